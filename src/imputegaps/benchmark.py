@@ -0,0 +1,414 @@
+"""
+
+This module provides a benchmark suite of the imputation on synthetic survey records.
+
+The records are generated with a chosen number of rows, number and skew of the strata, number of
+variables, missing rate, mix of variable types, share of filtered variables and depth of
+drop_dimensions. Every case is imputed with every imputation method, with and without
+track_imputed, and the wall time and peak memory are written to a JSON file which can be compared
+with the results of another version::
+
+    python -m imputegaps.benchmark --output results.json
+    python -m imputegaps.benchmark --output new.json --compare results.json
+
+Functions:
+----------
+
+make_survey_records:
+    Generate synthetic survey records with gaps, and the settings of their variables.
+imputation_methods_for:
+    Make the imputation methods which impute all variable types with one method.
+measure:
+    Measure the wall time and the peak memory of a function.
+run_benchmarks:
+    Impute the records of each case with each method and measure the time and memory.
+compare_results:
+    Compare the results of two benchmark runs case by case.
+main:
+    Run the benchmarks from the command line and write the results as JSON.
+"""
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from imputegaps import __version__, jit, logger
+from imputegaps.impute_gaps import ImputeGaps
+
+METHODS = ("mean", "median", "mode", "pick", "nan", "pick1")
+DEFAULT_DTYPE_MIX = {"float": 0.6, "int": 0.2, "dict": 0.1, "bool": 0.1}
+
+# the base case and the cases which each vary one of its parameters
+BENCHMARK_CASES = {
+    "base": {},
+    "many_rows": {"number_of_records": 200_000},
+    "many_strata": {"strata": (200, 50)},
+    "skewed_strata": {"strata_skew": 1.5},
+    "wide": {"number_of_variables": 100},
+    "sparse": {"missing_rate": 0.8},
+    "categorical": {"dtype_mix": {"float": 0.2, "dict": 0.6, "bool": 0.2}},
+    "filtered": {"filter_rate": 1.0},
+    "deep": {"strata": (10, 5, 4, 3)},
+    "no_drop_dimensions": {"drop_dimensions": False},
+}
+BASE_CASE = {
+    "number_of_records": 20_000,
+    "strata": (20, 10),
+    "strata_skew": 0.0,
+    "number_of_variables": 10,
+    "missing_rate": 0.3,
+    "dtype_mix": DEFAULT_DTYPE_MIX,
+    "filter_rate": 0.2,
+    "drop_dimensions": True,
+}
+
+
+def make_survey_records(
+    number_of_records: int = 20_000,
+    strata: tuple = (20, 10),
+    strata_skew: float = 0.0,
+    number_of_variables: int = 10,
+    missing_rate: float = 0.3,
+    dtype_mix: dict | None = None,
+    filter_rate: float = 0.2,
+    seed: int = 0,
+) -> tuple:
+    """
+    Generate synthetic survey records with gaps, and the settings of their variables.
+
+    Parameters
+    ----------
+    number_of_records: int
+        Number of records.
+    strata: tuple
+        Number of categories of each group_by variable, the most important one first. The length
+        is the depth of drop_dimensions.
+    strata_skew: float
+        Exponent of the Zipf-like distribution of the records over the categories. 0 gives
+        categories of equal size, larger values give a few large and many small strata.
+    number_of_variables: int
+        Number of variables to impute.
+    missing_rate: float
+        Fraction of missing values of each variable.
+    dtype_mix: dict
+        Fraction of the variables per type: 'float' (float64), 'int' (Int32), 'dict' (category)
+        and 'bool' (Int8). Defaults to DEFAULT_DTYPE_MIX.
+    filter_rate: float
+        Fraction of the variables which are only imputed for the records with internet == 1.
+    seed: int
+        Seed of the generator, the same seed gives the same records.
+
+    Returns
+    -------
+    tuple:
+        (records_df, variables, group_by): the records indexed by be_id, the settings per variable
+        and the names of the group_by variables.
+    """
+    rng = np.random.default_rng(seed)
+    dtype_mix = DEFAULT_DTYPE_MIX if dtype_mix is None else dtype_mix
+
+    records = {"be_id": np.arange(number_of_records)}
+    group_by = []
+    for index, number_of_categories in enumerate(strata):
+        weights = 1.0 / np.arange(1, number_of_categories + 1) ** strata_skew
+        name = f"key{index}"
+        records[name] = rng.choice(
+            np.array([f"{name}_{category}" for category in range(number_of_categories)], dtype=object),
+            size=number_of_records,
+            p=weights / weights.sum(),
+        )
+        group_by.append(name)
+    records["internet"] = rng.choice([0, 1], size=number_of_records, p=[0.3, 0.7])
+
+    types = list(dtype_mix)
+    fractions = np.array([dtype_mix[var_type] for var_type in types], dtype=float)
+    variable_types = rng.choice(types, size=number_of_variables, p=fractions / fractions.sum())
+    variables = {}
+    for index, var_type in enumerate(variable_types):
+        col_name = f"var{index}"
+        mask_is_na = rng.random(number_of_records) < missing_rate
+        if var_type == "float":
+            values = np.round(rng.lognormal(4, 1, size=number_of_records), 1)
+            values[mask_is_na] = np.nan
+        elif var_type == "int":
+            values = pd.array(rng.poisson(20, size=number_of_records), dtype="Int32")
+            values[mask_is_na] = pd.NA
+        elif var_type == "bool":
+            values = pd.array(rng.choice([0, 1], size=number_of_records), dtype="Int8")
+            values[mask_is_na] = pd.NA
+        elif var_type == "dict":
+            values = pd.Categorical(rng.choice(list("abcdefgh"), size=number_of_records))
+            values[mask_is_na] = np.nan
+        else:
+            raise ValueError(f"Unknown variable type in dtype_mix: {var_type}.")
+        records[col_name] = values
+        variables[col_name] = {"type": str(var_type)}
+        if rng.random() < filter_rate:
+            variables[col_name]["filter"] = "internet"
+
+    records_df = pd.DataFrame(records).set_index("be_id")
+    return records_df, variables, group_by
+
+
+def imputation_methods_for(how: str, variables: dict) -> dict:
+    """
+    Make the imputation methods which impute all variable types with one method.
+
+    Parameters
+    ----------
+    how: str
+        Imputation method.
+    variables: dict
+        Settings per variable as returned by :func:`make_survey_records`.
+
+    Returns
+    -------
+    dict:
+        Imputation methods per type. The mean and median can not be taken of dict variables, so
+        these are imputed with the mode.
+    """
+    types = sorted({properties["type"] for properties in variables.values()})
+    if how in ("mean", "median"):
+        imputation_methods = {how: [var_type for var_type in types if var_type != "dict"]}
+        if "dict" in types:
+            imputation_methods["mode"] = ["dict"]
+        return imputation_methods
+    return {how: types}
+
+
+def measure(function, repeat: int = 1) -> dict:
+    """
+    Measure the wall time and the peak memory of a function.
+
+    Parameters
+    ----------
+    function: callable
+        Function without arguments.
+    repeat: int
+        Number of timed calls, of which the fastest is reported.
+
+    Returns
+    -------
+    dict:
+        'wall_time' in seconds and 'peak_memory' in bytes.
+
+    Notes
+    -----
+    The peak memory is the peak of the memory allocated by Python and numpy during one extra call,
+    as traced by tracemalloc. Tracing slows the call down, so that call is not timed.
+    """
+    wall_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        wall_times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"wall_time": min(wall_times), "peak_memory": peak_memory}
+
+
+def run_benchmarks(
+    cases: dict | None = None,
+    methods: tuple = METHODS,
+    scale: float = 1.0,
+    repeat: int = 1,
+    seed: int = 0,
+) -> list:
+    """
+    Impute the records of each case with each method and measure the time and memory.
+
+    Parameters
+    ----------
+    cases: dict
+        Parameters per case name which replace those of BASE_CASE. Defaults to BENCHMARK_CASES.
+    methods: tuple
+        Imputation methods to measure.
+    scale: float
+        Factor of the number of records of every case, for instance 0.01 for a quick check.
+    repeat: int
+        Number of timed runs per measurement, of which the fastest is reported.
+    seed: int
+        Seed of the records and of the imputation.
+
+    Returns
+    -------
+    list:
+        One dictionary per case, method and track_imputed with the parameters of the case, the
+        wall time, the peak memory and the number of imputed values.
+    """
+    cases = BENCHMARK_CASES if cases is None else cases
+    results = []
+    for case_name, case in cases.items():
+        parameters = BASE_CASE | case
+        parameters["number_of_records"] = max(int(parameters["number_of_records"] * scale), 1)
+        drop_dimensions = parameters.pop("drop_dimensions")
+        records_df, variables, group_by = make_survey_records(**parameters, seed=seed)
+        number_of_gaps = int(records_df[list(variables)].isna().to_numpy().sum())
+        logger.info("Benchmark case %s with %d records and %d gaps", case_name, len(records_df), number_of_gaps)
+
+        for how in methods:
+            for track_imputed in (False, True):
+                impute_gaps = ImputeGaps(
+                    index_key="be_id",
+                    variables=variables,
+                    imputation_methods=imputation_methods_for(how, variables),
+                    seed=seed,
+                    track_imputed=track_imputed,
+                )
+                imputed = {}
+
+                def impute():
+                    imputed["records_df"] = impute_gaps.impute_gaps(
+                        records_df, group_by=group_by, drop_dimensions=drop_dimensions
+                    )
+
+                measurement = measure(impute, repeat=repeat)
+                number_of_imputed = number_of_gaps - int(imputed["records_df"][list(variables)].isna().to_numpy().sum())
+                results.append(
+                    {
+                        "case": case_name,
+                        "method": how,
+                        "track_imputed": track_imputed,
+                        **{
+                            key: list(value) if isinstance(value, tuple) else value for key, value in parameters.items()
+                        },
+                        "drop_dimensions": drop_dimensions,
+                        "number_of_gaps": number_of_gaps,
+                        "number_of_imputed": number_of_imputed,
+                        **measurement,
+                    }
+                )
+                logger.info(
+                    "- %s (track_imputed=%s): %.3f s, %.1f MB",
+                    how,
+                    track_imputed,
+                    measurement["wall_time"],
+                    measurement["peak_memory"] / 2**20,
+                )
+    return results
+
+
+def compare_results(baseline: dict, current: dict) -> pd.DataFrame:
+    """
+    Compare the results of two benchmark runs case by case.
+
+    Parameters
+    ----------
+    baseline: dict
+        Contents of the JSON file of the reference run, as written by :func:`main`.
+    current: dict
+        Contents of the JSON file of the new run.
+
+    Returns
+    -------
+    pd.DataFrame:
+        One row per case, method and track_imputed which both runs measured, with the wall time
+        and peak memory of both runs and their ratio (current / baseline).
+    """
+    keys = ["case", "method", "track_imputed"]
+    columns = keys + ["wall_time", "peak_memory"]
+    comparison = pd.merge(
+        pd.DataFrame(baseline["results"])[columns],
+        pd.DataFrame(current["results"])[columns],
+        on=keys,
+        suffixes=("_baseline", "_current"),
+    )
+    for name in ("wall_time", "peak_memory"):
+        comparison[f"{name}_ratio"] = comparison[f"{name}_current"] / comparison[f"{name}_baseline"]
+    return comparison
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args (List[str]): command line parameters as a list of strings
+          (for example, ``["--help"]``).
+
+    Returns:
+
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the imputation on synthetic survey records")
+    parser.add_argument("--output", help="Name of the JSON file with the results. If not given, written to stdout")
+    parser.add_argument("--compare", help="Name of the JSON file of an earlier run to compare the results with")
+    parser.add_argument(
+        "--cases",
+        help=f"Cases to run, separated by a comma. Defaults to all: {','.join(BENCHMARK_CASES)}",
+    )
+    parser.add_argument("--methods", default=",".join(METHODS), help="Imputation methods to run, separated by a comma")
+    parser.add_argument("--scale", type=float, default=1.0, help="Factor of the number of records of every case")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of timed runs of which the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the records and of the imputation")
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO,
+    )
+    return parser.parse_args(args)
+
+
+def main(args):
+    """
+    Run the benchmarks and write the results as JSON, compared to an earlier run if asked.
+    """
+    args = parse_args(args)
+    if args.loglevel is not None:
+        logger.setLevel(args.loglevel)
+
+    cases = BENCHMARK_CASES
+    if args.cases:
+        cases = {case_name: BENCHMARK_CASES[case_name] for case_name in args.cases.split(",")}
+
+    results = run_benchmarks(
+        cases, methods=tuple(args.methods.split(",")), scale=args.scale, repeat=args.repeat, seed=args.seed
+    )
+    report = {
+        "version": __version__,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "numba": jit.numba.__version__ if jit.USE_NUMBA else None,
+        "scale": args.scale,
+        "repeat": args.repeat,
+        "results": results,
+    }
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w", encoding="utf-8") as stream:
+            json.dump(report, stream, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, encoding="utf-8") as stream:
+            baseline = json.load(stream)
+        with pd.option_context("display.width", 160, "display.max_rows", None):
+            print(compare_results(baseline, report).to_string(index=False, float_format="{:.3f}".format))
+
+
+def run():
+    """Calls :func:`main` passing the CLI arguments extracted from :obj:`sys.argv`"""
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
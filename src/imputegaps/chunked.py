@@ -0,0 +1,538 @@
+"""
+
+This module provides the imputation of records which do not fit in memory at once.
+
+The records are read in chunks twice. The first pass collects the statistics of the donors per
+stratum of each level of drop_dimensions, the second pass fills the gaps chunk by chunk. The
+statistics only depend on the originally observed values, as with *impute_gaps(rollup=True)*.
+
+The statistics can be converted to one table with a row per stratum and back, which is how
+*ImputeGaps.save* and *ImputeGaps.load* store a fitted imputer.
+
+Classes:
+--------
+
+ChunkedImputer:
+    Collects the statistics per stratum from chunks of records and imputes the chunks with them.
+
+Functions:
+----------
+
+impute_gaps_chunked:
+    Impute the chunks of records in two passes.
+"""
+
+import logging
+from collections.abc import Callable, Iterable, Iterator
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+from imputegaps.impute_gaps import fill_positions, numeric_column
+from imputegaps.kernels import GROUPED_STATISTICS
+from imputegaps.masks import MaskEvaluator
+from imputegaps.sketches import merge_sketches, sketch_quantiles
+from imputegaps.streams import hash_uniforms
+
+logger = logging.getLogger(__name__)
+
+DataFrameType = Union["pd.DataFrame", None]
+
+# name of the key of the level of the whole column, which has one stratum
+ALL_RECORDS = "_all_records"
+VALUE = "_value"
+PRIORITY = "_priority"
+# name of the column with the number of group_by variables of the level in the statistics table
+LEVEL = "_level"
+MEAN = "_mean"
+WEIGHT = "_weight"
+# level of the quantile sketches of the approximate median, which keep missing keys
+SKETCH = None
+
+# number of partial statistics which are kept before they are combined
+MAX_PARTS = 32
+
+
+def level_keys(records_df: DataFrameType, level: tuple) -> list:
+    """
+    Get the keys of the strata of a level.
+
+    Parameters
+    ----------
+    records_df: DataFrameType
+        Records with the group_by variables as columns.
+    level: tuple
+        Names of the group_by variables of the level. An empty tuple is the whole column.
+
+    Returns
+    -------
+    list:
+        List with one pd.Series per variable of the level, or one constant pd.Series for the
+        whole column.
+    """
+    if not level:
+        return [pd.Series(np.zeros(len(records_df), dtype=np.int64), index=records_df.index, name=ALL_RECORDS)]
+    return [records_df[name] for name in level]
+
+
+def key_index(keys: list) -> pd.Index:
+    """
+    Combine the keys of a level into an index with one entry per record.
+    """
+    if len(keys) == 1:
+        return pd.Index(keys[0])
+    return pd.MultiIndex.from_arrays(keys)
+
+
+class ChunkedImputer:
+    """
+    Impute records which are read in chunks, in two passes over the chunks.
+
+    Arguments
+    ---------
+    imputer: ImputeGaps
+        Imputer with the settings of the variables, the min_threshold and the seed.
+    group_by: list
+        The variables by which the records should be grouped. The first variable is the most
+        important one.
+    drop_dimensions: bool
+        If True, gaps which can not be imputed in the strata of all group_by variables are
+        imputed in the strata of the coarser levels, until finally the whole column is used.
+    reservoir_size: int
+        Maximum number of donors per stratum which are kept for pick. The donors are a uniform
+        sample of all donors of the stratum.
+
+    Notes
+    -----
+    Call :meth:`update` for all chunks, then :meth:`finalize` and then :meth:`transform` for all
+    chunks. The memory needed grows with the number of strata and, for median and mode, with the
+    number of distinct values per stratum, but not with the number of records. With the
+    approximate option of the imputer, the median is collected in quantile sketches of at most
+    1 / median_error centroids per stratum instead.
+
+    The filter and set_nan_eval expressions are evaluated on the original values of a chunk in the
+    first pass. The group_by variables must have the same dtype in all chunks.
+
+    The priorities of the reservoir and the donors drawn by pick are hashed from the seed of the
+    imputer, the variable and the identifier of the record (the index_key column, or else the
+    index of the chunk). So the donors of a gap do not depend on the chunks, on the other records
+    which are transformed or on earlier calls of :meth:`transform`.
+    """
+
+    def __init__(self, imputer, group_by: list, drop_dimensions: bool = False, reservoir_size: int = 1000):
+        self.imputer = imputer
+        self.group_by = list(group_by)
+        self.levels = [tuple(self.group_by[:max_dim]) for max_dim in range(len(self.group_by), -1, -1)]
+        if not drop_dimensions:
+            self.levels = self.levels[:1]
+        self.reservoir_size = reservoir_size
+        self.min_threshold = max(imputer.min_threshold or 1, 1)
+
+        self.statistics = {}
+        self.donors = {}
+        self._parts = {}
+        self._reservoirs = {}
+        self.number_of_records = 0
+
+    def _variable_settings(self, col_name: str) -> dict | None:
+        """
+        Get the settings of a variable from the plan of the imputer.
+        """
+        if col_name == self.imputer.index_key or col_name in self.group_by:
+            return None
+        return self.imputer.plan.settings_for(col_name)
+
+    def _record_ids(self, records_df: DataFrameType) -> np.ndarray:
+        """
+        Get the identifiers of the records, which key their random numbers.
+        """
+        if self.imputer.index_key in records_df.columns:
+            return records_df[self.imputer.index_key].to_numpy()
+        return records_df.index.to_numpy()
+
+    def update(self, records_df: DataFrameType):
+        """
+        Collect the statistics of the donors of a chunk (pass one).
+
+        Parameters
+        ----------
+        records_df: DataFrameType
+            Chunk of records with the group_by variables as columns.
+        """
+        self.number_of_records += len(records_df)
+        masks = MaskEvaluator(records_df)
+
+        for col_name in records_df.columns:
+            settings = self._variable_settings(col_name)
+            if settings is None:
+                continue
+            how = settings["how"]
+            column = records_df[col_name]
+            if how in GROUPED_STATISTICS:
+                column = numeric_column(column)
+                if column is None:
+                    logger.debug("Can not take the %s of the non-numeric variable %s", how, col_name)
+                    continue
+
+            mask_to_impute = self.imputer._mask_to_impute(masks, col_name, settings)
+            donor_mask = column.notnull().to_numpy() & mask_to_impute
+            donor_keys = records_df.loc[donor_mask, self.group_by]
+            values = column[donor_mask]
+
+            if how == "median" and self.imputer.approximate:
+                # the sketches of the coarser levels are merged from these in finalize
+                self._add_part(col_name, SKETCH, self._sketch_part(donor_keys, values))
+                continue
+
+            for level in self.levels:
+                keys = level_keys(donor_keys, level)
+                if how == "mean":
+                    part = values.groupby(keys).agg(["count", "sum"])
+                elif how in ("median", "mode"):
+                    part = values.groupby(keys + [values.rename(VALUE)]).size()
+                else:
+                    part = values.groupby(keys).size()
+                    if how == "pick":
+                        donor_ids = self._record_ids(records_df)[donor_mask]
+                        self._update_reservoir(col_name, level, keys, values, donor_ids)
+                self._add_part(col_name, level, part)
+
+    def _add_part(self, col_name: str, level: tuple, part):
+        """
+        Add the statistics of a chunk, and combine them once there are too many of them.
+        """
+        parts = self._parts.setdefault((col_name, level), [])
+        parts.append(part)
+        if len(parts) > MAX_PARTS:
+            combine = self._combine_sketches if level is SKETCH else self._combine_parts
+            self._parts[(col_name, level)] = [combine(parts)]
+
+    @staticmethod
+    def _combine_parts(parts: list):
+        combined = pd.concat(parts)
+        return combined.groupby(level=list(range(combined.index.nlevels))).sum()
+
+    def _sketch_part(self, donor_keys: DataFrameType, values: pd.Series) -> DataFrameType:
+        """
+        Sketch the donors of a chunk per combination of the group_by keys, including missing keys.
+        """
+        sketch_df = donor_keys.reset_index(drop=True)
+        sketch_df[MEAN] = values.to_numpy(dtype=np.float64)
+        sketch_df[WEIGHT] = 1.0
+        return self._combine_sketches([sketch_df])
+
+    def _combine_sketches(self, parts: list, level: tuple | None = None) -> DataFrameType:
+        """
+        Merge the centroids of the sketches per stratum of a level, by default of all keys.
+        """
+        combined = pd.concat(parts, ignore_index=True)
+        keys = level_keys(combined, self.group_by if level is None else level)
+        groups = combined[MEAN].groupby(keys, dropna=level is not None)
+        # the centroids of which a key of the level is missing are not part of any stratum
+        codes = groups.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+        keep = codes >= 0
+        sketch_codes, means, weights = merge_sketches(
+            codes[keep],
+            combined[MEAN].to_numpy()[keep],
+            combined[WEIGHT].to_numpy()[keep],
+            error=self.imputer.median_error,
+        )
+        strata = groups.size().index
+        if level is not None:
+            return strata, (sketch_codes, means, weights)
+        sketch_df = strata.to_frame(index=False).iloc[sketch_codes].reset_index(drop=True)
+        sketch_df[MEAN] = means
+        sketch_df[WEIGHT] = weights
+        return sketch_df
+
+    def _update_reservoir(self, col_name: str, level: tuple, keys: list, values: pd.Series, donor_ids: np.ndarray):
+        """
+        Keep the donors with the smallest random priorities per stratum, which are a uniform sample.
+        """
+        key_names = [key.name for key in keys]
+        sample = pd.DataFrame({key.name: key.to_numpy() for key in keys})
+        sample[VALUE] = values.to_numpy()
+        sample[PRIORITY] = hash_uniforms(donor_ids, f"{self.imputer.stream_seed}:{col_name}:{PRIORITY}")
+        sample = sample.dropna(subset=key_names)
+
+        reservoir = self._reservoirs.get((col_name, level))
+        if reservoir is not None:
+            sample = pd.concat([reservoir, sample], ignore_index=True)
+        sample = sample.sort_values(PRIORITY, kind="stable")
+        self._reservoirs[(col_name, level)] = sample.groupby(key_names, sort=False).head(self.reservoir_size)
+
+    def finalize(self):
+        """
+        Compute the statistics per stratum from the collected statistics.
+
+        Notes
+        -----
+        For each variable and level, *statistics* gets a DataFrame indexed by the keys of the
+        strata with the number of donors ('count') and the imputed value ('value'), or, for pick,
+        the position and the size of the sample of the donors in *donors*.
+        """
+        for (col_name, level), parts in self._parts.items():
+            if level is SKETCH:
+                self._finalize_sketches(col_name, self._combine_sketches(parts))
+                continue
+            how = self._variable_settings(col_name)["how"]
+            combined = self._combine_parts(parts)
+
+            if how == "mean":
+                table = pd.DataFrame({"count": combined["count"], "value": combined["sum"] / combined["count"]})
+            elif how in ("median", "mode"):
+                table = self._value_count_statistics(combined, how)
+            else:
+                table = combined.rename("count").to_frame()
+                reservoir = self._reservoirs.get((col_name, level))
+                if how == "pick" and reservoir is not None:
+                    key_names = list(reservoir.columns[:-2])
+                    reservoir = reservoir.sort_values(key_names, kind="stable")
+                    sizes = reservoir.groupby(key_names).size().reindex(table.index, fill_value=0)
+                    table["size"] = sizes.to_numpy()
+                    table["start"] = np.cumsum(table["size"].to_numpy()) - table["size"].to_numpy()
+                    self.donors[(col_name, level)] = reservoir[VALUE].to_numpy()
+
+            self.statistics[(col_name, level)] = table
+
+        self._parts = {}
+        self._reservoirs = {}
+
+    def _finalize_sketches(self, col_name: str, sketch_df: DataFrameType):
+        """
+        Merge the sketches of each level and estimate the median per stratum.
+        """
+        for level in self.levels:
+            strata, sketches = self._combine_sketches([sketch_df], level=level)
+            medians, counts = sketch_quantiles(*sketches, number_of_strata=len(strata))
+            self.statistics[(col_name, level)] = pd.DataFrame({"count": counts, "value": medians}, index=strata)
+
+    @staticmethod
+    def _value_count_statistics(value_counts: pd.Series, how: str) -> DataFrameType:
+        """
+        Compute the number of donors and the median or the mode per stratum from the value counts.
+        """
+        key_levels = list(range(value_counts.index.nlevels - 1))
+        value_counts = value_counts[value_counts > 0].sort_index()
+        groups = value_counts.groupby(level=key_levels)
+        counts = groups.sum()
+
+        if how == "mode":
+            # the values are sorted, so the first value with the highest frequency is the smallest
+            mode_index = groups.idxmax()
+            values = pd.MultiIndex.from_tuples(mode_index.to_numpy()).get_level_values(-1)
+            return pd.DataFrame({"count": counts, "value": np.asarray(values)}, index=counts.index)
+
+        values = value_counts.index.get_level_values(-1).to_numpy(dtype=np.float64)
+        cumulative = groups.cumsum().to_numpy()
+        totals = groups.transform("sum").to_numpy()
+        codes = groups.ngroup().to_numpy()
+
+        def order_statistic(rank: np.ndarray) -> np.ndarray:
+            # value of the first row of each stratum of which the cumulative count exceeds the rank
+            selection = np.flatnonzero(cumulative > rank)
+            first = np.ones(selection.size, dtype=bool)
+            first[1:] = codes[selection[1:]] != codes[selection[:-1]]
+            return values[selection[first]]
+
+        lower = order_statistic((totals - 1) // 2)
+        upper = order_statistic(totals // 2)
+        return pd.DataFrame({"count": counts, "value": (lower + upper) / 2}, index=counts.index)
+
+    def to_frame(self) -> DataFrameType:
+        """
+        Convert the statistics of all variables and levels to one table.
+
+        Returns
+        -------
+        DataFrameType:
+            Table with the group_by variables, the level and, per variable, the number of donors
+            ('<variable>.count'), the imputed value ('<variable>.value') or, for pick, the list of
+            donors ('<variable>.donors') as columns. There is one row per stratum of each level.
+            The group_by variables which are not part of the level are empty.
+        """
+        frames = []
+        for level in self.levels:
+            columns = {}
+            for (col_name, table_level), table in self.statistics.items():
+                if table_level != level:
+                    continue
+                columns[f"{col_name}.count"] = table["count"]
+                if "value" in table.columns:
+                    columns[f"{col_name}.value"] = table["value"]
+                donors = self.donors.get((col_name, level))
+                if donors is not None and len(table) > 0:
+                    samples = np.split(donors, table["start"].to_numpy()[1:])
+                    columns[f"{col_name}.donors"] = pd.Series(samples, index=table.index)
+            if not columns:
+                continue
+            frame = pd.DataFrame(columns).reset_index().drop(columns=ALL_RECORDS, errors="ignore")
+            for name in self.group_by[len(level) :]:
+                frame[name] = None
+            frame[LEVEL] = len(level)
+            frames.append(frame)
+
+        if not frames:
+            return pd.DataFrame(columns=self.group_by + [LEVEL])
+        statistics_df = pd.concat(frames, ignore_index=True)
+        count_columns = [name for name in statistics_df.columns if name.endswith(".count")]
+        statistics_df[count_columns] = statistics_df[count_columns].fillna(0).astype(np.int64)
+        other_columns = [name for name in statistics_df.columns if name not in self.group_by and name != LEVEL]
+        return statistics_df[self.group_by + [LEVEL] + other_columns]
+
+    @classmethod
+    def from_frame(cls, imputer, statistics_df: DataFrameType) -> "ChunkedImputer":
+        """
+        Create the imputer from the table of :meth:`to_frame`.
+
+        Parameters
+        ----------
+        imputer: ImputeGaps
+            Imputer with the settings of the variables, the min_threshold and the seed.
+        statistics_df: DataFrameType
+            Table with the statistics per stratum. The columns before the level are the group_by
+            variables.
+
+        Returns
+        -------
+        ChunkedImputer:
+            Imputer of which the statistics are final, to be used with :meth:`transform`.
+        """
+        group_by = list(statistics_df.columns[: statistics_df.columns.get_loc(LEVEL)])
+        depths = statistics_df[LEVEL].to_numpy()
+        chunked_imputer = cls(imputer, group_by=group_by, drop_dimensions=len(np.unique(depths)) > 1)
+        variables = [name[: -len(".count")] for name in statistics_df.columns if name.endswith(".count")]
+
+        for level in chunked_imputer.levels:
+            rows = statistics_df[depths == len(level)]
+            index = key_index(level_keys(rows.reset_index(drop=True), level))
+            for col_name in variables:
+                if chunked_imputer._variable_settings(col_name) is None:
+                    continue
+                counts = rows[f"{col_name}.count"].to_numpy()
+                present = counts > 0
+                table = pd.DataFrame({"count": counts[present]}, index=index[present])
+                if f"{col_name}.value" in rows.columns:
+                    table["value"] = rows[f"{col_name}.value"].to_numpy()[present]
+                if f"{col_name}.donors" in rows.columns:
+                    samples = list(rows[f"{col_name}.donors"].to_numpy()[present])
+                    sizes = np.array([len(sample) for sample in samples], dtype=np.int64)
+                    table["size"] = sizes
+                    table["start"] = np.cumsum(sizes) - sizes
+                    chunked_imputer.donors[(col_name, level)] = (
+                        np.concatenate(samples) if samples else np.array([], dtype=np.float64)
+                    )
+                chunked_imputer.statistics[(col_name, level)] = table
+
+        return chunked_imputer
+
+    def transform(self, records_df: DataFrameType) -> DataFrameType:
+        """
+        Impute the gaps of a chunk with the statistics of pass one (pass two).
+
+        Parameters
+        ----------
+        records_df: DataFrameType
+            Chunk of records with the group_by variables as columns.
+
+        Returns
+        -------
+        DataFrameType:
+            The chunk with imputed values.
+        """
+        masks = MaskEvaluator(records_df)
+        record_ids = self._record_ids(records_df)
+
+        for col_name in records_df.columns:
+            settings = self._variable_settings(col_name)
+            if settings is None or (col_name, self.levels[-1]) not in self.statistics:
+                continue
+            how = settings["how"]
+            column = records_df[col_name]
+
+            mask_to_impute = self.imputer._mask_to_impute(masks, col_name, settings)
+            remaining = np.flatnonzero(column.isnull().to_numpy() & mask_to_impute)
+            if remaining.size == 0 or self.statistics[(col_name, self.levels[-1])]["count"].sum() == 0:
+                continue
+
+            positions = []
+            imputed_values = []
+            for level in self.levels:
+                table = self.statistics[(col_name, level)]
+                keys = level_keys(records_df.iloc[remaining], level)
+                has_key = np.logical_and.reduce([key.notnull().to_numpy() for key in keys])
+                if how in ("nan", "pick1"):
+                    # methods without donors fill each gap which belongs to a stratum
+                    selection = has_key
+                    values = np.full(selection.sum(), fill_value=0 if how == "nan" else 1)
+                else:
+                    index = table.index.get_indexer(key_index(keys))
+                    index[~has_key] = -1
+                    counts = table["count"].to_numpy()
+                    selection = index >= 0
+                    selection[selection] = counts[index[selection]] >= self.min_threshold
+                    index = index[selection]
+                    if how == "pick":
+                        gap_ids = record_ids[remaining[selection]]
+                        uniforms = hash_uniforms(gap_ids, f"{self.imputer.stream_seed}:{col_name}")
+                        offsets = (uniforms * table["size"].to_numpy()[index]).astype(np.int64)
+                        values = self.donors[(col_name, level)][table["start"].to_numpy()[index] + offsets]
+                    else:
+                        values = table["value"].to_numpy()[index]
+
+                positions.append(remaining[selection])
+                imputed_values.append(values)
+                remaining = remaining[~selection]
+                if remaining.size == 0:
+                    break
+
+            positions = np.concatenate(positions)
+            if positions.size > 0:
+                records_df[col_name] = fill_positions(column, positions, np.concatenate(imputed_values))
+                masks.invalidate(col_name)
+            if remaining.size > 0:
+                logger.debug("Could not impute %d gaps of %s in this chunk", remaining.size, col_name)
+
+        return records_df
+
+
+def impute_gaps_chunked(
+    imputer,
+    read_chunks: Callable[[], Iterable[DataFrameType]],
+    group_by: list,
+    drop_dimensions: bool = False,
+    reservoir_size: int = 1000,
+) -> Iterator[DataFrameType]:
+    """
+    Impute records which are read in chunks, in two passes over the chunks.
+
+    Parameters
+    ----------
+    imputer: ImputeGaps
+        Imputer with the settings of the variables.
+    read_chunks: Callable
+        Function without arguments which returns an iterable over the chunks of records. It is
+        called twice and must give the same chunks each time.
+    group_by: list
+        The variables by which the records should be grouped.
+    drop_dimensions: bool
+        If True, impute the gaps which remain in the strata of the coarser levels.
+    reservoir_size: int
+        Maximum number of donors per stratum which are kept for pick.
+
+    Yields
+    ------
+    DataFrameType:
+        The chunks with imputed values.
+    """
+    chunked_imputer = ChunkedImputer(
+        imputer, group_by=group_by, drop_dimensions=drop_dimensions, reservoir_size=reservoir_size
+    )
+    for records_df in read_chunks():
+        chunked_imputer.update(records_df)
+    chunked_imputer.finalize()
+    logger.info("Collected the statistics of %d records", chunked_imputer.number_of_records)
+
+    for records_df in read_chunks():
+        yield chunked_imputer.transform(records_df)
@@ -0,0 +1,437 @@
+"""
+
+This module provides reading and writing of the records in the file format given by the extension.
+
+Supported are Parquet (.parquet, .pq), Feather / Arrow IPC (.feather, .arrow, .ipc) and CSV
+(.csv), which may be compressed (.csv.gz, .csv.bz2, .csv.xz, .csv.zip, .csv.zst). Parquet and
+Feather need pyarrow.
+
+Classes:
+--------
+
+RecordsWriter:
+    Writes chunks of records to one file.
+
+Functions:
+----------
+
+file_format:
+    Get the file format from the extension of a file name.
+needed_columns:
+    Get the names of the columns which are needed for the imputation.
+variable_dtypes:
+    Get the data type of each variable from the type in the variables metadata.
+read_records:
+    Read the records of a file, optionally only some of the columns.
+read_records_in_chunks:
+    Read the records of a file in chunks.
+write_records:
+    Write the records to a file.
+"""
+
+import logging
+import sys
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+
+from imputegaps.plan import ImputationPlan
+
+logger = logging.getLogger(__name__)
+
+DataFrameType = Union["pd.DataFrame", None]
+
+FILE_FORMATS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+    ".ipc": "feather",
+    ".csv": "csv",
+}
+CSV_COMPRESSIONS = (".gz", ".bz2", ".xz", ".zip", ".zst")
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:
+    PYARROW_AVAILABLE = False
+else:
+    PYARROW_AVAILABLE = True
+
+
+def file_format(filename) -> str:
+    """
+    Get the file format from the extension of a file name.
+
+    Parameters
+    ----------
+    filename: str or Path
+        Name of the file.
+
+    Returns
+    -------
+    str:
+        'parquet', 'feather' or 'csv'.
+
+    Raises
+    ------
+    ValueError:
+        If the extension is not known.
+    """
+    suffixes = [suffix.lower() for suffix in Path(filename).suffixes]
+    if len(suffixes) > 1 and suffixes[-1] in CSV_COMPRESSIONS:
+        # the compression of a CSV file is inferred by pandas
+        suffixes = suffixes[:-1]
+    try:
+        return FILE_FORMATS[suffixes[-1]]
+    except (IndexError, KeyError):
+        raise ValueError(f"Unknown file format of {filename}. Use one of {', '.join(FILE_FORMATS)}.") from None
+
+
+def import_pyarrow():
+    """
+    Import pyarrow, which is needed for Parquet and Feather files.
+    """
+    try:
+        import pyarrow
+    except ImportError as err:
+        raise ImportError("Reading and writing Parquet or Feather files needs pyarrow.") from err
+    return pyarrow
+
+
+def needed_columns(index_key: str | None, group_by: list, plan: ImputationPlan) -> set | None:
+    """
+    Get the names of the columns which are needed for the imputation.
+
+    Parameters
+    ----------
+    index_key: str
+        Name of the variable by which a record is identified.
+    group_by: list
+        The variables by which the records are grouped.
+    plan: ImputationPlan
+        The imputation plan of the variables, for instance *ImputeGaps.plan*.
+
+    Returns
+    -------
+    set or None:
+        Names of the index key, the group_by variables, the variables and the sources of the
+        variables which are imputed, which are the columns used in their filter (or impute_only)
+        and set_nan_eval expressions. None if an expression can not be parsed, in which case all
+        columns are needed.
+    """
+    columns = set(group_by) | set(plan.variables)
+    if index_key is not None:
+        columns.add(index_key)
+    for col_name in plan.variables:
+        settings = plan.settings_for(col_name)
+        if settings is None:
+            continue
+        if settings["sources"] is None:
+            logger.debug("Read all columns, because an expression of %s can not be parsed", col_name)
+            return None
+        columns |= settings["sources"]
+    return columns
+
+
+def variable_dtypes(
+    variables: dict,
+    float_dtype: str = "float64",
+    int_dtype: str = "Int32",
+    bool_dtype: str = "Int8",
+) -> dict:
+    """
+    Get the data type of each variable from the type in the variables metadata.
+
+    Parameters
+    ----------
+    variables: dict
+        Dictionary with information about the variables, with a 'type' per variable.
+    float_dtype: str
+        Data type of the float variables, 'float64' or 'float32'.
+    int_dtype: str
+        Data type of the int variables, a nullable integer type.
+    bool_dtype: str
+        Data type of the bool variables, a nullable integer type. The values must be 0 or 1.
+
+    Returns
+    -------
+    dict:
+        Data type per variable name, to be passed to the readers. dict and str variables are
+        categories, of numbers if their codes are numbers. Variables of other types, such as date,
+        are left to the reader.
+
+    Notes
+    -----
+    The values of an int variable must fit in int_dtype. If the mean or median of an int variable is
+    imputed, the variable becomes a float variable, as when it was read as float.
+    """
+    type_dtypes = {
+        "dict": "category",
+        "str": "category",
+        "bool": bool_dtype,
+        "int": int_dtype,
+        "float": float_dtype,
+    }
+    dtypes = {}
+    for name, variable_properties in variables.items():
+        try:
+            dtypes[name] = type_dtypes[variable_properties.get("type")]
+        except KeyError:
+            logger.debug("No data type for %s of type %s", name, variable_properties.get("type"))
+    return dtypes
+
+
+def read_records(
+    filename,
+    columns: set | None = None,
+    sep: str = ";",
+    dtype: dict | None = None,
+    engine: str | None = None,
+) -> DataFrameType:
+    """
+    Read the records of a file, optionally only some of the columns.
+
+    Parameters
+    ----------
+    filename: str or Path
+        Name of the file. The format follows from the extension.
+    columns: set
+        Names of the columns to read. Names which are not in the file are ignored. All columns
+        are read if not given.
+    sep: str
+        Separator of a CSV file.
+    dtype: dict
+        Data type per column. For Parquet and Feather files, the columns are converted.
+    engine: str
+        Parser of a CSV file. Defaults to 'pyarrow' if pyarrow is installed, else 'c'.
+
+    Returns
+    -------
+    DataFrameType:
+        The records, with the columns in the order of the file.
+    """
+    fmt = file_format(filename)
+    if fmt == "csv":
+        if engine is None:
+            engine = "pyarrow" if PYARROW_AVAILABLE else "c"
+        usecols = None
+        if columns is not None:
+            # the pyarrow engine needs the names of the columns, so read the header first
+            header = pd.read_csv(filename, sep=sep, nrows=0).columns
+            usecols = [name for name in header if name in columns]
+        records_df = pd.read_csv(filename, sep=sep, usecols=usecols, dtype=reader_dtypes(dtype), engine=engine)
+        return convert_dtypes(records_df, dtype)
+
+    import_pyarrow()
+    selection = None if columns is None else [name for name in file_columns(filename) if name in columns]
+    if fmt == "parquet":
+        return convert_dtypes(pd.read_parquet(filename, columns=selection), dtype)
+    return convert_dtypes(pd.read_feather(filename, columns=selection), dtype)
+
+
+def file_columns(filename) -> list:
+    """
+    Get the names of the columns of a Parquet or Feather file from its schema.
+    """
+    import_pyarrow()
+    if file_format(filename) == "parquet":
+        import pyarrow.parquet as pq
+
+        return pq.read_schema(filename).names
+    import pyarrow.ipc as ipc
+
+    with ipc.open_file(filename) as reader:
+        return reader.schema.names
+
+
+def read_records_in_chunks(
+    filename,
+    chunksize: int,
+    columns: set | None = None,
+    sep: str = ";",
+    dtype: dict | None = None,
+) -> Iterator[DataFrameType]:
+    """
+    Read the records of a file in chunks.
+
+    Parameters
+    ----------
+    filename: str or Path
+        Name of the file. The format follows from the extension.
+    chunksize: int
+        Number of records per chunk. The batches of a Feather file are read as they are stored.
+    columns: set
+        Names of the columns to read. All columns are read if not given.
+    sep: str
+        Separator of a CSV file.
+    dtype: dict
+        Data type per column. For Parquet and Feather files, the columns are converted.
+
+    Yields
+    ------
+    DataFrameType:
+        The chunks of records.
+    """
+    fmt = file_format(filename)
+    if fmt == "csv":
+        usecols = None if columns is None else (lambda name: name in columns)
+        chunks = pd.read_csv(filename, sep=sep, usecols=usecols, dtype=reader_dtypes(dtype), chunksize=chunksize)
+        for chunk in chunks:
+            yield convert_dtypes(chunk, dtype)
+        return
+
+    import_pyarrow()
+    selection = None if columns is None else [name for name in file_columns(filename) if name in columns]
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        batches = pq.ParquetFile(filename).iter_batches(batch_size=chunksize, columns=selection)
+        for batch in batches:
+            yield convert_dtypes(batch.to_pandas(), dtype)
+    else:
+        import pyarrow.ipc as ipc
+
+        with ipc.open_file(filename) as reader:
+            for index in range(reader.num_record_batches):
+                batch = reader.get_batch(index)
+                if selection is not None:
+                    batch = batch.select(selection)
+                yield convert_dtypes(batch.to_pandas(), dtype)
+
+
+def reader_dtypes(dtype: dict | None) -> dict | None:
+    """
+    Get the data types which are passed to the CSV reader, which are all but the categories.
+    """
+    if not dtype:
+        return None
+    return {name: value for name, value in dtype.items() if value != "category"} or None
+
+
+def convert_dtypes(records_df: DataFrameType, dtype: dict | None) -> DataFrameType:
+    """
+    Convert the columns of the records which are given in dtype.
+
+    Categories are made from the values as they are read, such that numeric codes stay numbers
+    instead of the strings of the C engine. Integer codes, also when they are read as float because
+    of gaps, become Int64 categories, as with the pyarrow engine.
+    """
+    if not dtype:
+        return records_df
+    dtype = {name: value for name, value in dtype.items() if name in records_df.columns}
+    records_df = records_df.astype({name: value for name, value in dtype.items() if value != "category"})
+    for name, value in dtype.items():
+        column = records_df[name]
+        if value != "category" or isinstance(column.dtype, pd.CategoricalDtype):
+            continue
+        if pd.api.types.is_integer_dtype(column.dtype) or (
+            pd.api.types.is_float_dtype(column.dtype) and (column.dropna() % 1 == 0).all()
+        ):
+            column = column.astype("Int64")
+        records_df[name] = column.astype("category")
+    return records_df
+
+
+def write_records(records_df: DataFrameType, filename, sep: str = ";", index: bool = False):
+    """
+    Write the records to a file.
+
+    Parameters
+    ----------
+    records_df: DataFrameType
+        The records.
+    filename: str or Path
+        Name of the file. The format follows from the extension.
+    sep: str
+        Separator of a CSV file.
+    index: bool
+        Write the index of the records as well.
+    """
+    with RecordsWriter(filename, sep=sep, index=index) as writer:
+        writer.write(records_df)
+
+
+class RecordsWriter:
+    """
+    Write chunks of records to one file.
+
+    Arguments
+    ---------
+    filename: str or Path
+        Name of the file. The format follows from the extension. CSV is written to stdout if not
+        given.
+    sep: str
+        Separator of a CSV file.
+    index: bool
+        Write the index of the records as well.
+
+    Notes
+    -----
+    Parquet and Feather files are written with the columnar writers of pyarrow. A CSV file is
+    opened once, with the compression which follows from the extension, so all chunks end up in
+    one stream (and one member of a zip file). All chunks must have the same columns and data
+    types. Use the writer as a context manager, such that the file is closed after the last chunk.
+    """
+
+    def __init__(self, filename, sep: str = ";", index: bool = False):
+        self.filename = sys.stdout if filename is None else filename
+        self.file_format = "csv" if filename is None else file_format(filename)
+        self.sep = sep
+        self.index = index
+        self._writer = None
+        self._schema = None
+        self.number_of_chunks = 0
+
+    def write(self, records_df: DataFrameType):
+        """
+        Write a chunk of records.
+        """
+        if self.file_format == "csv":
+            if self.filename is sys.stdout:
+                handle = sys.stdout
+            else:
+                if self._writer is None:
+                    self._writer = self._open_writer(None)
+                handle = self._writer.handle
+            records_df.to_csv(handle, sep=self.sep, index=self.index, header=self.number_of_chunks == 0)
+        else:
+            pyarrow = import_pyarrow()
+            table = pyarrow.Table.from_pandas(records_df, preserve_index=self.index)
+            if self._writer is None:
+                self._schema = table.schema
+                self._writer = self._open_writer(table.schema)
+            elif not table.schema.equals(self._schema, check_metadata=False):
+                # for instance a column without any value in this chunk
+                table = table.cast(self._schema)
+            self._writer.write_table(table)
+        self.number_of_chunks += 1
+
+    def _open_writer(self, schema):
+        if self.file_format == "csv":
+            from pandas.io.common import get_handle
+
+            return get_handle(self.filename, "w", compression="infer")
+        if self.file_format == "parquet":
+            import pyarrow.parquet as pq
+
+            return pq.ParquetWriter(self.filename, schema)
+        import pyarrow.ipc as ipc
+
+        return ipc.new_file(self.filename, schema)
+
+    def close(self):
+        """
+        Close the file.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
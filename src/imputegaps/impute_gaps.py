@@ -12,6 +12,8 @@ ImputeGaps:
 Functions:
 fill_missing_data(
     Impute missing values for one variable of a particular stratum (subset).
+fill_missing_data_grouped(
+    Impute missing values for one variable of all strata at once.
 
 
 
@@ -20,20 +22,102 @@ ImputeGaps:
     A class to handle the imputation of missing values in a DataFrame based on specified methods and settings.
 """
 
+import copy
 import logging
+import os
 import warnings
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
 from typing import Union
 
 import numpy as np
 import pandas as pd
 
+from imputegaps import jit
+from imputegaps.kernels import (
+    ARRAY_METHODS,
+    BLOCK_METHODS,
+    GROUPED_STATISTICS,
+    ROLLUP_METHODS,
+    factorize_levels,
+    factorize_strata,
+    fill_rollup,
+    impute_arrays,
+    reservoir_donors,
+    strata_with_recipients,
+)
+from imputegaps.fileio import import_pyarrow
+from imputegaps.masks import MaskEvaluator
+from imputegaps.partition import SharedColumns, impute_partition, partition_positions
+from imputegaps.plan import ImputationPlan, imputed_float_dtype
+from imputegaps.profiling import NullProfiler, Profiler, timed_call
+from imputegaps.sketches import MEDIAN_ERROR
+from imputegaps.streams import StratumStreams, stratum_generator, stratum_hashes
+
 logger = logging.getLogger(__name__)
 
+GROUPED_METHODS = ARRAY_METHODS
+EXECUTORS = ("thread", "process")
+
 DataFrameType = Union["pd.DataFrame", None]
 DataFrameLikeType = Union["pd.DataFrame", "pd.Series", None]
 SeriesType = Union["pd.Series", None]
 
 
+def invalid_donor_mask(invalid_donors: SeriesType | np.ndarray, column: SeriesType) -> np.ndarray:
+    """
+    Convert the invalid donors of a column to a positional boolean array
+
+    Parameters
+    ----------
+    invalid_donors : SeriesType or np.ndarray
+        Boolean array with the same length as column, or a pd.Series with a boolean column which
+        is aligned on the index of column.
+    column : SeriesType
+        pd.Series with the column to impute.
+
+    Returns
+    -------
+    np.ndarray:
+        Boolean array which is True for the positions of the invalid donors. Records which are
+        not found in invalid_donors are valid donors.
+    """
+    if isinstance(invalid_donors, np.ndarray):
+        if invalid_donors.size != column.size:
+            raise ValueError(f"Expected {column.size} invalid donor flags, got {invalid_donors.size}.")
+        return invalid_donors.astype(bool, copy=False)
+    if not invalid_donors.index.equals(column.index):
+        # only align on the index if the records are not in the same order already
+        invalid_donors = invalid_donors.reindex(column.index)
+    return invalid_donors.to_numpy(dtype=bool, na_value=False)
+
+
+def numeric_column(column: SeriesType) -> SeriesType:
+    """
+    Convert a column which holds numbers to a numeric column
+
+    Parameters
+    ----------
+    column : SeriesType
+        pd.Series with the column to impute.
+
+    Returns
+    -------
+    SeriesType:
+        The column itself if it has a numeric dtype, the column converted by pd.to_numeric if it
+        holds numbers in another dtype (for instance object), or None if it can not be converted.
+    """
+    if pd.api.types.is_numeric_dtype(column.dtype):
+        return column
+    try:
+        converted = pd.to_numeric(column)
+    except (TypeError, ValueError):
+        return None
+    if not pd.api.types.is_numeric_dtype(converted.dtype):
+        return None
+    return converted
+
+
 def fill_missing_data(
     stratum: SeriesType,
     invalid_donors: SeriesType = None,
@@ -41,6 +125,8 @@ def fill_missing_data(
     how: str = "mean",
     min_threshold: int = 1,
     seed: int = None,
+    max_donors: int | None = None,
+    rng: np.random.Generator | None = None,
 ) -> SeriesType:
     """
     Impute missing values for one variable of a particular stratum (subset)
@@ -49,9 +135,10 @@ def fill_missing_data(
     ----------
     stratum : SeriesType
         pd.Series with one column that contains missing values.
-    invalid_donors : SeriesType
+    invalid_donors : SeriesType or np.ndarray
         pd.Series with the same index as stratum and a boolean column that
-        indicates which records are invalid donors.
+        indicates which records are invalid donors, or a boolean array with the
+        same length as stratum.
     how : str
         Method that should be used to fill the missing values;
         - mean: Impute with the mean
@@ -63,10 +150,14 @@ def fill_missing_data(
     min_threshold : int
         Minimum number of valid donor records needed for imputation.
     seed : int
-        Seed needed for random generator.
-        Will only be imposed for seed == 1
+        Seed of the random generator of pick, which is derived from the seed, col_name and the
+        name of the stratum. The draws differ every call if None.
     col_name: str
         Name of the variable, used for reporting only
+    max_donors : int
+        If given, pick draws from a uniform sample of at most max_donors valid donor records.
+    rng : np.random.Generator
+        Random generator of pick, which replaces the generator derived from the seed.
 
     Returns
     -------
@@ -96,14 +187,10 @@ def fill_missing_data(
         return stratum_to_impute
 
     # If applicable, only select valid donor records (i.e., if track records with imputed values)
-    mask_invalid_donors = None
+    mask_valid_donors = ~mask_is_na.to_numpy()
     if invalid_donors is not None:
-        overlap_index = invalid_donors.index.intersection(stratum_to_impute.index)
-        mask_invalid_donors = invalid_donors.reindex(overlap_index)
-    if mask_invalid_donors is not None and len(mask_invalid_donors) > 0:
-        valid_donor_records = stratum_to_impute[~mask_is_na & ~mask_invalid_donors]
-    else:
-        valid_donor_records = stratum_to_impute[~mask_is_na]
+        mask_valid_donors &= ~invalid_donor_mask(invalid_donors, stratum_to_impute)
+    valid_donor_records = stratum_to_impute[mask_valid_donors]
 
     # If the number of valid donors is smaller than the min_threshold, imputation is not possible
     # This only applies to mean, mode and pick, because the other methods do not rely on donor
@@ -137,12 +224,11 @@ def fill_missing_data(
             imputed_values = np.full(mask_is_na.size, fill_value=valid_donor_records.median())
     elif how == "mode":
         mode = valid_donor_records.mode()
-        try:
-            first_mode = mode[0]
-        except KeyError as err:
-            logger.warning(f"{err}\nMode not found for {col_name} in stratum {stratum.name}.")
-            logger.warning("%s\nMode not found for %s in stratum %s.", err, col_name, stratum.name)
-        imputed_values = np.full(mask_is_na.size, fill_value=first_mode)
+        if mode.empty:
+            logger.warning("Mode not found for %s in stratum %s.", col_name, stratum.name)
+            return stratum_to_impute
+        # take the first mode by position; the index of the mode is not guaranteed to start at 0
+        imputed_values = np.full(mask_is_na.size, fill_value=mode.iloc[0])
     elif how == "nan":
         try:
             stratum_to_impute = stratum_to_impute.cat.add_categories([0])
@@ -158,12 +244,22 @@ def fill_missing_data(
             pass
         imputed_values = np.full(stratum_to_impute.isnull().sum(), fill_value=1)
     elif how == "pick":
-        if seed == -1:
-            # Only for seed is 1 we imposed every time we enter a new cell.
-            # Generates less random results but useful for reproduction of the data
-            np.random.seed(seed)
+        if rng is None:
+            # the draws of a stratum do not depend on the strata which were imputed before
+            rng = stratum_generator(seed, col_name, stratum.name)
         number_of_nans = mask_is_na.sum()
-        imputed_values = np.random.choice(valid_donor_records.values, size=number_of_nans)
+        if max_donors is not None and valid_donor_records.size > max_donors:
+            # draw from a uniform sample of the donors instead of copying all donor values
+            sample, _ = reservoir_donors(
+                np.zeros(mask_valid_donors.size, dtype=np.int64),
+                mask_valid_donors,
+                max_donors,
+                number_of_strata=1,
+                rng=rng,
+            )
+            imputed_values = rng.choice(stratum_to_impute.iloc[sample].to_numpy(), size=number_of_nans)
+        else:
+            imputed_values = rng.choice(valid_donor_records.to_numpy(), size=number_of_nans)
     else:
         raise ValueError(f"Not a valid imputation method: {how}.")
 
@@ -175,6 +271,238 @@ def fill_missing_data(
     return stratum_to_impute
 
 
+def fill_missing_data_grouped(
+    column: SeriesType,
+    group_by: list | None = None,
+    invalid_donors: SeriesType = None,
+    col_name: str = None,
+    how: str = "mean",
+    min_threshold: int = 1,
+    stratum_codes: tuple | None = None,
+    max_donors: int | None = None,
+    rng=None,
+) -> SeriesType:
+    """
+    Impute missing values for one variable of all strata at once
+
+    Parameters
+    ----------
+    column : SeriesType
+        pd.Series with one column that contains missing values. The index must contain the levels
+        given by group_by.
+    group_by: list
+        Names of the index levels which define the strata. If empty, the whole column is one stratum.
+        Only used for reporting if stratum_codes is given.
+    invalid_donors : SeriesType or np.ndarray
+        Boolean array with the same length as column which indicates by position which records
+        are invalid donors, or a pd.Series which is aligned on the index of column.
+    col_name: str
+        Name of the variable, used for reporting only
+    how : str
+        Method that should be used to fill the missing values;
+        - mean: Impute with the mean
+        - median: Impute with the median
+        - mode: Impute with the mode. For ties, the smallest value is taken
+        - pick: Impute with a random value of a valid donor of the same stratum
+        - nan: Impute with the value 0
+        - pick1: Impute with the value 1
+    min_threshold : int
+        Minimum number of valid donor records needed for imputation.
+    stratum_codes: tuple
+        Tuple (codes, number_of_strata) with the integer stratum code of each record of column, as
+        returned by :func:`imputegaps.kernels.factorize_strata`. If given, the strata are not
+        derived from the index, so the column can have any index.
+    max_donors: int
+        If given, pick draws from a uniform sample of at most max_donors donors per stratum.
+    rng:
+        :class:`imputegaps.streams.StratumStreams` of the column, or a random generator, used
+        for pick. Defaults to a new numpy Generator.
+
+    Returns
+    -------
+    SeriesType:
+        Series with imputed values
+
+    Notes
+    -----
+    For mean, median and mode, this gives the same result as applying :func:`fill_missing_data` to
+    each stratum with a groupby, but calculates the statistic of all strata with one grouped
+    reduction and fills all gaps with one masked assignment. For pick, the donors of all missing values are
+    drawn at once from the random streams of their strata. The column is converted to a NumPy array
+    and imputed with :func:`imputegaps.kernels.impute_arrays`; categories are imputed by their codes.
+    """
+    if how not in GROUPED_METHODS:
+        raise ValueError(f"Not a valid grouped imputation method: {how}.")
+
+    logger.debug("Imputing %s for all strata of %s with grouped %s method", col_name, group_by, how)
+
+    if stratum_codes is None:
+        keys = [column.index.get_level_values(name) for name in group_by or []]
+        stratum_codes = factorize_strata(keys, size=column.size)
+    stratum_codes, number_of_strata = stratum_codes
+
+    mask_is_na = column.isnull().to_numpy()
+    donor_mask = ~mask_is_na
+    if invalid_donors is not None:
+        donor_mask &= ~invalid_donor_mask(invalid_donors, column)
+
+    is_categorical = isinstance(column.dtype, pd.CategoricalDtype)
+    if is_categorical and how in ("mode", "pick"):
+        # the category codes follow the order of the categories, which decides the ties of the mode
+        values = column.cat.codes.to_numpy().astype(np.float64)
+        values[mask_is_na] = np.nan
+    elif pd.api.types.is_numeric_dtype(column.dtype) and (
+        how in GROUPED_STATISTICS or not pd.api.types.is_bool_dtype(column.dtype)
+    ):
+        # booleans count as 0 and 1 for the mean and median, but keep their values for mode and pick
+        values = column.to_numpy(dtype=np.float64, na_value=np.nan)
+    elif how in GROUPED_STATISTICS:
+        raise TypeError(f"Can not take the {how} of the non-numeric variable {col_name}.")
+    else:
+        values = column.to_numpy(dtype=object)
+
+    filled_values, imputed_mask = impute_arrays(
+        values,
+        stratum_codes,
+        donor_mask=donor_mask,
+        method=how,
+        min_threshold=min_threshold,
+        rng=rng,
+        number_of_strata=number_of_strata,
+        max_donors=max_donors,
+        col_name=col_name,
+    )
+    if how in GROUPED_STATISTICS:
+        return pd.Series(filled_values, index=column.index, name=column.name)
+
+    recipient_positions = np.flatnonzero(imputed_mask)
+    imputed_values = filled_values[recipient_positions]
+    if is_categorical and how in ("mode", "pick"):
+        imputed_values = np.asarray(column.cat.categories.take(imputed_values.astype(np.int64)))
+    return fill_positions(column, recipient_positions, imputed_values)
+
+
+def fill_positions(column: SeriesType, positions: np.ndarray, values: np.ndarray) -> SeriesType:
+    """
+    Fill the values of a column at the given positions
+
+    Parameters
+    ----------
+    column: SeriesType
+        pd.Series with the column to fill.
+    positions: np.ndarray
+        Positions of the records to fill.
+    values: np.ndarray
+        Values to fill in, one for each position.
+
+    Returns
+    -------
+    SeriesType:
+        Copy of the column with the values filled in. For a categorical column, values which are
+        not yet a category are added to the categories. An integer or boolean column becomes a
+        float column if the values are not integer.
+    """
+    filled_column = column.copy()
+    if positions.size == 0:
+        return filled_column
+    is_integer = pd.api.types.is_integer_dtype(filled_column.dtype) or pd.api.types.is_bool_dtype(filled_column.dtype)
+    if is_integer and pd.api.types.is_float_dtype(np.asarray(values).dtype):
+        if not np.all(np.mod(values, 1) == 0):
+            # for instance the mean of an integer or boolean variable
+            filled_column = filled_column.astype(imputed_float_dtype(column.dtype))
+    if isinstance(filled_column.dtype, pd.CategoricalDtype):
+        new_categories = pd.Index(pd.unique(values)).difference(filled_column.cat.categories)
+        if not new_categories.empty:
+            filled_column = filled_column.cat.add_categories(new_categories)
+    filled_column.iloc[positions] = values
+    return filled_column
+
+
+def log_imputation_result(
+    col_name: str,
+    group_by: list | None,
+    number_of_nans_before: int,
+    number_of_nans_after: int,
+    column_size: int,
+):
+    """
+    Report how many gaps of a variable were imputed
+
+    Parameters
+    ----------
+    col_name: str
+        Name of the variable
+    group_by: list
+        The variables which defined the strata, used for reporting only
+    number_of_nans_before: int
+        Number of missing values before imputation
+    number_of_nans_after: int
+        Number of missing values after imputation
+    column_size: int
+        Number of records which could be imputed
+    """
+    number_of_removed_nans = number_of_nans_before - number_of_nans_after
+
+    if number_of_removed_nans == 0 and number_of_nans_before > 0:
+        logger.info(
+            "Imputing %s in stratum %s - Didn't impute any gap: %d gaps imputed / %d gaps remaining",
+            col_name,
+            group_by,
+            number_of_removed_nans,
+            number_of_nans_after,
+        )
+    elif number_of_nans_after > 0:
+        logger.info(
+            "Imputing %s in stratum %s - Didn't impute all gaps: %d gaps imputed / %d gaps remaining",
+            col_name,
+            group_by,
+            number_of_removed_nans,
+            number_of_nans_after,
+        )
+    elif number_of_nans_after == 0:
+        percentage_replaced = round(100 * number_of_nans_before / column_size, 1)
+        logger.info(
+            "Imputing %s in stratum %s - Successfully imputed all %d/%d (%.1f %%) gaps.",
+            col_name,
+            group_by,
+            number_of_nans_before,
+            column_size,
+            percentage_replaced,
+        )
+    else:
+        logger.warning(
+            "Imputing based on stratum %s - Something went wrong with imputing gaps for %s.", group_by, col_name
+        )
+
+
+def run_tasks(tasks: list, executor: Executor | None = None) -> list:
+    """
+    Run the imputation of independent variables, in parallel if an executor is given
+
+    Parameters
+    ----------
+    tasks: list
+        List of tuples (function, kwargs).
+    executor: Executor
+        Pool to which the tasks are submitted. The tasks are run one by one if not given.
+
+    Returns
+    -------
+    list:
+        The results function(**kwargs) of the tasks, in the order of the tasks.
+
+    Notes
+    -----
+    Tasks which draw random donors (how='pick') get their own random streams, so they are run in
+    parallel as well.
+    """
+    if executor is None:
+        return [function(**kwargs) for function, kwargs in tasks]
+
+    futures = [executor.submit(function, **kwargs) for function, kwargs in tasks]
+    return [future.result() for future in futures]
+
+
 class ImputeGaps:
     """
     Initializes the ImputeGaps object.
@@ -188,11 +516,37 @@ class ImputeGaps:
     imputation_methods: dict
         Dictionary with imputation methods per data type.
     seed: int
-        Seed for random number generator. If seed == 1, seed will be imposed every time a cell is
-        entered, forcing fewer 'random results'.
-        For a seed not equal to 1, the seed will be set only once.
-        For seed is None, no seed will be imposed, meaning that your outcome of random pick will be
-        different every time your run the code
+        Seed of the random streams of pick. The stream of a stratum of a variable is derived from
+        the seed, the name of the variable and the key of the stratum, so the outcome does not
+        depend on n_jobs, the executor, batch_columns or partition. For seed is None, a seed is
+        drawn once per imputer, meaning that your outcome of random pick will be different every
+        time your run the code
+    batch_columns: bool
+        If True (default), impute the float variables which share the imputation method, filter and
+        set_nan_eval expression together in one block instead of column by column.
+    n_jobs: int
+        Number of workers which impute the variables of a level in parallel. Defaults to 1, which
+        imputes the variables one by one. None or a value smaller than 1 uses all cores.
+    executor: str
+        'thread' to run the workers in a thread pool, which suits the numpy kernels, or 'process'
+        to run them in a process pool. The result is the same as the serial imputation.
+    approximate: bool
+        If True, the median of the rollup, chunked and fitted imputations is approximated with
+        mergeable quantile sketches (see :mod:`imputegaps.sketches`). The sketches of the coarser
+        levels are merged from those of the finer levels and the memory of the chunked mode no
+        longer grows with the number of distinct values. impute_gaps without rollup takes the
+        exact median and logs a warning if a variable is imputed with the median.
+    median_error: float
+        Rank error of the approximate median, as a fraction of the donors of a stratum. Strata
+        with at most 1 / median_error donors get the exact median.
+    max_donors: int
+        If given, pick draws from a uniform sample of at most max_donors donors per stratum, which
+        is collected in one pass over the records. This bounds the memory of pick for strata with
+        very many donors. Every donor still has the same chance to be drawn.
+    profile: bool
+        If True, impute_gaps records the wall time, the number of rows, the strata with gaps and
+        the filled gaps per variable, level and stage (groupby, filter, kernel, write_back and
+        partition) in the DataFrame *profile_df*, see :class:`imputegaps.profiling.Profiler`.
 
     Notes
     ----------
@@ -218,11 +572,29 @@ class ImputeGaps:
         seed: int = None,
         track_imputed: bool = False,
         min_threshold: int | None = None,
+        batch_columns: bool = True,
+        n_jobs: int | None = 1,
+        executor: str = "thread",
+        approximate: bool = False,
+        median_error: float = MEDIAN_ERROR,
+        max_donors: int | None = None,
+        profile: bool = False,
     ):
         self.index_key = index_key
         self.imputation_methods = imputation_methods
         self.seed = seed
         self.track_imputed = track_imputed
+        self.batch_columns = batch_columns
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
+        self.n_jobs = n_jobs
+        if executor not in EXECUTORS:
+            raise ValueError(f"executor must be one of {EXECUTORS}, got {executor}.")
+        self.executor = executor
+        self.approximate = approximate
+        self.median_error = median_error
+        self.max_donors = max_donors
+        self.profile = profile
         if min_threshold is None:
             self.min_threshold = 1
         else:
@@ -230,16 +602,28 @@ class ImputeGaps:
 
         self.variables = variables
         self.imputed_df = None
-
-        if self.seed is not None:
-            # Set seed for random number generator. Only needs to be done one time
-            np.random.seed(seed)
+        # statistics per stratum of fit or load, which are used by transform
+        self.fitted_statistics = None
+        # stages of the last call of impute_gaps if profile is True
+        self.profile_df = None
+        # the settings of the variables, made on first use
+        self._plan = None
+        self._plan_sources = ()
+        self._profiler = NullProfiler()
+
+        # the random streams of pick are derived from this seed, never from the global numpy state
+        self.stream_seed = seed if seed is not None else int(np.random.SeedSequence().entropy % 2**63)
 
         logger.info("ImputeGaps is starting with the following settings: ")
         logger.info("- set_seed: %s", self.seed)
         logger.info("- set_seed: %s", self.seed)
         logger.info("- min_threshold: %s", self.min_threshold)
         logger.info("- track_imputed: %s", self.track_imputed)
+        logger.info("- n_jobs: %s (%s)", self.n_jobs, self.executor)
+        logger.info("- approximate median: %s (error %s)", self.approximate, self.median_error)
+        logger.info("- max_donors: %s", self.max_donors)
+        logger.info("- profile: %s", self.profile)
+        logger.info("- numba kernels: %s", jit.USE_NUMBA)
         logger.info("- pick1: %s", self.imputation_methods.get("pick1"))
         logger.info("- pick: %s", self.imputation_methods.get("pick"))
         logger.info("- mode: %s", self.imputation_methods.get("mode"))
@@ -253,6 +637,8 @@ class ImputeGaps:
         records_df: DataFrameType,
         group_by: list,
         drop_dimensions: bool = False,
+        rollup: bool = False,
+        partition: bool = False,
     ) -> DataFrameType:
         """
         Impute all missing values in a dataframe for indices group_by.
@@ -265,51 +651,103 @@ class ImputeGaps:
             The variables by which the records should be grouped.
             The first variable is the most important one.
         drop_dimensions: bool
-
-
+            If True, gaps which can not be imputed in the strata of all group_by variables are
+            imputed in the strata of the group_by variables with the last one dropped, and so on,
+            until finally the whole column is used.
+        rollup: bool
+            If True, impute all levels of drop_dimensions in one pass with
+            :meth:`impute_gaps_rollup`. In this mode only the originally observed values are used
+            as donors, the same as with track_imputed.
+        partition: bool
+            If True, impute the levels which contain the first group_by variable per partition of
+            that variable in n_jobs worker processes with :meth:`impute_gaps_partitioned`. The
+            coarser levels are imputed on all records afterwards.
 
         Returns
         -------
         DataFrameType:
             DataFrame with imputed values.
         """
+        if (
+            self.approximate
+            and not rollup
+            and any(settings["how"] == "median" for settings in self.plan.for_columns(records_df.columns).values())
+        ):
+            logger.warning("The median is only approximated with rollup, in chunks or after fit; it is exact here.")
+        self._profiler = Profiler() if self.profile else NullProfiler()
+        try:
+            return self._impute_gaps(records_df, group_by, drop_dimensions, rollup, partition)
+        finally:
+            if self.profile:
+                self.profile_df = self._profiler.to_frame()
+            self._profiler = NullProfiler()
 
+    def _impute_gaps(
+        self,
+        records_df: DataFrameType,
+        group_by: list,
+        drop_dimensions: bool,
+        rollup: bool,
+        partition: bool,
+    ) -> DataFrameType:
+        """
+        Impute all missing values in a dataframe for indices group_by, see :meth:`impute_gaps`.
+        """
         original_indices = records_df.index.names
         records_df = records_df.reset_index()
-        number_of_dimensions = len(group_by)
-
-        # add one to number of dimensions because you add the index key
-        for group_dim in range(number_of_dimensions + 1):
-            max_dim = number_of_dimensions - group_dim
-            if max_dim > 0:
-                group_by_indices = group_by[:max_dim]
-                index_for_group_by = [self.index_key] + group_by_indices
-            else:
-                index_for_group_by = self.index_key
-                group_by_indices = []
-
-            # set index before imputations
-            records_df.set_index(index_for_group_by, inplace=True)
 
-            if self.imputed_df is None and self.track_imputed:
-                self.imputed_df = records_df.isna()
-            elif self.imputed_df is not None and self.track_imputed:
-                self.imputed_df = self.imputed_df.reset_index().set_index(index_for_group_by)
+        if rollup:
+            records_df = self.impute_gaps_rollup(records_df, group_by=group_by, drop_dimensions=drop_dimensions)
+            if None not in original_indices:
+                records_df.set_index(original_indices, inplace=True)
+            return records_df
 
-            # Impute missing values for the new index
-            records_df = self.impute_gaps_for_dimensions(records_df, group_by=group_by_indices)
+        if self.track_imputed:
+            # the records are not reordered, so the imputed flags stay aligned by position
+            self.imputed_df = records_df.isna()
 
-            # after each iteration, reset the index
-            records_df.reset_index(inplace=True)
-
-            if not drop_dimensions:
-                # by default, we do not continue imputing for the next group_by with one
-                # less dimension
-                break
+        number_of_dimensions = len(group_by)
+        dimensions_to_impute = range(number_of_dimensions + 1) if drop_dimensions else range(1)
+        if partition and number_of_dimensions > 0:
+            with self._profiler.stage("", group_by[0], "partition", rows=len(records_df)):
+                records_df = self.impute_gaps_partitioned(
+                    records_df, group_by=group_by, drop_dimensions=drop_dimensions
+                )
+            # only the levels without the first group_by variable cross the partitions
+            dimensions_to_impute = [
+                group_dim for group_dim in dimensions_to_impute if group_dim == number_of_dimensions
+            ]
+
+        # factorize the group_by keys once for all levels, the records keep a plain RangeIndex
+        with self._profiler.stage("", "all", "groupby", rows=len(records_df)) as entry:
+            levels = factorize_levels([records_df[name] for name in group_by], size=len(records_df))
+            entry["strata"] = sum(number_of_strata for _, number_of_strata in levels)
+
+        # the filter masks are evaluated once and shared by all variables and levels
+        masks = MaskEvaluator(records_df)
+        # the gaps which are still missing after each level, so the coarser levels only visit those
+        residual_gaps = {}
+
+        # the pool of workers is started once for all levels
+        with self.start_executor() if self.n_jobs > 1 else nullcontext() as executor:
+            for group_dim in dimensions_to_impute:
+                max_dim = number_of_dimensions - group_dim
+
+                # Impute missing values for the strata of the first max_dim group_by variables
+                records_df = self.impute_gaps_for_dimensions(
+                    records_df,
+                    group_by=group_by[:max_dim],
+                    stratum_codes=levels[group_dim],
+                    masks=masks,
+                    executor=executor,
+                    residual_gaps=residual_gaps,
+                )
 
-        if drop_dimensions:
-            # call the last time in case we gave drop dimensions
-            records_df = self.impute_gaps_for_dimensions(records_df)
+            if drop_dimensions:
+                # call the last time in case we gave drop dimensions
+                records_df = self.impute_gaps_for_dimensions(
+                    records_df, stratum_codes=levels[-1], masks=masks, executor=executor, residual_gaps=residual_gaps
+                )
 
         if None not in original_indices:
             records_df.set_index(original_indices, inplace=True)
@@ -317,208 +755,888 @@ class ImputeGaps:
 
         return records_df
 
-    def impute_gaps_for_dimensions(self, records_df: DataFrameType, group_by: list | None = None) -> DataFrameType:
+    def impute_gaps_partitioned(
+        self,
+        records_df: DataFrameType,
+        group_by: list,
+        drop_dimensions: bool = False,
+    ) -> DataFrameType:
         """
-        Impute all missing values in a dataframe for a particular subset (aka stratum).
+        Impute the levels which contain the first group_by variable per partition of that variable.
 
         Parameters
         ----------
         records_df: DataFrameType
-            DataFrame containing variables with missing values.
+            DataFrame with a plain RangeIndex containing variables with missing values.
         group_by: list
-            The new indices for the DataFrame.
+            The variables by which the records should be grouped. The records are partitioned by
+            the first one.
+        drop_dimensions: bool
+            If True, impute all levels which contain the first group_by variable, else only the
+            deepest level.
 
         Returns
         -------
         DataFrameType:
-            DataFrame with imputed values for indices group_by.
-        """
-
-        # Set index to group_by
-        how = None
-
-        # Iterate over variables
-        for col_name in records_df.columns:
-            try:
-                variable_properties = self.variables[col_name]
-            except KeyError as err:
-                logger.debug("Skip imputing, want geen variabele info voor %s", err)
-                continue
-            # Check if information is available about the variable
-            try:
-                var_type = variable_properties["type"]
-            except KeyError as err:
-                logger.info("Geen 'type' info voor: %s, %s", col_name, err)
-                continue
-
-            no_impute = variable_properties.get("no_impute")
-            skip_variable_type = self.imputation_methods.get("skip")
-
-            # Check if the variable has a 'no_impute' flag or if its type should not be imputed
-            if no_impute or (skip_variable_type is not None and var_type in skip_variable_type):
-                logger.debug("Skip imputing variable %s of var type %s", col_name, var_type)
-                continue
+            DataFrame with imputed values.
 
-            # Get filter(s) if provided
-            impute_only = variable_properties.get("impute_only")
-            variable_filter = variable_properties.get("filter")
+        Notes
+        -----
+        The partitions are imputed in a process pool with n_jobs workers. The numeric columns are
+        passed to the workers in shared memory and the imputed float columns are written back into
+        it; only the other columns of a partition are pickled. Records with a missing value of the
+        first group_by variable are left to the coarser levels. The random streams of pick belong to
+        the strata, so the partitions draw the same donors as a serial run.
+        """
+        partitions = partition_positions(records_df[group_by[0]])
+        logger.debug("Impute %d partitions of %s in %d processes", len(partitions), group_by[0], self.n_jobs)
+
+        # the worker gets the settings only, the imputed flags are made from its own records
+        imputer = copy.copy(self)
+        imputer.imputed_df = None
+        imputer.n_jobs = 1
+        imputer.profile = False
+        imputer._profiler = NullProfiler()
+
+        columns = list(records_df.columns)
+        with SharedColumns(records_df) as shared, ProcessPoolExecutor(max_workers=self.n_jobs) as executor:
+            other_names = [col_name for col_name in columns if col_name not in shared.descriptors]
+            futures = [
+                executor.submit(
+                    impute_partition,
+                    imputer,
+                    shared.descriptors,
+                    columns,
+                    {name: records_df[name].iloc[positions].reset_index(drop=True) for name in other_names},
+                    positions,
+                    group_by,
+                    drop_dimensions,
+                )
+                for positions in partitions
+            ]
+            results = [future.result() for future in futures]
 
-            if impute_only is None and variable_filter is not None:  # Als impute_only leeg is, neem dan filter
-                var_filter = variable_filter
-            else:
-                var_filter = impute_only
+            for col_name in shared.descriptors:
+                values = shared.array(col_name)
+                if values.dtype.kind == "f":
+                    records_df[col_name] = values.copy()
 
-            # If a filter is provided, use it to filter the records
-            mask_filter = pd.Series(True, index=records_df.index)
-            if var_filter is not None:
-                eval_str = var_filter + " == 1"
-                try:
-                    mask_filter = records_df.eval(eval_str, engine="python")
-                except pd.errors.UndefinedVariableError as err:
-                    logger.warning("%s\nImputation filter failed for %s met %s", err, col_name, var_filter)
-
-            # If set_nan_eval is provided, use it to filter the records
-            set_nan_eval = self.variables[col_name].get("set_nan_eval")
-            mask_set_nan_eval = pd.Series(False, index=records_df.index)
-            if set_nan_eval is not None:
-                try:
-                    mask_set_nan_eval = records_df.eval(set_nan_eval, engine="python")
-                except pd.errors.UndefinedVariableError as err:
-                    logger.warning("%s\nSet_nan_eval filter failed for %s met %s", err, col_name, set_nan_eval)
+        if partitions:
+            all_positions = np.concatenate(partitions)
+            for col_name in other_names:
+                values = np.concatenate([result[col_name].to_numpy(dtype=object) for result in results])
+                records_df[col_name] = fill_positions(records_df[col_name], all_positions, values)
 
-            col_to_impute = records_df[mask_filter & ~mask_set_nan_eval][col_name]
+        return records_df
 
-            if self.track_imputed:
-                invalid_donors = self.imputed_df[col_name]
-            else:
-                invalid_donors = None
+    def impute_gaps_rollup(
+        self,
+        records_df: DataFrameType,
+        group_by: list,
+        drop_dimensions: bool = True,
+    ) -> DataFrameType:
+        """
+        Impute all missing values for all levels of drop_dimensions in one pass.
 
-            start_type = col_to_impute.dtype
+        Parameters
+        ----------
+        records_df: DataFrameType
+            DataFrame containing variables with missing values and the group_by variables as columns.
+        group_by: list
+            The variables by which the records should be grouped.
+            The first variable is the most important one.
+        drop_dimensions: bool
+            If False, only the strata of all group_by variables are used.
 
-            # Compute number of missing values
-            number_of_nans_before = col_to_impute.isnull().sum()
-            column_size = col_to_impute.size
+        Returns
+        -------
+        DataFrameType:
+            DataFrame with imputed values.
 
-            # Skip if there are no missing values
+        Notes
+        -----
+        The donor counts of all levels are computed at once, after which each gap is filled from
+        the deepest level which has at least min_threshold valid donors. The donors are the
+        originally observed values on all levels; values imputed on a deeper level are not used as
+        donor on a coarser level. For mean, median, mode, nan and pick1 this gives the same values as
+        :meth:`impute_gaps` with track_imputed=True, but scans each column only once instead of once
+        per level. pick draws from the same donors, but not the same draws, because the donors of
+        all levels are ordered at once.
+        """
+        with self._profiler.stage("", "rollup", "groupby", rows=len(records_df)) as entry:
+            levels = factorize_levels([records_df[name] for name in group_by], size=len(records_df))
+            if not drop_dimensions:
+                levels = levels[:1]
+            entry["strata"] = sum(number_of_strata for _, number_of_strata in levels)
+        masks = MaskEvaluator(records_df)
+        # the hashes of the strata of all levels, made for the first variable with pick
+        level_keys = None
+
+        for col_name, settings in self.plan.for_columns(
+            records_df.columns, exclude=[self.index_key] + group_by
+        ).items():
+            how = settings["how"]
+
+            with self._profiler.stage(col_name, "rollup", "filter", rows=len(records_df)):
+                mask_to_impute = self._mask_to_impute(masks, col_name, settings)
+            column = records_df[col_name]
+            mask_is_na = column.isnull().to_numpy()
+            recipient_mask = mask_is_na & mask_to_impute
+            donor_mask = ~mask_is_na & mask_to_impute
+
+            number_of_nans_before = int(recipient_mask.sum())
             if number_of_nans_before == 0:
                 logger.debug("Skip imputing %s. It has no missing values.", col_name)
                 continue
-
-            # Skip if there is only missing values
-            if number_of_nans_before == column_size:
+            if not donor_mask.any():
                 logger.debug("Skip imputing %s. It has only missing values", col_name)
                 continue
 
-            logger.debug("Impute gaps {:20s} ({})".format(col_name, var_type))
-            percentage_to_replace = round(100 * number_of_nans_before / column_size, 1)
-            logger.debug(
-                "Filling %s with %d / %d nans (%.1f %%)",
+            with self._profiler.stage(col_name, "rollup", "kernel", rows=int(mask_to_impute.sum())) as entry:
+                if how in ("nan", "pick1"):
+                    # methods without donors fill each gap which belongs to a stratum of any level
+                    has_stratum = np.zeros(mask_is_na.size, dtype=bool)
+                    for codes, _ in levels:
+                        has_stratum |= codes >= 0
+                    recipient_positions = np.flatnonzero(recipient_mask & has_stratum)
+                    imputed_values = np.full(recipient_positions.size, fill_value=0 if how == "nan" else 1)
+                elif how in ROLLUP_METHODS:
+                    if how in GROUPED_STATISTICS:
+                        column = numeric_column(column)
+                        if column is None:
+                            logger.warning("Can not take the %s of the non-numeric variable %s", how, col_name)
+                            continue
+                        values = column.to_numpy(dtype=np.float64, na_value=np.nan)
+                    else:
+                        values, uniques = pd.factorize(column, sort=True)
+                    rng = None
+                    if how == "pick":
+                        if level_keys is None:
+                            level_keys = np.stack(
+                                [
+                                    stratum_hashes(
+                                        [records_df[name] for name in group_by[:max_dim]], size=len(records_df)
+                                    )
+                                    for max_dim in range(len(group_by), len(group_by) - len(levels), -1)
+                                ]
+                            )
+                        rng = StratumStreams(self.stream_seed, [col_name], level_keys)
+                    recipient_positions, imputed_values, recipient_levels = fill_rollup(
+                        values,
+                        levels,
+                        donor_mask=donor_mask,
+                        recipient_mask=recipient_mask,
+                        how=how,
+                        min_threshold=self.min_threshold,
+                        rng=rng,
+                        col_name=col_name,
+                        median_error=self.median_error if self.approximate else None,
+                        max_donors=self.max_donors,
+                    )
+                    if how not in GROUPED_STATISTICS:
+                        imputed_values = np.asarray(uniques.take(imputed_values))
+                    if self.profile:
+                        entry["strata"] = sum(
+                            np.unique(levels[level][0][recipient_positions[recipient_levels == level]]).size
+                            for level in np.unique(recipient_levels)
+                        )
+                else:
+                    raise ValueError(f"Not a valid imputation method: {how}.")
+                entry["gaps_filled"] = recipient_positions.size
+
+            with self._profiler.stage(col_name, "rollup", "write_back", rows=recipient_positions.size) as entry:
+                records_df[col_name] = fill_positions(column, recipient_positions, imputed_values)
+                entry["gaps_filled"] = recipient_positions.size
+            masks.invalidate(col_name)
+            log_imputation_result(
                 col_name,
+                group_by,
                 number_of_nans_before,
-                column_size,
-                percentage_to_replace,
+                number_of_nans_before - recipient_positions.size,
+                int(mask_to_impute.sum()),
             )
 
-            # Get which imputing method to use
-            imputation_dict = self.imputation_methods
-            not_none = [i for i in imputation_dict.keys() if imputation_dict[i] is not None]
+        return records_df
 
-            impute_method = variable_properties.get("impute_method")
-            if impute_method is not None:
-                how = impute_method
-            else:
-                for key in imputation_dict.keys():
-                    if key in not_none and var_type in imputation_dict[key]:
-                        how = key
-                        # Convert categorical (dict) variables to categorical
-                        if var_type == "dict":
-                            col_to_impute = col_to_impute.astype("category")
-                        continue
-
-            if how is None:
-                logger.warning("Imputation method not found!")
-            else:
-                logger.debug("Fill gaps by taking the %s of the valid values", how)
-
-            def fill_gaps(stratum):
-                """
-                Impute missing values for one variable for a particular subset (aka stratum)
-
-                Parameters
-                ----------
-                stratum: pd.Series
-                    pd.Series with one column that contains missing values.
-
-                Returns
-                -------
-                imputed_col: SeriesType
-                    New Series with the imputed values.
-                """
-                imputed_col = fill_missing_data(
-                    stratum,
-                    invalid_donors=invalid_donors,
-                    col_name=col_name,
-                    how=how,
-                    min_threshold=self.min_threshold,
-                    seed=self.seed,
+    def fit(
+        self,
+        records_df: DataFrameType,
+        group_by: list,
+        drop_dimensions: bool = False,
+        reservoir_size: int = 1000,
+    ) -> "ImputeGaps":
+        """
+        Collect the statistics per stratum of all levels, to impute other records with :meth:`transform`.
+
+        Parameters
+        ----------
+        records_df: DataFrameType
+            DataFrame with the donors of the variables and the group_by variables.
+        group_by: list
+            The variables by which the records should be grouped.
+            The first variable is the most important one.
+        drop_dimensions: bool
+            If True, collect the statistics of the coarser levels as well.
+        reservoir_size: int
+            Maximum number of donors per stratum which are kept for pick.
+
+        Returns
+        -------
+        ImputeGaps:
+            The imputer itself.
+
+        Notes
+        -----
+        Per variable and level, the number of donors and the mean, median or mode of each stratum
+        are kept, and for pick a uniform sample of the donors. Only the originally observed values
+        are donors, so for mean, median, mode, nan and pick1 *fit* followed by *transform* of the
+        same records equals :meth:`impute_gaps` with rollup=True. pick draws from the donors of the
+        same strata, but its draws are keyed by the seed, the variable and the record instead of
+        the random streams of the strata, so they differ.
+        """
+        from imputegaps.chunked import ChunkedImputer
+
+        fitted_statistics = ChunkedImputer(
+            self, group_by=group_by, drop_dimensions=drop_dimensions, reservoir_size=reservoir_size
+        )
+        fitted_statistics.update(records_df.reset_index())
+        fitted_statistics.finalize()
+        self.fitted_statistics = fitted_statistics
+        logger.info("Fitted the statistics of %d records", fitted_statistics.number_of_records)
+        return self
+
+    def transform(self, records_df: DataFrameType) -> DataFrameType:
+        """
+        Impute the missing values with the statistics of :meth:`fit` or :meth:`load`.
+
+        Parameters
+        ----------
+        records_df: DataFrameType
+            DataFrame containing variables with missing values and the group_by variables.
+
+        Returns
+        -------
+        DataFrameType:
+            DataFrame with imputed values.
+        """
+        if self.fitted_statistics is None:
+            raise ValueError("The statistics are not fitted yet. Call fit or load first.")
+
+        original_indices = records_df.index.names
+        records_df = self.fitted_statistics.transform(records_df.reset_index())
+        if None not in original_indices:
+            records_df.set_index(original_indices, inplace=True)
+        return records_df
+
+    def save(self, filename):
+        """
+        Write the statistics of :meth:`fit` to a Parquet file.
+
+        Parameters
+        ----------
+        filename: str or Path
+            Name of the Parquet file. It has one row per stratum of each level, see
+            *ChunkedImputer.to_frame*.
+        """
+        if self.fitted_statistics is None:
+            raise ValueError("The statistics are not fitted yet. Call fit first.")
+        import_pyarrow()
+        self.fitted_statistics.to_frame().to_parquet(filename, index=False)
+
+    def load(self, filename) -> "ImputeGaps":
+        """
+        Read the statistics which were written by :meth:`save`.
+
+        Parameters
+        ----------
+        filename: str or Path
+            Name of the Parquet file.
+
+        Returns
+        -------
+        ImputeGaps:
+            The imputer itself, ready for :meth:`transform`.
+
+        Notes
+        -----
+        The settings of the variables, the min_threshold and the seed are those of this imputer.
+        """
+        from imputegaps.chunked import ChunkedImputer
+
+        import_pyarrow()
+        self.fitted_statistics = ChunkedImputer.from_frame(self, pd.read_parquet(filename))
+        return self
+
+    @property
+    def plan(self) -> ImputationPlan:
+        """
+        The imputation plan of the variables, which is made once and reused by all levels and calls.
+
+        Returns
+        -------
+        ImputationPlan:
+            The settings of all variables. The plan is made again if variables or
+            imputation_methods is replaced, but not if one of them is changed in place.
+        """
+        sources = (self.variables, self.imputation_methods)
+        if self._plan is None or any(new is not old for new, old in zip(sources, self._plan_sources)):
+            self._plan = ImputationPlan(self.variables, self.imputation_methods)
+            self._plan_sources = sources
+        return self._plan
+
+    def explain(self, records_df: DataFrameType = None) -> pd.DataFrame:
+        """
+        Show the work of the imputation per variable, see :meth:`ImputationPlan.explain`.
+
+        Parameters
+        ----------
+        records_df: DataFrameType
+            If given, only the variables which are columns of records_df are shown, with their
+            number of gaps.
+
+        Returns
+        -------
+        pd.DataFrame:
+            One row per variable with its imputation method, expressions, target dtype, source
+            columns and the reason why it is skipped, if so.
+        """
+        return self.plan.explain(records_df)
+
+    def _variable_settings(self, col_name: str) -> dict | None:
+        """
+        Get the imputation settings of one variable from the plan.
+
+        Parameters
+        ----------
+        col_name: str
+            Name of the variable.
+
+        Returns
+        -------
+        dict or None:
+            Dictionary with the var_type, the imputation method 'how', the filter, the set_nan_eval
+            expression, whether the variable must be converted to a category, the target dtype and
+            the referenced and source columns, see :class:`imputegaps.plan.ImputationPlan`. None if
+            the variable must not be imputed.
+        """
+        return self.plan.settings_for(col_name)
+
+    @staticmethod
+    def _mask_to_impute(masks: MaskEvaluator, col_name: str, settings: dict) -> np.ndarray:
+        """
+        Evaluate the filter and the set_nan_eval expression of a variable.
+
+        Parameters
+        ----------
+        masks: MaskEvaluator
+            Evaluator of the masks of the records, which shares masks between variables.
+        col_name: str
+            Name of the variable, used for reporting only
+        settings: dict
+            Settings of the variable as returned by _variable_settings.
+
+        Returns
+        -------
+        np.ndarray:
+            Boolean array which is True for the records which take part in the imputation.
+        """
+        number_of_records = len(masks.records_df)
+
+        # If a filter is provided, use it to filter the records
+        var_filter = settings["filter"]
+        mask_filter = np.ones(number_of_records, dtype=bool)
+        if var_filter is not None:
+            try:
+                mask_filter = masks.filter_mask(var_filter)
+            except pd.errors.UndefinedVariableError as err:
+                logger.warning("%s\nImputation filter failed for %s met %s", err, col_name, var_filter)
+
+        # If set_nan_eval is provided, use it to filter the records
+        set_nan_eval = settings["set_nan_eval"]
+        mask_set_nan_eval = np.zeros(number_of_records, dtype=bool)
+        if set_nan_eval is not None:
+            try:
+                mask_set_nan_eval = masks.mask(set_nan_eval)
+            except pd.errors.UndefinedVariableError as err:
+                logger.warning("%s\nSet_nan_eval filter failed for %s met %s", err, col_name, set_nan_eval)
+
+        return mask_filter & ~mask_set_nan_eval
+
+    @staticmethod
+    def _gap_positions(records_df: DataFrameType, col_name: str, residual_gaps: dict) -> np.ndarray:
+        """
+        Get the positions of the gaps of a variable which are still missing.
+
+        Parameters
+        ----------
+        records_df: DataFrameType
+            DataFrame containing variables with missing values.
+        col_name: str
+            Name of the variable.
+        residual_gaps: dict
+            Positions of the remaining gaps per variable, to which the gaps of the variable are
+            added if they are not known yet.
+
+        Returns
+        -------
+        np.ndarray:
+            Sorted positions of the missing values of the variable.
+        """
+        try:
+            return residual_gaps[col_name]
+        except KeyError:
+            gap_positions = np.flatnonzero(records_df[col_name].isnull().to_numpy())
+            residual_gaps[col_name] = gap_positions
+            return gap_positions
+
+    def impute_gaps_for_dimensions(
+        self,
+        records_df: DataFrameType,
+        group_by: list | None = None,
+        stratum_codes: tuple | None = None,
+        masks: MaskEvaluator | None = None,
+        executor: Executor | None = None,
+        residual_gaps: dict | None = None,
+    ) -> DataFrameType:
+        """
+        Impute all missing values in a dataframe for a particular subset (aka stratum).
+
+        Parameters
+        ----------
+        records_df: DataFrameType
+            DataFrame containing variables with missing values.
+        group_by: list
+            The variables which define the strata, either columns or index levels of records_df.
+        stratum_codes: tuple
+            Tuple (codes, number_of_strata) with the integer stratum code of each record, as
+            returned by :func:`imputegaps.kernels.factorize_levels`. Derived from group_by if not
+            given.
+        masks: MaskEvaluator
+            Evaluator of the filter masks of records_df, shared between calls. A new one is made if
+            not given.
+        executor: Executor
+            Pool which imputes the independent variables in parallel. If not given, a pool is
+            started for this call if n_jobs is larger than 1.
+        residual_gaps: dict
+            Positions of the gaps of each variable which are still missing, shared between the
+            levels of drop_dimensions and updated with the gaps which are filled. The gaps of a
+            variable are looked up in records_df the first time. Only valid as long as records_df
+            is changed by the imputation only.
+
+        Returns
+        -------
+        DataFrameType:
+            DataFrame with imputed values for indices group_by.
+
+        Notes
+        -----
+        With track_imputed, the rows of records_df must be in the same order as the rows of
+        imputed_df. A variable without residual gaps is skipped before its masks are evaluated, and
+        only the records of the strata which still have gaps are passed to the kernels, so a coarser
+        level costs time in proportion to the gaps which are left by the deeper levels.
+        """
+        if executor is None and self.n_jobs > 1:
+            with self.start_executor() as executor:
+                return self.impute_gaps_for_dimensions(
+                    records_df,
+                    group_by=group_by,
+                    stratum_codes=stratum_codes,
+                    masks=masks,
+                    executor=executor,
+                    residual_gaps=residual_gaps,
                 )
-                return imputed_col
 
-            # Iterate over the variables in the group_by-list and try to impute until there are no
-            # more missing values
-            if group_by:
-                df_grouped = col_to_impute.groupby(group_by, group_keys=False)  # Do group by
-                col_to_impute = df_grouped.apply(fill_gaps)  # Impute missing values
+        group_by = group_by or []
+        keys = [
+            records_df[name] if name in records_df.columns else records_df.index.get_level_values(name)
+            for name in group_by
+        ]
+        if stratum_codes is None:
+            stratum_codes = factorize_strata(keys, size=len(records_df))
+        codes, number_of_strata = stratum_codes
+        if masks is None or masks.records_df is not records_df:
+            masks = MaskEvaluator(records_df)
+        if residual_gaps is None:
+            residual_gaps = {}
+
+        # the settings of the variables to impute, which are resolved once by the plan
+        variable_settings = self.plan.for_columns(records_df.columns, exclude=[self.index_key] + group_by)
+
+        # the random streams of pick are keyed by the values of the group_by variables, not by the codes
+        level = ",".join(group_by)
+        stratum_keys = None
+        if any(settings["how"] == "pick" for settings in variable_settings.values()):
+            with self._profiler.stage("", level, "groupby", rows=len(records_df), strata=number_of_strata):
+                stratum_keys = stratum_hashes(keys, size=len(records_df))
+
+        for segment in self._column_batches(records_df, variable_settings):
+            # the variables of a segment do not depend on each other, so their imputations are
+            # prepared first and written back after all of them are done
+            tasks = []
+            for batch in segment:
+                settings = variable_settings[batch[0]]
+                if len(batch) == 1:
+                    task = self._column_task(
+                        records_df,
+                        batch[0],
+                        settings,
+                        group_by,
+                        codes,
+                        number_of_strata,
+                        masks,
+                        stratum_keys,
+                        residual_gaps,
+                    )
+                else:
+                    task = self._batch_task(
+                        records_df,
+                        batch,
+                        settings,
+                        group_by,
+                        codes,
+                        number_of_strata,
+                        masks,
+                        stratum_keys,
+                        residual_gaps,
+                    )
+                if task is not None:
+                    tasks.append(task)
+
+            calls = [(function, kwargs) for function, kwargs, _, _ in tasks]
+            if self.profile:
+                # the kernels are timed where they run, which may be a worker process
+                calls = [(timed_call, {"function": function, "kwargs": kwargs}) for function, kwargs in calls]
+            results = run_tasks(calls, executor=executor)
+            for (_, _, finish, info), result in zip(tasks, results):
+                kernel_entry = {}
+                if self.profile:
+                    result, wall_time = result
+                    kernel_entry = self._profiler.add(
+                        info["variable"], level, "kernel", wall_time, rows=info["rows"], strata=info["strata"]
+                    )
+                with self._profiler.stage(info["variable"], level, "write_back", rows=info["rows"]) as entry:
+                    entry["gaps_filled"] = kernel_entry["gaps_filled"] = finish(result)
+
+        return records_df
+
+    def start_executor(self) -> Executor:
+        """
+        Start the pool which imputes the variables in parallel.
+
+        Returns
+        -------
+        Executor:
+            A thread pool or process pool with n_jobs workers, to be used as a context manager.
+        """
+        if self.executor == "thread":
+            return ThreadPoolExecutor(max_workers=self.n_jobs)
+        return ProcessPoolExecutor(max_workers=self.n_jobs)
+
+    def _column_batches(self, records_df: DataFrameType, variable_settings: dict) -> list:
+        """
+        Divide the variables in segments of independent batches of variables.
+
+        Parameters
+        ----------
+        records_df: DataFrameType
+            DataFrame containing variables with missing values.
+        variable_settings: dict
+            Settings per variable as returned by _variable_settings, in the order of imputation.
+
+        Returns
+        -------
+        list:
+            List of segments, in the order of imputation. A segment is a list of batches, which are
+            lists with the names of the variables which are imputed together.
+
+        Notes
+        -----
+        A batch contains float variables with the same method, filter and set_nan_eval expression,
+        which are imputed with one call of :func:`imputegaps.kernels.impute_arrays`. A variable
+        which is used in a filter or set_nan_eval expression is a segment on its own and is never
+        moved across other variables, so each variable sees the same masks as in a column by column
+        imputation. The batches of a segment do not depend on each other and may be imputed in
+        parallel. If any expression can not be parsed, all variables are imputed one by one.
+        """
+        column_names = list(variable_settings.keys())
+
+        referenced = set()
+        for settings in variable_settings.values():
+            if settings["referenced"] is None:
+                return [[[col_name]] for col_name in column_names]
+            referenced |= settings["referenced"]
+
+        dtypes = records_df.dtypes
+        segments = []
+        segment = {}
+        for col_name in column_names:
+            settings = variable_settings[col_name]
+            if col_name in referenced:
+                # the masks of other variables may change by imputing this variable
+                if segment:
+                    segments.append(list(segment.values()))
+                segments.append([[col_name]])
+                segment = {}
+                continue
+            if (
+                self.batch_columns
+                and settings["how"] in BLOCK_METHODS
+                and not settings["to_category"]
+                and dtypes[col_name].kind == "f"
+            ):
+                batch_key = (settings["how"], settings["filter"], settings["set_nan_eval"])
             else:
-                # for imputation on the whole column, we don't need to apply but just fill_gaps
-                col_to_impute = fill_missing_data(
-                    col_to_impute,
-                    invalid_donors=invalid_donors,
-                    how=how,
-                    min_threshold=self.min_threshold,
-                    col_name=col_name,
-                    seed=self.seed,
-                )
+                batch_key = col_name
+            segment.setdefault(batch_key, []).append(col_name)
+        if segment:
+            segments.append(list(segment.values()))
 
-            number_of_nans_after = col_to_impute.isnull().sum()
+        return segments
 
-            number_of_removed_nans = number_of_nans_before - number_of_nans_after
+    def _column_task(
+        self,
+        records_df: DataFrameType,
+        col_name: str,
+        settings: dict,
+        group_by: list,
+        codes: np.ndarray,
+        number_of_strata: int,
+        masks: MaskEvaluator,
+        stratum_keys: np.ndarray | None = None,
+        residual_gaps: dict | None = None,
+    ) -> tuple | None:
+        """
+        Prepare the imputation of one variable for all strata of a level.
 
-            if number_of_removed_nans == 0 and number_of_nans_before > 0:
-                logger.info(
-                    "Imputing %s in stratum %s - Didn't impute any gap: %d gaps imputed / %d gaps remaining",
-                    col_name,
-                    group_by,
-                    number_of_removed_nans,
-                    number_of_nans_after,
-                )
-            elif number_of_nans_after > 0:
-                logger.info(
-                    "Imputing %s in stratum %s - Didn't impute all gaps: %d gaps imputed / %d gaps remaining",
-                    col_name,
-                    group_by,
-                    number_of_removed_nans,
-                    number_of_nans_after,
-                )
-            elif number_of_nans_after == 0:
-                column_size = col_to_impute.size
-                percentage_replaced = round(100 * number_of_nans_before / column_size, 1)
-                logger.info(
-                    "Imputing %s in stratum %s - Successfully imputed all %d/%d (%.1f %%) gaps.",
-                    col_name,
-                    group_by,
-                    number_of_nans_before,
-                    column_size,
-                    percentage_replaced,
-                )
+        Returns
+        -------
+        tuple or None:
+            (function, kwargs, finish, info). The imputed column is function(**kwargs), which is
+            written back into records_df by finish(result), which returns the number of filled
+            gaps and removes them from residual_gaps. info holds the name of the variable, the
+            number of rows and, when profiling, the number of strata with gaps. None if the variable
+            can not be imputed.
+        """
+        how = settings["how"]
+        if residual_gaps is None:
+            residual_gaps = {}
+
+        # a variable of which all gaps were filled on a deeper level is done
+        gap_positions = self._gap_positions(records_df, col_name, residual_gaps)
+        if gap_positions.size == 0:
+            logger.debug("Skip imputing %s. It has no missing values.", col_name)
+            return None
+
+        with self._profiler.stage(col_name, ",".join(group_by), "filter", rows=len(records_df)):
+            mask_to_impute = self._mask_to_impute(masks, col_name, settings)
+        filtered_gaps = gap_positions[mask_to_impute[gap_positions]]
+
+        # Skip if there is only missing values, counted over all strata, as nan and pick1 also fill
+        # the strata without donors
+        if filtered_gaps.size == np.count_nonzero(mask_to_impute):
+            logger.debug("Skip imputing %s. It has only missing values", col_name)
+            return None
+
+        # only the strata with gaps take part, the other strata need no statistic
+        in_strata = strata_with_recipients(codes, filtered_gaps, number_of_strata)
+        positions = np.flatnonzero(mask_to_impute & in_strata)
+        col_to_impute = records_df[col_name].iloc[positions]
+
+        if self.track_imputed:
+            # the imputed flags are aligned by position with the records
+            invalid_donors = self.imputed_df[col_name].to_numpy(dtype=bool)[positions]
+        else:
+            invalid_donors = None
+
+        start_type = col_to_impute.dtype
+
+        # Compute number of missing values
+        mask_is_na = col_to_impute.isnull().to_numpy()
+        number_of_nans_before = mask_is_na.sum()
+        column_size = col_to_impute.size
+
+        # Skip if there are no missing values
+        if number_of_nans_before == 0:
+            logger.debug("Skip imputing %s. It has no missing values.", col_name)
+            return None
+
+        logger.debug("Impute gaps {:20s} ({})".format(col_name, settings["var_type"]))
+        percentage_to_replace = round(100 * number_of_nans_before / column_size, 1)
+        logger.debug(
+            "Filling %s with %d / %d nans (%.1f %%)",
+            col_name,
+            number_of_nans_before,
+            column_size,
+            percentage_to_replace,
+        )
+
+        # Convert categorical (dict) variables to categorical
+        if settings["to_category"]:
+            col_to_impute = col_to_impute.astype("category")
+
+        if how in GROUPED_STATISTICS:
+            col_to_impute = numeric_column(col_to_impute)
+            if col_to_impute is None:
+                logger.warning("Can not take the %s of the non-numeric variable %s", how, col_name)
+                return None
+
+        # Impute the gaps of all strata at once
+        kwargs = dict(
+            column=col_to_impute,
+            invalid_donors=invalid_donors,
+            col_name=col_name,
+            how=how,
+            min_threshold=self.min_threshold,
+            stratum_codes=(codes[positions], number_of_strata),
+            max_donors=self.max_donors,
+        )
+        if how == "pick":
+            kwargs["rng"] = StratumStreams(self.stream_seed, [col_name], stratum_keys[positions])
+        info = {"variable": col_name, "rows": column_size, "strata": 0}
+        if self.profile:
+            info["strata"] = np.unique(codes[positions[mask_is_na]]).size
+
+        def finish(imputed_column):
+            number_of_nans_after = imputed_column.isnull().sum()
+            log_imputation_result(col_name, group_by, number_of_nans_before, number_of_nans_after, column_size)
+
+            # Replace original column by imputed column
+            mask_imputed = mask_is_na & imputed_column.notnull().to_numpy()
+            if isinstance(start_type, pd.CategoricalDtype):
+                # values which are no category yet, such as the 0 of nan, are added by fill_positions
+                imputed_values = imputed_column.to_numpy()[mask_imputed]
             else:
-                logger.warning(
-                    "Imputing based on stratum %s - Something went wrong with imputing gaps for %s.", group_by, col_name
+                try:
+                    imputed_values = imputed_column.astype(start_type).to_numpy()[mask_imputed]
+                except (TypeError, ValueError):
+                    # the mean or median of an integer variable is kept as float
+                    imputed_values = imputed_column.to_numpy()[mask_imputed]
+            records_df[col_name] = fill_positions(records_df[col_name], positions[mask_imputed], imputed_values)
+            masks.invalidate(col_name)
+            residual_gaps[col_name] = np.setdiff1d(gap_positions, positions[mask_imputed], assume_unique=True)
+            return int(mask_imputed.sum())
+
+        return fill_missing_data_grouped, kwargs, finish, info
+
+    def _batch_task(
+        self,
+        records_df: DataFrameType,
+        col_names: list,
+        settings: dict,
+        group_by: list,
+        codes: np.ndarray,
+        number_of_strata: int,
+        masks: MaskEvaluator,
+        stratum_keys: np.ndarray | None = None,
+        residual_gaps: dict | None = None,
+    ) -> tuple | None:
+        """
+        Prepare the imputation of a batch of float variables with the same settings.
+
+        Returns
+        -------
+        tuple or None:
+            (function, kwargs, finish, info) as for _column_task. None if none of the variables can
+            be imputed.
+        """
+        how = settings["how"]
+        if residual_gaps is None:
+            residual_gaps = {}
+
+        # the variables of which all gaps were filled on a deeper level are done
+        gap_positions = {col_name: self._gap_positions(records_df, col_name, residual_gaps) for col_name in col_names}
+        for col_name in col_names:
+            if gap_positions[col_name].size == 0:
+                logger.debug("Skip imputing %s. It has no missing values.", col_name)
+        col_names = [col_name for col_name in col_names if gap_positions[col_name].size > 0]
+        if not col_names:
+            return None
+
+        # the variables of a batch share the filter and set_nan_eval expression
+        with self._profiler.stage(", ".join(col_names), ",".join(group_by), "filter", rows=len(records_df)):
+            mask_to_impute = self._mask_to_impute(masks, col_names[0], settings)
+        filtered_gaps = {
+            col_name: gap_positions[col_name][mask_to_impute[gap_positions[col_name]]] for col_name in col_names
+        }
+
+        # Skip the variables with only missing values, counted over all strata as in _column_task
+        filtered_size = np.count_nonzero(mask_to_impute)
+        selection = []
+        for col_name in col_names:
+            if filtered_gaps[col_name].size == 0:
+                logger.debug("Skip imputing %s. It has no missing values.", col_name)
+            elif filtered_gaps[col_name].size == filtered_size:
+                logger.debug("Skip imputing %s. It has only missing values", col_name)
+            else:
+                selection.append(col_name)
+        if not selection:
+            return None
+        col_names = selection
+
+        # only the strata in which any of the variables has gaps take part
+        recipient_positions = np.concatenate([filtered_gaps[col_name] for col_name in col_names])
+        positions = np.flatnonzero(
+            mask_to_impute & strata_with_recipients(codes, recipient_positions, number_of_strata)
+        )
+        column_size = positions.size
+
+        values = records_df[col_names].iloc[positions].to_numpy(dtype=np.float64, na_value=np.nan)
+        numbers_of_nans_before = np.isnan(values).sum(axis=0)
+        # the gaps of which a group_by key is missing belong to no stratum of this level
+        selection = np.flatnonzero(numbers_of_nans_before > 0)
+        if selection.size == 0:
+            return None
+        col_names = [col_names[index] for index in selection]
+        values = values[:, selection]
+        numbers_of_nans_before = numbers_of_nans_before[selection]
+        logger.debug("Impute gaps of %d variables with the %s at once", len(col_names), how)
+
+        if self.track_imputed:
+            donor_mask = ~self.imputed_df[col_names].to_numpy(dtype=bool)[positions]
+        else:
+            donor_mask = None
+
+        kwargs = dict(
+            values=values,
+            stratum_codes=codes[positions],
+            donor_mask=donor_mask,
+            method=how,
+            min_threshold=self.min_threshold,
+            number_of_strata=number_of_strata,
+            col_name=", ".join(col_names),
+            max_donors=self.max_donors,
+        )
+        if how == "pick":
+            kwargs["rng"] = StratumStreams(self.stream_seed, col_names, stratum_keys[positions])
+        info = {"variable": ", ".join(col_names), "rows": column_size, "strata": 0}
+        if self.profile:
+            info["strata"] = np.unique(codes[positions[np.isnan(values).any(axis=1)]]).size
+
+        def finish(result):
+            filled_values, mask_imputed = result
+            numbers_of_nans_after = numbers_of_nans_before - mask_imputed.sum(axis=0)
+            for index, col_name in enumerate(col_names):
+                log_imputation_result(
+                    col_name, group_by, numbers_of_nans_before[index], numbers_of_nans_after[index], column_size
                 )
 
-            # Replace original column by imputed column
-            records_df[col_name] = records_df[col_name].where(
-                records_df[col_name].notna(), col_to_impute.astype(start_type)
-            )
+            # Replace the original columns by the imputed columns
+            if (records_df.dtypes[col_names] == np.float64).all():
+                block = records_df[col_names].to_numpy(copy=True)
+                block[positions] = np.where(mask_imputed, filled_values, block[positions])
+                records_df[col_names] = block
+            else:
+                for index, col_name in enumerate(col_names):
+                    start_type = records_df[col_name].dtype
+                    imputed_values = pd.Series(filled_values[mask_imputed[:, index], index]).astype(start_type)
+                    records_df[col_name] = fill_positions(
+                        records_df[col_name], positions[mask_imputed[:, index]], imputed_values.to_numpy()
+                    )
+            for index, col_name in enumerate(col_names):
+                masks.invalidate(col_name)
+                residual_gaps[col_name] = np.setdiff1d(
+                    gap_positions[col_name], positions[mask_imputed[:, index]], assume_unique=True
+                )
+            return int(mask_imputed.sum())
 
-        return records_df
+        return impute_arrays, kwargs, finish, info
@@ -0,0 +1,374 @@
+"""
+
+This module provides the imputation of records which are added, removed and changed over time.
+
+The donor statistics per stratum are kept as running sums and counts (mean), value counts (median,
+mode) and donor pools (pick). When records change, the statistics of the strata which contain the
+changed donors are updated and only the gaps which depend on those strata are imputed again. As
+with *impute_gaps(rollup=True)*, only the originally observed values are donors.
+
+Classes:
+--------
+
+IncrementalImputer:
+    Keeps the statistics per stratum up to date with added, removed and changed records.
+"""
+
+import logging
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+from imputegaps.chunked import ChunkedImputer, level_keys
+from imputegaps.impute_gaps import fill_positions
+from imputegaps.kernels import GROUPED_STATISTICS
+from imputegaps.masks import MaskEvaluator
+from imputegaps.streams import hash_uniforms
+
+logger = logging.getLogger(__name__)
+
+DataFrameType = Union["pd.DataFrame", None]
+
+VALUE = "_value"
+RECORD = "_record"
+
+
+class IncrementalImputer:
+    """
+    Impute records of which some are added, removed or changed after the first imputation.
+
+    Arguments
+    ---------
+    imputer: ImputeGaps
+        Imputer with the settings of the variables, the min_threshold and the seed.
+    group_by: list
+        The variables by which the records should be grouped. The first variable is the most
+        important one.
+    drop_dimensions: bool
+        If True, gaps which can not be imputed in the strata of all group_by variables are
+        imputed in the strata of the coarser levels, until finally the whole column is used.
+
+    Notes
+    -----
+    The records are identified by their index, which must be unique. Call :meth:`fit` with the
+    first records, then :meth:`update` with the changes, and :meth:`imputed_records` to get the
+    records with the imputed values.
+
+    The result equals that of :meth:`fit` with all current records, up to the rounding of the
+    running sums of mean. The donor which pick draws for a gap only depends on the seed, the
+    variable, the record and the donors of its stratum, so it does not change when other strata
+    change.
+
+    The filter and set_nan_eval expressions are evaluated per record.
+    """
+
+    def __init__(self, imputer, group_by: list, drop_dimensions: bool = False):
+        self.imputer = imputer
+        self.group_by = list(group_by)
+        self.levels = [tuple(self.group_by[:max_dim]) for max_dim in range(len(self.group_by), -1, -1)]
+        if not drop_dimensions:
+            self.levels = self.levels[:1]
+        self.min_threshold = max(imputer.min_threshold or 1, 1)
+
+        self.records_df = None
+        self.statistics = {}
+        self._accumulators = {}
+        self._pools = {}
+        # per variable, the level at which each gap was imputed (len(levels) if not) and the imputed values
+        self._resolved = {}
+        self._imputed = {}
+
+    def _variable_settings(self, col_name: str) -> dict | None:
+        """
+        Get the settings of a variable from the plan of the imputer.
+        """
+        if col_name in self.group_by:
+            return None
+        return self.imputer.plan.settings_for(col_name)
+
+    def fit(self, records_df: DataFrameType) -> "IncrementalImputer":
+        """
+        Collect the statistics of the records and impute all their gaps.
+
+        Parameters
+        ----------
+        records_df: DataFrameType
+            Records indexed by their identifier, with the group_by variables as columns.
+
+        Returns
+        -------
+        IncrementalImputer:
+            The imputer itself.
+        """
+        self.records_df = records_df.iloc[:0].copy()
+        self.statistics = {}
+        self._accumulators = {}
+        self._pools = {}
+        self._resolved = {}
+        self._imputed = {}
+        return self.update(added=records_df)
+
+    def update(
+        self,
+        added: DataFrameType = None,
+        removed=None,
+        changed: DataFrameType = None,
+    ) -> "IncrementalImputer":
+        """
+        Update the statistics with changed records and impute the gaps which depend on them.
+
+        Parameters
+        ----------
+        added: DataFrameType
+            New records, indexed by their identifier.
+        removed: array-like
+            Identifiers of the records which are removed.
+        changed: DataFrameType
+            New values of existing records, indexed by their identifier. Only the given columns
+            are changed.
+
+        Returns
+        -------
+        IncrementalImputer:
+            The imputer itself.
+        """
+        removed_ids = pd.Index([] if removed is None else removed)
+        changed_ids = pd.Index([]) if changed is None else changed.index
+        old_ids = removed_ids.append(changed_ids)
+        old_df = self.records_df.loc[old_ids]
+
+        # apply the changes to the records, which keep their order
+        if changed is not None:
+            self.records_df.loc[changed_ids, changed.columns] = changed
+        self.records_df = self.records_df.drop(index=removed_ids)
+        new_df = self.records_df.loc[changed_ids]
+        if added is not None:
+            self.records_df = added.copy() if self.records_df.empty else pd.concat([self.records_df, added])
+            new_df = added if new_df.empty else pd.concat([new_df, added])
+
+        old_masks = MaskEvaluator(old_df)
+        new_masks = MaskEvaluator(new_df)
+        for col_name in self.records_df.columns:
+            settings = self._variable_settings(col_name)
+            if settings is None:
+                continue
+            how = settings["how"]
+            if how in GROUPED_STATISTICS and not pd.api.types.is_numeric_dtype(self.records_df[col_name].dtype):
+                logger.debug("Can not take the %s of the non-numeric variable %s", how, col_name)
+                continue
+
+            had_donors = self._has_donors(col_name)
+            affected = {}
+            if not old_df.empty:
+                self._accumulate(col_name, settings, old_df, old_masks, -1, affected)
+            if not new_df.empty:
+                self._accumulate(col_name, settings, new_df, new_masks, 1, affected)
+            for level, strata in affected.items():
+                self._update_statistics(col_name, how, level, strata.unique())
+
+            resolved = self._resolved.get(col_name, pd.Series([], dtype=np.int64))
+            imputed = self._imputed.get(col_name, pd.Series([], dtype=object))
+            resolved = resolved.drop(index=old_ids, errors="ignore")
+            imputed = imputed.drop(index=old_ids, errors="ignore")
+            if had_donors != self._has_donors(col_name):
+                # all gaps are imputed again once the first donor arrives or the last one leaves
+                redo = resolved.index
+            else:
+                redo = self._dependent_gaps(resolved, affected)
+            mask_to_impute = self.imputer._mask_to_impute(new_masks, col_name, settings)
+            new_gaps = new_df.index[new_df[col_name].isnull().to_numpy() & mask_to_impute]
+            gap_ids = redo.append(new_gaps)
+
+            depths, values = self._impute(col_name, how, gap_ids)
+            self._resolved[col_name] = pd.concat([resolved.drop(index=redo), pd.Series(depths, index=gap_ids)])
+            self._imputed[col_name] = pd.concat(
+                [imputed.drop(index=redo, errors="ignore"), pd.Series(values, index=gap_ids[depths < len(self.levels)])]
+            )
+            logger.debug("Imputed %d changed and %d new gaps of %s", redo.size, new_gaps.size, col_name)
+
+        return self
+
+    def _accumulate(self, col_name: str, settings: dict, delta_df, masks, sign: int, affected: dict):
+        """
+        Add (sign 1) or subtract (sign -1) the donors of records to the running statistics.
+        """
+        how = settings["how"]
+        column = delta_df[col_name]
+        donor_mask = column.notnull().to_numpy() & self.imputer._mask_to_impute(masks, col_name, settings)
+        donor_keys = delta_df.loc[donor_mask, self.group_by]
+        values = column[donor_mask]
+
+        for level in self.levels:
+            keys = level_keys(donor_keys, level)
+            if how == "mean":
+                part = values.groupby(keys).agg(["count", "sum"])
+            elif how in ("median", "mode"):
+                part = values.groupby(keys + [values.rename(VALUE)]).size()
+            else:
+                part = values.groupby(keys).size()
+                if how == "pick":
+                    self._update_pool(col_name, level, keys, values, sign)
+            accumulator = self._accumulators.get((col_name, level))
+            accumulator = sign * part if accumulator is None else accumulator.add(sign * part, fill_value=0)
+            if how == "mean":
+                accumulator = accumulator[accumulator["count"] > 0].astype({"count": np.int64})
+            else:
+                accumulator = accumulator[accumulator > 0].astype(np.int64)
+            self._accumulators[(col_name, level)] = accumulator
+
+            strata = part.index if how not in ("median", "mode") else part.index.droplevel(-1)
+            affected[level] = strata if level not in affected else affected[level].append(strata)
+
+    def _update_pool(self, col_name: str, level: tuple, keys: list, values: pd.Series, sign: int):
+        """
+        Add the donors to or remove them from the pool of donors, indexed by stratum and record.
+        """
+        index = pd.MultiIndex.from_arrays(
+            [key.to_numpy() for key in keys] + [values.index], names=[key.name for key in keys] + [RECORD]
+        )
+        donors = pd.Series(values.to_numpy(), index=index).loc[np.logical_and.reduce([key.notnull() for key in keys])]
+        pool = self._pools.get((col_name, level))
+        if sign < 0:
+            self._pools[(col_name, level)] = pool.drop(index=donors.index)
+        else:
+            self._pools[(col_name, level)] = donors if pool is None else pd.concat([pool, donors])
+
+    def _update_statistics(self, col_name: str, how: str, level: tuple, strata: pd.Index):
+        """
+        Compute the number of donors and the imputed value of the given strata again.
+        """
+        accumulator = self._accumulators[(col_name, level)]
+        if how in ("median", "mode"):
+            selection = accumulator[accumulator.index.droplevel(-1).isin(strata)]
+            if selection.empty:
+                table = pd.DataFrame({"count": np.array([], dtype=np.int64), "value": []})
+            else:
+                table = ChunkedImputer._value_count_statistics(selection, how)
+        else:
+            selection = accumulator[accumulator.index.isin(strata)]
+            if how == "mean":
+                table = pd.DataFrame({"count": selection["count"], "value": selection["sum"] / selection["count"]})
+            else:
+                table = selection.rename("count").to_frame()
+
+        statistics = self.statistics.get((col_name, level))
+        if statistics is None:
+            self.statistics[(col_name, level)] = table
+        else:
+            statistics = statistics[~statistics.index.isin(strata)]
+            self.statistics[(col_name, level)] = pd.concat([statistics, table]) if len(table) else statistics
+
+    def _has_donors(self, col_name: str) -> bool:
+        table = self.statistics.get((col_name, self.levels[-1]))
+        return table is not None and table["count"].sum() > 0
+
+    def _dependent_gaps(self, resolved: pd.Series, affected: dict) -> pd.Index:
+        """
+        Select the gaps of which a stratum changed on a level up to the level at which they are imputed.
+        """
+        redo = np.zeros(len(resolved), dtype=bool)
+        depths = resolved.to_numpy()
+        for depth, level in enumerate(self.levels):
+            strata = affected.get(level)
+            candidates = np.flatnonzero(~redo & (depths >= depth))
+            if strata is None or candidates.size == 0:
+                continue
+            if not level:
+                # the whole column is one stratum
+                redo[candidates] = True
+                continue
+            keys_df = self.records_df.loc[resolved.index[candidates], list(level)]
+            # select on each key, which is cheaper than combining the keys of all gaps
+            selection = np.logical_and.reduce(
+                [keys_df[name].isin(strata.get_level_values(index)).to_numpy() for index, name in enumerate(level)]
+            )
+            if len(level) > 1:
+                selection[selection] = _key_index([keys_df[name][selection] for name in level]).isin(strata)
+            redo[candidates[selection]] = True
+        return resolved.index[redo]
+
+    def _impute(self, col_name: str, how: str, gap_ids: pd.Index) -> tuple:
+        """
+        Impute gaps from the deepest level with enough donors.
+
+        Returns
+        -------
+        tuple:
+            The level at which each gap is imputed (len(levels) if it is not) and the imputed
+            values, in the order of the gaps.
+        """
+        depths = np.full(gap_ids.size, len(self.levels), dtype=np.int64)
+        if gap_ids.size == 0 or not self._has_donors(col_name):
+            return depths, np.array([], dtype=object)
+        gaps_df = self.records_df.loc[gap_ids]
+
+        values = np.empty(gap_ids.size, dtype=object)
+        remaining = np.arange(gap_ids.size)
+        for depth, level in enumerate(self.levels):
+            keys = level_keys(gaps_df.iloc[remaining], level)
+            has_key = np.logical_and.reduce([key.notnull().to_numpy() for key in keys])
+            if how in ("nan", "pick1"):
+                selection = has_key
+                level_values = np.full(selection.sum(), fill_value=0 if how == "nan" else 1)
+            else:
+                table = self.statistics[(col_name, level)]
+                index = table.index.get_indexer(_key_index(keys))
+                index[~has_key] = -1
+                selection = index >= 0
+                selection[selection] = table["count"].to_numpy()[index[selection]] >= self.min_threshold
+                if how == "pick":
+                    level_values = self._draw(
+                        col_name, level, [key[selection] for key in keys], gap_ids[remaining[selection]]
+                    )
+                else:
+                    level_values = table["value"].to_numpy()[index[selection]]
+
+            depths[remaining[selection]] = depth
+            values[remaining[selection]] = level_values
+            remaining = remaining[~selection]
+            if remaining.size == 0:
+                break
+
+        return depths, values[depths < len(self.levels)]
+
+    def _draw(self, col_name: str, level: tuple, keys: list, gap_ids: pd.Index) -> np.ndarray:
+        """
+        Draw a donor of the stratum of each gap, which only depends on the gap and the donors of its stratum.
+        """
+        pool = self._pools[(col_name, level)]
+        strata = _key_index(keys)
+        donors = pool[pool.index.droplevel(-1).isin(strata)].sort_index()
+        codes, uniques = pd.factorize(donors.index.droplevel(-1))
+        sizes = np.bincount(codes, minlength=len(uniques))
+        starts = np.cumsum(sizes) - sizes
+        index = uniques.get_indexer(strata)
+        offsets = (hash_uniforms(gap_ids, f"{self.imputer.stream_seed}:{col_name}") * sizes[index]).astype(np.int64)
+        return donors.to_numpy()[starts[index] + offsets]
+
+    def imputed_records(self) -> DataFrameType:
+        """
+        Get the current records with the imputed values.
+
+        Returns
+        -------
+        DataFrameType:
+            Copy of the records with the gaps filled.
+        """
+        records_df = self.records_df.copy()
+        for col_name, imputed in self._imputed.items():
+            if len(imputed) == 0:
+                continue
+            positions = records_df.index.get_indexer(imputed.index)
+            values = imputed.infer_objects().to_numpy()
+            records_df[col_name] = fill_positions(records_df[col_name], positions, values)
+        return records_df
+
+
+def _key_index(keys: list) -> pd.Index:
+    """
+    Combine the keys of a level into an index with one entry per record, ignoring the record index.
+    """
+    if len(keys) == 1:
+        return pd.Index(keys[0].to_numpy(), name=keys[0].name)
+    return pd.MultiIndex.from_arrays([key.to_numpy() for key in keys], names=[key.name for key in keys])
@@ -0,0 +1,202 @@
+"""
+
+This module provides the optional compiled kernels of the methods which do not map onto a
+vectorized NumPy reduction. The kernels are compiled with numba if it is installed and cached on
+disk, so a new process loads them instead of compiling them again.
+
+Functions:
+----------
+
+njit:
+    Compile a function with numba and cache it on disk, or return it unchanged without numba.
+grouped_median:
+    Compute the donor count and the median of the donors per stratum in one pass.
+grouped_float_mode:
+    Compute the donor count and the most frequent value of the donors per stratum of a float column.
+segment_donors:
+    Sort the donors by stratum with a counting sort.
+"""
+
+import logging
+import os
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+logger = logging.getLogger(__name__)
+
+NUMBA_AVAILABLE = numba is not None
+# the kernels are only used when they are compiled; set IMPUTEGAPS_NUMBA=0 to use the NumPy kernels
+USE_NUMBA = NUMBA_AVAILABLE and os.environ.get("IMPUTEGAPS_NUMBA", "1") != "0"
+
+
+def njit(function):
+    """
+    Compile a function with numba and cache it on disk, or return it unchanged without numba.
+
+    Parameters
+    ----------
+    function: callable
+        Function of which the body only uses the subset of Python and NumPy which numba supports.
+
+    Returns
+    -------
+    callable:
+        The function, which is compiled at its first call. The compiled code is kept in the
+        __pycache__ directory next to this module, or in NUMBA_CACHE_DIR if that is set.
+    """
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+@njit
+def _donor_segments(stratum_codes, donor_mask, number_of_strata):
+    """
+    Count the donors per stratum and find the start of the segment of each stratum.
+    """
+    counts = np.zeros(number_of_strata, dtype=np.int64)
+    for index in range(stratum_codes.size):
+        if donor_mask[index] and stratum_codes[index] >= 0:
+            counts[stratum_codes[index]] += 1
+    starts = np.zeros(number_of_strata + 1, dtype=np.int64)
+    for stratum in range(number_of_strata):
+        starts[stratum + 1] = starts[stratum] + counts[stratum]
+    return counts, starts
+
+
+@njit
+def _scatter_values(values, stratum_codes, donor_mask, starts):
+    """
+    Copy the values of the donors into the segments of their strata, in the order of the records.
+    """
+    number_of_strata = starts.size - 1
+    buffer = np.empty(starts[number_of_strata], dtype=values.dtype)
+    fill = starts[:number_of_strata].copy()
+    for index in range(stratum_codes.size):
+        if donor_mask[index] and stratum_codes[index] >= 0:
+            stratum = stratum_codes[index]
+            buffer[fill[stratum]] = values[index]
+            fill[stratum] += 1
+    return buffer
+
+
+@njit
+def grouped_median(values, stratum_codes, donor_mask, number_of_strata):
+    """
+    Compute the number of valid donors and the median of the donors per stratum.
+
+    Parameters
+    ----------
+    values: np.ndarray
+        Float array with the values of the column.
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record (-1 for records without stratum).
+    donor_mask: np.ndarray
+        Boolean array which is True for the records which may act as donor. The donors must not
+        be NaN.
+    number_of_strata: int
+        Total number of strata.
+
+    Returns
+    -------
+    tuple:
+        (statistic, counts), both arrays of length number_of_strata. The median is NaN for strata
+        without donors.
+    """
+    counts, starts = _donor_segments(stratum_codes, donor_mask, number_of_strata)
+    buffer = _scatter_values(values, stratum_codes, donor_mask, starts)
+    statistic = np.full(number_of_strata, np.nan)
+    for stratum in range(number_of_strata):
+        count = counts[stratum]
+        if count == 0:
+            continue
+        segment = np.sort(buffer[starts[stratum] : starts[stratum + 1]])
+        middle = count // 2
+        if count % 2 == 1:
+            statistic[stratum] = segment[middle]
+        else:
+            statistic[stratum] = (segment[middle - 1] + segment[middle]) / 2
+    return statistic, counts
+
+
+@njit
+def grouped_float_mode(values, stratum_codes, donor_mask, number_of_strata):
+    """
+    Compute the number of valid donors and the most frequent value of the donors per stratum.
+
+    Parameters
+    ----------
+    values: np.ndarray
+        Float array with the values of the column.
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record (-1 for records without stratum).
+    donor_mask: np.ndarray
+        Boolean array which is True for the records which may act as donor. The donors must not
+        be NaN.
+    number_of_strata: int
+        Total number of strata.
+
+    Returns
+    -------
+    tuple:
+        (modes, counts), both arrays of length number_of_strata. If more values occur equally
+        often in a stratum, the smallest value is taken. The mode is NaN for strata without donors.
+    """
+    counts, starts = _donor_segments(stratum_codes, donor_mask, number_of_strata)
+    buffer = _scatter_values(values, stratum_codes, donor_mask, starts)
+    modes = np.full(number_of_strata, np.nan)
+    for stratum in range(number_of_strata):
+        if counts[stratum] == 0:
+            continue
+        segment = np.sort(buffer[starts[stratum] : starts[stratum + 1]])
+        # the runs are visited from the smallest value, so a tie keeps the smallest value
+        best_value = segment[0]
+        best_length = 0
+        run_length = 0
+        for index in range(segment.size):
+            if index > 0 and segment[index] == segment[index - 1]:
+                run_length += 1
+            else:
+                run_length = 1
+            if run_length > best_length:
+                best_length = run_length
+                best_value = segment[index]
+        modes[stratum] = best_value
+    return modes, counts
+
+
+@njit
+def segment_donors(stratum_codes, donor_mask, number_of_strata):
+    """
+    Sort the donors by stratum with a counting sort.
+
+    Parameters
+    ----------
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record (-1 for records without stratum).
+    donor_mask: np.ndarray
+        Boolean array which is True for the records which may act as donor.
+    number_of_strata: int
+        Total number of strata.
+
+    Returns
+    -------
+    tuple:
+        (sorted_donors, counts): the positions of the donors, sorted by stratum and within a
+        stratum in the order of the records, which is the same as a stable sort, and the number of
+        donors per stratum.
+    """
+    counts, starts = _donor_segments(stratum_codes, donor_mask, number_of_strata)
+    sorted_donors = np.empty(starts[number_of_strata], dtype=np.int64)
+    fill = starts[:number_of_strata].copy()
+    for index in range(stratum_codes.size):
+        if donor_mask[index] and stratum_codes[index] >= 0:
+            stratum = stratum_codes[index]
+            sorted_donors[fill[stratum]] = index
+            fill[stratum] += 1
+    return sorted_donors, counts
@@ -0,0 +1,1083 @@
+"""
+
+This module provides the vectorized kernels used to impute all strata of a column at once.
+
+Functions:
+----------
+
+impute_arrays:
+    Impute the gaps of a NumPy array of one or more columns with any imputation method.
+
+factorize_strata:
+    Convert one or more group_by keys into a single integer stratum code per record.
+select_recipients:
+    Select the missing values of the strata with enough valid donors.
+strata_with_recipients:
+    Select the records of the strata which contain a recipient.
+grouped_statistic:
+    Compute the donor count and a statistic (mean, median) per stratum.
+grouped_mode:
+    Compute the donor count and the most frequent value per stratum.
+factorize_levels:
+    Convert the group_by keys into stratum codes for all levels of drop_dimensions.
+fill_grouped:
+    Fill the gaps of a column with the statistic of its stratum in one masked assignment.
+fill_mode_values:
+    Fill the gaps of a column of any type with the mode of its stratum.
+fill_rollup:
+    Fill the gaps of a column from the deepest level of drop_dimensions with enough donors.
+fill_block:
+    Fill the gaps of a block of columns which share the same imputation settings at once.
+sample_donors:
+    Draw a random donor from the stratum of every missing value in one call.
+reservoir_donors:
+    Keep a uniform sample of at most max_donors donors per stratum in one pass.
+"""
+
+import logging
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from imputegaps import jit
+from imputegaps.sketches import level_quantiles
+from imputegaps.streams import StratumStreams, draw_uniforms
+
+logger = logging.getLogger(__name__)
+
+GROUPED_STATISTICS = ("mean", "median")
+ROLLUP_METHODS = GROUPED_STATISTICS + ("mode", "pick")
+BLOCK_METHODS = GROUPED_STATISTICS + ("mode", "pick")
+ARRAY_METHODS = GROUPED_STATISTICS + ("mode", "pick", "nan", "pick1")
+
+# maximum number of (column, stratum) combinations and of values of a block which are imputed in one go
+MAX_BLOCK_STRATA = 2**22
+MAX_BLOCK_VALUES = 2**20
+
+
+def factorize_levels(keys: list, size: int | None = None) -> list:
+    """
+    Convert the group_by keys into integer stratum codes for all levels of drop_dimensions.
+
+    Parameters
+    ----------
+    keys: list
+        List of array-likes (one per group_by variable) with the same length. The first key is the
+        most important one.
+    size: int
+        Number of records. Only needed if *keys* is empty.
+
+    Returns
+    -------
+    list:
+        List of (codes, number_of_strata) tuples, one per level, starting with the deepest level
+        (all keys) and ending with the level without keys, in which all records belong to one
+        stratum. The codes are numbered in the sort order of the keys. Records with a missing value
+        in any of the keys of a level get code -1 on that level.
+    """
+    if size is None:
+        if not keys:
+            raise ValueError("Need the number of records if no keys are given")
+        size = len(keys[0])
+
+    levels = [(np.zeros(size, dtype=np.int64), int(size > 0))]
+    codes = None
+    missing = None
+    for key in keys:
+        key_codes, uniques = pd.factorize(np.asarray(key), sort=True)
+        key_codes = key_codes.astype(np.int64)
+        if codes is None:
+            codes = key_codes
+            missing = key_codes < 0
+        else:
+            # combine the codes and compact them again to prevent an overflow for many keys
+            missing = missing | (key_codes < 0)
+            codes = codes * max(len(uniques), 1) + key_codes
+        codes[missing] = -1
+        valid_codes, _ = pd.factorize(codes[~missing], sort=True)
+        codes[~missing] = valid_codes
+        number_of_strata = int(codes.max()) + 1 if codes.size > 0 else 0
+        levels.insert(0, (codes.copy(), number_of_strata))
+
+    return levels
+
+
+def factorize_strata(keys: list, size: int | None = None) -> tuple:
+    """
+    Convert the group_by keys of a set of records into one integer code per record.
+
+    Parameters
+    ----------
+    keys: list
+        List of array-likes (one per group_by variable) with the same length.
+    size: int
+        Number of records. Only needed if *keys* is empty, in which case all records belong to
+        one stratum.
+
+    Returns
+    -------
+    tuple:
+        (codes, number_of_strata). The codes are numbered in the sort order of the keys. Records
+        with a missing value in any of the keys get code -1 and do not belong to any stratum.
+    """
+    return factorize_levels(keys, size=size)[0]
+
+
+def select_recipients(
+    stratum_codes: np.ndarray,
+    recipient_mask: np.ndarray,
+    counts: np.ndarray,
+    min_threshold: int | None = 1,
+    col_name: str = None,
+) -> np.ndarray:
+    """
+    Select the recipients which belong to a stratum with enough valid donors.
+
+    Parameters
+    ----------
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record (-1 for records without stratum).
+    recipient_mask: np.ndarray
+        Boolean array which is True for the records which need to be imputed.
+    counts: np.ndarray
+        Number of valid donors per stratum.
+    min_threshold: int
+        Minimum number of valid donor records needed for imputation of a stratum.
+    col_name: str
+        Name of the variable, used for reporting only
+
+    Returns
+    -------
+    np.ndarray:
+        Positions of the records which can be imputed.
+    """
+    recipient_positions = np.flatnonzero(recipient_mask & (stratum_codes >= 0))
+    recipient_codes = stratum_codes[recipient_positions]
+
+    # a stratum without any valid donor can never be imputed, also not for min_threshold < 1
+    threshold = 1 if min_threshold is None else max(min_threshold, 1)
+    can_impute = counts[recipient_codes] >= threshold
+
+    number_of_skipped = np.unique(recipient_codes[~can_impute]).size
+    if number_of_skipped > 0:
+        logger.warning(
+            "Imputation not possible for %s in %d strata because of too few valid donor records.",
+            col_name,
+            number_of_skipped,
+        )
+
+    return recipient_positions[can_impute]
+
+
+def strata_with_recipients(
+    stratum_codes: np.ndarray, recipient_positions: np.ndarray, number_of_strata: int
+) -> np.ndarray:
+    """
+    Select the records of the strata which contain at least one recipient.
+
+    Parameters
+    ----------
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record (-1 for records without stratum).
+    recipient_positions: np.ndarray
+        Positions of the records which need to be imputed.
+    number_of_strata: int
+        Total number of strata.
+
+    Returns
+    -------
+    np.ndarray:
+        Boolean array which is True for the records of the strata with a recipient. Records
+        without stratum are never selected.
+    """
+    # the last element is looked up by the records without stratum (-1) and stays False
+    has_recipients = np.zeros(number_of_strata + 1, dtype=bool)
+    has_recipients[stratum_codes[recipient_positions]] = True
+    has_recipients[-1] = False
+    return has_recipients[stratum_codes]
+
+
+def grouped_statistic(
+    values: np.ndarray,
+    stratum_codes: np.ndarray,
+    donor_mask: np.ndarray,
+    number_of_strata: int,
+    how: str = "mean",
+) -> tuple:
+    """
+    Compute the number of valid donors and the statistic of the donors per stratum.
+
+    Parameters
+    ----------
+    values: np.ndarray
+        Float array with the values of the column.
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record (-1 for records without stratum).
+    donor_mask: np.ndarray
+        Boolean array which is True for the records which may act as donor.
+    number_of_strata: int
+        Total number of strata.
+    how: str
+        Statistic to compute: 'mean' or 'median'.
+
+    Returns
+    -------
+    tuple:
+        (statistic, counts), both arrays of length number_of_strata.
+    """
+    donors = donor_mask & (stratum_codes >= 0)
+    donor_codes = stratum_codes[donors]
+    donor_values = values[donors]
+    counts = np.bincount(donor_codes, minlength=number_of_strata)
+
+    if how == "mean":
+        sums = np.bincount(donor_codes, weights=donor_values, minlength=number_of_strata)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            statistic = sums / counts
+    elif how == "median" and jit.USE_NUMBA:
+        statistic, _ = jit.grouped_median(
+            np.ascontiguousarray(values, dtype=np.float64), stratum_codes, donors, number_of_strata
+        )
+    elif how == "median":
+        medians = pd.Series(donor_values).groupby(donor_codes).median()
+        statistic = np.full(number_of_strata, np.nan)
+        statistic[medians.index.to_numpy()] = medians.to_numpy()
+    else:
+        raise ValueError(f"Not a valid grouped statistic: {how}.")
+
+    return statistic, counts
+
+
+def grouped_mode(
+    value_codes: np.ndarray,
+    stratum_codes: np.ndarray,
+    donor_mask: np.ndarray,
+    number_of_strata: int,
+) -> tuple:
+    """
+    Compute the number of valid donors and the most frequent value of the donors per stratum.
+
+    Parameters
+    ----------
+    value_codes: np.ndarray
+        Integer array with the factorized values of the column (-1 for missing values). The codes
+        must follow the sort order of the values.
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record (-1 for records without stratum).
+    donor_mask: np.ndarray
+        Boolean array which is True for the records which may act as donor.
+    number_of_strata: int
+        Total number of strata.
+
+    Returns
+    -------
+    tuple:
+        (mode_codes, counts), both arrays of length number_of_strata. The mode code is -1 for
+        strata without donors.
+
+    Notes
+    -----
+    All (stratum, value) pairs are counted at once. If more values occur equally often in a
+    stratum, the smallest value is taken, which is the same as the first value of *Series.mode()*.
+    """
+    donors = donor_mask & (stratum_codes >= 0) & (value_codes >= 0)
+    donor_codes = stratum_codes[donors]
+    counts = np.bincount(donor_codes, minlength=number_of_strata)
+
+    number_of_values = int(value_codes.max()) + 1 if value_codes.size > 0 else 0
+    pairs, pair_counts = np.unique(donor_codes * max(number_of_values, 1) + value_codes[donors], return_counts=True)
+    pair_strata, pair_values = np.divmod(pairs, max(number_of_values, 1))
+
+    # the pairs are sorted on stratum and value, so the first pair with the highest frequency of
+    # a stratum has the smallest value
+    is_first = np.ones(pair_strata.size, dtype=bool)
+    is_first[1:] = pair_strata[1:] != pair_strata[:-1]
+    starts = np.flatnonzero(is_first)
+    max_counts = np.maximum.reduceat(pair_counts, starts) if starts.size > 0 else pair_counts
+    candidates = np.flatnonzero(pair_counts == np.repeat(max_counts, np.diff(starts, append=pair_strata.size)))
+    candidate_strata = pair_strata[candidates]
+    is_first = np.ones(candidates.size, dtype=bool)
+    is_first[1:] = candidate_strata[1:] != candidate_strata[:-1]
+
+    mode_codes = np.full(number_of_strata, -1, dtype=np.int64)
+    mode_codes[candidate_strata[is_first]] = pair_values[candidates[is_first]]
+
+    return mode_codes, counts
+
+
+def fill_grouped(
+    values: np.ndarray,
+    stratum_codes: np.ndarray,
+    donor_mask: np.ndarray,
+    how: str = "mean",
+    min_threshold: int | None = 1,
+    number_of_strata: int | None = None,
+    col_name: str = None,
+) -> tuple:
+    """
+    Impute the missing values of all strata of one column at once.
+
+    Parameters
+    ----------
+    values: np.ndarray
+        Float array with the values of the column. Missing values are NaN.
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record (-1 for records without stratum).
+    donor_mask: np.ndarray
+        Boolean array which is True for the records which may act as donor. Missing values are
+        never used as donor.
+    how: str
+        Imputation method: 'mean' or 'median'.
+    min_threshold: int
+        Minimum number of valid donor records needed for imputation of a stratum.
+    number_of_strata: int
+        Total number of strata. Derived from the stratum codes if not given.
+    col_name: str
+        Name of the variable, used for reporting only
+
+    Returns
+    -------
+    tuple:
+        (filled_values, imputed_mask). The imputed mask is True for all imputed records.
+
+    Notes
+    -----
+    The result is the same as calling :func:`fill_missing_data` for each stratum separately: strata
+    with fewer than *min_threshold* (and at least one) valid donors are not imputed. The statistic
+    is only calculated for the strata which contain a missing value.
+    """
+    if number_of_strata is None:
+        number_of_strata = int(stratum_codes.max()) + 1 if stratum_codes.size > 0 else 0
+
+    mask_is_na = np.isnan(values)
+    # only the donors of the strata with gaps are aggregated
+    in_strata = strata_with_recipients(stratum_codes, np.flatnonzero(mask_is_na), number_of_strata)
+
+    statistic, counts = grouped_statistic(
+        values,
+        stratum_codes,
+        donor_mask=donor_mask & ~mask_is_na & in_strata,
+        number_of_strata=number_of_strata,
+        how=how,
+    )
+
+    recipient_positions = select_recipients(
+        stratum_codes, mask_is_na, counts, min_threshold=min_threshold, col_name=col_name
+    )
+    imputed_mask = np.zeros(values.size, dtype=bool)
+    imputed_mask[recipient_positions] = True
+
+    filled_values = values.copy()
+    filled_values[recipient_positions] = statistic[stratum_codes[recipient_positions]]
+
+    return filled_values, imputed_mask
+
+
+def sample_donors(
+    stratum_codes: np.ndarray,
+    donor_mask: np.ndarray,
+    recipient_mask: np.ndarray,
+    number_of_strata: int | None = None,
+    min_threshold: int | None = 1,
+    rng=None,
+    col_name: str = None,
+    max_donors: int | None = None,
+) -> tuple:
+    """
+    Draw a random donor from the stratum of every recipient at once.
+
+    Parameters
+    ----------
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record (-1 for records without stratum).
+    donor_mask: np.ndarray
+        Boolean array which is True for the records which may act as donor.
+    recipient_mask: np.ndarray
+        Boolean array which is True for the records which need to be imputed.
+    number_of_strata: int
+        Total number of strata. Derived from the stratum codes if not given.
+    min_threshold: int
+        Minimum number of valid donor records needed for imputation of a stratum.
+    rng:
+        :class:`imputegaps.streams.StratumStreams` of the column, or a random generator with a
+        *random(size)* method. Defaults to a new numpy Generator.
+    col_name: str
+        Name of the variable, used for reporting only
+    max_donors: int
+        If given, the donors are drawn from a uniform sample of at most max_donors donors per
+        stratum, see :func:`reservoir_donors`. The min_threshold applies to all donors.
+
+    Returns
+    -------
+    tuple:
+        (recipient_positions, donor_positions): for each imputed record the position of the record
+        and the position of the donor record which is copied into it.
+
+    Notes
+    -----
+    The donors are sorted by stratum once, such that the donors of each stratum form a contiguous
+    segment. For every recipient a uniform offset inside the segment of its stratum is drawn with a
+    single call of the random generator, so the cost does not depend on the number of strata. The
+    donors of strata without recipients are left out before the sort.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    if number_of_strata is None:
+        number_of_strata = int(stratum_codes.max()) + 1 if stratum_codes.size > 0 else 0
+
+    # only the donors of the strata with recipients are sorted or sampled
+    donor_mask = donor_mask & strata_with_recipients(stratum_codes, np.flatnonzero(recipient_mask), number_of_strata)
+    counts = np.bincount(stratum_codes[donor_mask], minlength=number_of_strata)
+    if max_donors is None and jit.USE_NUMBA:
+        sorted_donors, sample_counts = jit.segment_donors(stratum_codes, donor_mask, number_of_strata)
+    elif max_donors is None:
+        donor_positions = np.flatnonzero(donor_mask)
+        sorted_donors = donor_positions[np.argsort(stratum_codes[donor_positions], kind="stable")]
+        sample_counts = counts
+    else:
+        sorted_donors, sample_counts = reservoir_donors(
+            stratum_codes, donor_mask, max_donors, number_of_strata=number_of_strata, rng=rng
+        )
+    starts = np.cumsum(sample_counts) - sample_counts
+
+    recipient_positions = select_recipients(
+        stratum_codes, recipient_mask, counts, min_threshold=min_threshold, col_name=col_name
+    )
+    recipient_counts = sample_counts[stratum_codes[recipient_positions]]
+
+    offsets = (draw_uniforms(rng, recipient_positions, stratum_codes) * recipient_counts).astype(np.int64)
+    offsets = np.minimum(offsets, recipient_counts - 1)
+    donor_positions = sorted_donors[starts[stratum_codes[recipient_positions]] + offsets]
+
+    return recipient_positions, donor_positions
+
+
+def reservoir_donors(
+    stratum_codes: np.ndarray,
+    donor_mask: np.ndarray,
+    max_donors: int,
+    number_of_strata: int | None = None,
+    rng=None,
+    block_size: int | None = None,
+) -> tuple:
+    """
+    Keep a uniform sample of at most max_donors donors per stratum in one pass over the records.
+
+    Parameters
+    ----------
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record (-1 for records without stratum).
+    donor_mask: np.ndarray
+        Boolean array which is True for the records which may act as donor.
+    max_donors: int
+        Maximum number of donors per stratum.
+    number_of_strata: int
+        Total number of strata. Derived from the stratum codes if not given.
+    rng:
+        :class:`imputegaps.streams.StratumStreams` of the column, or a random generator with a
+        *random(size)* method. Defaults to a new numpy Generator.
+    block_size: int
+        Number of records per block. Defaults to MAX_BLOCK_VALUES.
+
+    Returns
+    -------
+    tuple:
+        (sorted_donors, sample_counts): the positions of the sampled donors, sorted by stratum,
+        and the number of sampled donors per stratum.
+
+    Notes
+    -----
+    Every donor gets a random priority and the donors with the smallest priorities of each stratum
+    are kept, which is a uniform sample without replacement (bottom-k sampling). The records are
+    processed in blocks which are merged into the sample, so next to the sample only the donors of
+    one block are held, however large a stratum is.
+    """
+    if max_donors < 1:
+        raise ValueError(f"max_donors must be at least 1, got {max_donors}.")
+    if rng is None:
+        rng = np.random.default_rng()
+    if number_of_strata is None:
+        number_of_strata = int(stratum_codes.max()) + 1 if stratum_codes.size > 0 else 0
+    if block_size is None:
+        block_size = MAX_BLOCK_VALUES
+
+    positions = np.array([], dtype=np.int64)
+    priorities = np.array([], dtype=np.float64)
+    seen = np.zeros(number_of_strata, dtype=np.int64)
+    for start in range(0, stratum_codes.size, block_size):
+        block = slice(start, start + block_size)
+        new_positions = start + np.flatnonzero(donor_mask[block] & (stratum_codes[block] >= 0))
+        new_priorities = draw_uniforms(rng, new_positions, stratum_codes, offsets=seen, purpose="priority")
+        seen += np.bincount(stratum_codes[new_positions], minlength=number_of_strata)
+        positions = np.concatenate([positions, new_positions])
+        priorities = np.concatenate([priorities, new_priorities])
+
+        codes = stratum_codes[positions]
+        order = np.lexsort((priorities, codes))
+        sorted_codes = codes[order]
+        counts = np.bincount(sorted_codes, minlength=number_of_strata)
+        ranks = np.arange(order.size) - (np.cumsum(counts) - counts)[sorted_codes]
+        keep = order[ranks < max_donors]
+        positions = positions[keep]
+        priorities = priorities[keep]
+
+    sample_counts = np.bincount(stratum_codes[positions], minlength=number_of_strata)
+    return positions, sample_counts
+
+
+def fill_mode(
+    value_codes: np.ndarray,
+    stratum_codes: np.ndarray,
+    donor_mask: np.ndarray,
+    number_of_strata: int | None = None,
+    min_threshold: int | None = 1,
+    col_name: str = None,
+) -> tuple:
+    """
+    Impute the missing values of all strata of one column with the mode of their stratum.
+
+    Parameters
+    ----------
+    value_codes: np.ndarray
+        Integer array with the factorized values of the column (-1 for missing values). The codes
+        must follow the sort order of the values.
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record (-1 for records without stratum).
+    donor_mask: np.ndarray
+        Boolean array which is True for the records which may act as donor.
+    number_of_strata: int
+        Total number of strata. Derived from the stratum codes if not given.
+    min_threshold: int
+        Minimum number of valid donor records needed for imputation of a stratum.
+    col_name: str
+        Name of the variable, used for reporting only
+
+    Returns
+    -------
+    tuple:
+        (recipient_positions, imputed_codes): for each imputed record the position of the record
+        and the value code which is imputed.
+    """
+    if number_of_strata is None:
+        number_of_strata = int(stratum_codes.max()) + 1 if stratum_codes.size > 0 else 0
+
+    mask_is_na = value_codes < 0
+    # only the (stratum, value) pairs of the strata with gaps are counted
+    in_strata = strata_with_recipients(stratum_codes, np.flatnonzero(mask_is_na), number_of_strata)
+    mode_codes, counts = grouped_mode(
+        value_codes, stratum_codes, donor_mask & ~mask_is_na & in_strata, number_of_strata
+    )
+
+    recipient_positions = select_recipients(
+        stratum_codes, mask_is_na, counts, min_threshold=min_threshold, col_name=col_name
+    )
+
+    return recipient_positions, mode_codes[stratum_codes[recipient_positions]]
+
+
+def fill_mode_values(
+    values: np.ndarray,
+    stratum_codes: np.ndarray,
+    donor_mask: np.ndarray,
+    number_of_strata: int,
+    min_threshold: int | None = 1,
+    col_name: str = None,
+) -> tuple:
+    """
+    Impute the missing values of all strata of one column with the mode of their stratum.
+
+    Parameters
+    ----------
+    values: np.ndarray
+        Array with the values of the column. Missing values are NaN, or None in an object array.
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record (-1 for records without stratum).
+    donor_mask: np.ndarray
+        Boolean array which is True for the records which may act as donor.
+    number_of_strata: int
+        Total number of strata.
+    min_threshold: int
+        Minimum number of valid donor records needed for imputation of a stratum.
+    col_name: str
+        Name of the variable, used for reporting only
+
+    Returns
+    -------
+    tuple:
+        (recipient_positions, imputed_values): for each imputed record the position of the record
+        and the value which is imputed.
+
+    Notes
+    -----
+    The values are factorized for :func:`fill_mode`, except for a float column if the compiled
+    kernels of :mod:`imputegaps.jit` are used, which count the values of each stratum directly.
+    """
+    if not (jit.USE_NUMBA and values.dtype.kind == "f"):
+        value_codes, uniques = pd.factorize(values, sort=True)
+        recipient_positions, imputed_codes = fill_mode(
+            value_codes,
+            stratum_codes,
+            donor_mask=donor_mask,
+            number_of_strata=number_of_strata,
+            min_threshold=min_threshold,
+            col_name=col_name,
+        )
+        return recipient_positions, np.asarray(uniques)[imputed_codes]
+
+    mask_is_na = np.isnan(values)
+    in_strata = strata_with_recipients(stratum_codes, np.flatnonzero(mask_is_na), number_of_strata)
+    modes, counts = jit.grouped_float_mode(
+        np.ascontiguousarray(values, dtype=np.float64),
+        stratum_codes,
+        donor_mask & ~mask_is_na & in_strata,
+        number_of_strata,
+    )
+    recipient_positions = select_recipients(
+        stratum_codes, mask_is_na, counts, min_threshold=min_threshold, col_name=col_name
+    )
+    return recipient_positions, modes[stratum_codes[recipient_positions]]
+
+
+def segment_starts(sorted_codes: np.ndarray, number_of_strata: int) -> np.ndarray:
+    """
+    Find the start of the segment of each stratum in an array of sorted stratum codes.
+
+    Parameters
+    ----------
+    sorted_codes: np.ndarray
+        Stratum codes in which the records of each stratum form one contiguous segment. Records
+        with code -1 may be placed in between the segments.
+    number_of_strata: int
+        Total number of strata.
+
+    Returns
+    -------
+    np.ndarray:
+        Position of the first record of each stratum (0 for strata without records).
+    """
+    starts = np.zeros(number_of_strata, dtype=np.int64)
+    is_start = np.ones(sorted_codes.size, dtype=bool)
+    is_start[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    run_positions = np.flatnonzero(is_start)
+    run_codes = sorted_codes[run_positions]
+    valid = run_codes >= 0
+    starts[run_codes[valid]] = run_positions[valid]
+    return starts
+
+
+def fill_rollup(
+    values: np.ndarray,
+    levels: list,
+    donor_mask: np.ndarray,
+    recipient_mask: np.ndarray,
+    how: str = "mean",
+    min_threshold: int | None = 1,
+    rng=None,
+    col_name: str = None,
+    median_error: float | None = None,
+    max_donors: int | None = None,
+) -> tuple:
+    """
+    Impute the missing values of one column for all levels of drop_dimensions at once.
+
+    Parameters
+    ----------
+    values: np.ndarray
+        For mean and median a float array with the values of the column. For mode and pick an
+        integer array with the factorized values of the column, following the sort order of the
+        values (-1 for missing values).
+    levels: list
+        List of (stratum_codes, number_of_strata) tuples as returned by :func:`factorize_levels`,
+        starting with the deepest level.
+    donor_mask: np.ndarray
+        Boolean array which is True for the records which may act as donor.
+    recipient_mask: np.ndarray
+        Boolean array which is True for the records which need to be imputed.
+    how: str
+        Imputation method: 'mean', 'median', 'mode' or 'pick'.
+    min_threshold: int
+        Minimum number of valid donor records needed for imputation of a stratum.
+    rng:
+        :class:`imputegaps.streams.StratumStreams` of the column with the stratum keys of all
+        levels, or a random generator with a *random(size)* method, used for pick. Defaults to a
+        new numpy Generator.
+    col_name: str
+        Name of the variable, used for reporting only
+    median_error: float
+        If given, the median is approximated with quantile sketches with this rank error, see
+        :func:`imputegaps.sketches.level_quantiles`. The values are then sorted once for all levels.
+    max_donors: int
+        If given, pick draws from a uniform sample of at most max_donors donors per stratum, see
+        :func:`reservoir_donors`.
+
+    Returns
+    -------
+    tuple:
+        (recipient_positions, imputed_values, recipient_levels): for each imputed record its
+        position, the imputed value (a value code for mode and pick) and the index of the level in
+        *levels* which provided the donors.
+
+    Notes
+    -----
+    The donors are the same on all levels, so values imputed on a deeper level are never used as
+    donor on a coarser level. First the donor counts of all levels are calculated, which gives
+    for each recipient the deepest level with at least *min_threshold* donors. Then the statistic
+    is only calculated for the strata of the levels which provide the donors of a recipient and all
+    gaps are filled at once. For pick, the donors are sorted once on the stratum codes of all
+    levels, such that the donors of each stratum of every level form a contiguous segment.
+    """
+    if how not in ROLLUP_METHODS:
+        raise ValueError(f"Not a valid imputation method for the rollup: {how}.")
+    if rng is None:
+        rng = np.random.default_rng()
+
+    if how in GROUPED_STATISTICS:
+        donor_mask = donor_mask & ~np.isnan(values)
+    else:
+        donor_mask = donor_mask & (values >= 0)
+
+    threshold = 1 if min_threshold is None else max(min_threshold, 1)
+    recipient_positions = np.flatnonzero(recipient_mask)
+    recipient_levels = np.full(recipient_positions.size, -1, dtype=np.int64)
+
+    # find the deepest level with enough donors for each recipient
+    level_counts = []
+    for level, (codes, number_of_strata) in enumerate(levels):
+        counts = np.bincount(codes[donor_mask & (codes >= 0)], minlength=number_of_strata)
+        level_counts.append(counts)
+        pending = np.flatnonzero(recipient_levels < 0)
+        if pending.size == 0:
+            break
+        pending_codes = codes[recipient_positions[pending]]
+        has_stratum = pending_codes >= 0
+        can_impute = np.zeros(pending.size, dtype=bool)
+        can_impute[has_stratum] = counts[pending_codes[has_stratum]] >= threshold
+        recipient_levels[pending[can_impute]] = level
+
+    number_of_skipped = int((recipient_levels < 0).sum())
+    if number_of_skipped > 0:
+        logger.warning(
+            "Imputation not possible for %d gaps of %s on any level because of too few valid donor records.",
+            number_of_skipped,
+            col_name,
+        )
+    keep = recipient_levels >= 0
+    recipient_positions = recipient_positions[keep]
+    recipient_levels = recipient_levels[keep]
+    imputed_values = np.empty(recipient_positions.size, dtype=values.dtype)
+
+    # the statistics are only needed for the strata which provide the donors of a recipient; a
+    # stratum of a coarser level holds all donors of its deeper strata, so the segments of pick stay whole
+    needed = np.zeros(donor_mask.size, dtype=bool)
+    for level in np.unique(recipient_levels):
+        codes, number_of_strata = levels[level]
+        needed |= strata_with_recipients(codes, recipient_positions[recipient_levels == level], number_of_strata)
+    donor_mask = donor_mask & needed
+
+    if how == "pick":
+        if max_donors is None:
+            # sort the donors once; the coarsest level is the primary key of the sort
+            donor_positions = np.flatnonzero(donor_mask)
+            sorted_donors = donor_positions[np.lexsort([codes[donor_positions] for codes, _ in levels])]
+    elif how == "median" and median_error is not None and recipient_positions.size > 0:
+        approximate_medians = level_quantiles(
+            values, levels, donor_mask, error=median_error, needed_levels=set(np.unique(recipient_levels).tolist())
+        )
+
+    for level in np.unique(recipient_levels):
+        codes, number_of_strata = levels[level]
+        selection = recipient_levels == level
+        recipient_codes = codes[recipient_positions[selection]]
+        if how == "median" and median_error is not None:
+            imputed_values[selection] = approximate_medians[level][recipient_codes]
+        elif how in GROUPED_STATISTICS:
+            statistic, _ = grouped_statistic(values, codes, donor_mask, number_of_strata, how=how)
+            imputed_values[selection] = statistic[recipient_codes]
+        elif how == "mode":
+            mode_codes, _ = grouped_mode(values, codes, donor_mask, number_of_strata)
+            imputed_values[selection] = mode_codes[recipient_codes]
+        else:
+            level_rng = rng.level(level) if isinstance(rng, StratumStreams) else rng
+            uniform = draw_uniforms(level_rng, recipient_positions[selection], codes)
+            if max_donors is None:
+                level_donors = sorted_donors
+                starts = segment_starts(codes[sorted_donors], number_of_strata)
+                sample_counts = level_counts[level]
+            else:
+                level_donors, sample_counts = reservoir_donors(
+                    codes, donor_mask, max_donors, number_of_strata=number_of_strata, rng=level_rng
+                )
+                starts = np.cumsum(sample_counts) - sample_counts
+            recipient_counts = sample_counts[recipient_codes]
+            offsets = np.minimum((uniform * recipient_counts).astype(np.int64), recipient_counts - 1)
+            imputed_values[selection] = values[level_donors[starts[recipient_codes] + offsets]]
+
+    return recipient_positions, imputed_values, recipient_levels
+
+
+def fill_block(
+    values: np.ndarray,
+    stratum_codes: np.ndarray,
+    donor_mask: np.ndarray | None = None,
+    how: str = "mean",
+    min_threshold: int | None = 1,
+    number_of_strata: int | None = None,
+    rng=None,
+    col_name: str = None,
+    max_donors: int | None = None,
+) -> np.ndarray:
+    """
+    Impute the missing values of all strata of a block of columns at once.
+
+    Parameters
+    ----------
+    values: np.ndarray
+        Float array of shape (number_of_records, number_of_columns). Missing values are NaN.
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record (-1 for records without stratum).
+    donor_mask: np.ndarray
+        Boolean array with the same shape as values which is True for the values which may act as
+        donor. Missing values are never used as donor. All values may be donor if not given.
+    how: str
+        Imputation method: 'mean', 'median', 'mode' or 'pick'.
+    min_threshold: int
+        Minimum number of valid donor records needed for imputation of a stratum.
+    number_of_strata: int
+        Total number of strata. Derived from the stratum codes if not given.
+    rng:
+        :class:`imputegaps.streams.StratumStreams` of the columns of the block, or a random
+        generator with a *random(size)* method, used for pick. Defaults to a new numpy Generator.
+    col_name: str
+        Name of the variables, used for reporting only
+    max_donors: int
+        If given, pick draws from a uniform sample of at most max_donors donors per stratum.
+
+    Returns
+    -------
+    np.ndarray:
+        Array with the same shape as values with the imputed values.
+
+    Notes
+    -----
+    Each combination of a column and a stratum is treated as a stratum of its own, so the block is
+    imputed with one call of the kernel of the method instead of one call per column. Large blocks
+    are split in chunks of columns to limit the memory of the per stratum statistics and to keep
+    the sorts of mode and pick small.
+    """
+    if how not in BLOCK_METHODS:
+        raise ValueError(f"Not a valid imputation method for a block: {how}.")
+    if number_of_strata is None:
+        number_of_strata = int(stratum_codes.max()) + 1 if stratum_codes.size > 0 else 0
+
+    number_of_records, number_of_columns = values.shape
+    # column major, such that the values of a chunk of columns are contiguous
+    values = np.asfortranarray(values)
+    mask_is_na = np.isnan(values)
+    if donor_mask is None:
+        donor_mask = ~mask_is_na
+    else:
+        donor_mask = np.asfortranarray(donor_mask) & ~mask_is_na
+
+    filled_values = np.array(values, order="F")
+    columns_per_chunk = max(
+        1, min(MAX_BLOCK_STRATA // max(number_of_strata, 1), MAX_BLOCK_VALUES // max(number_of_records, 1))
+    )
+    for first in range(0, number_of_columns, columns_per_chunk):
+        chunk = slice(first, min(first + columns_per_chunk, number_of_columns))
+        chunk_size = chunk.stop - chunk.start
+        block_strata = number_of_strata * chunk_size
+
+        # lay out the columns one after the other and give each column its own range of strata
+        column_offsets = number_of_strata * np.arange(chunk_size, dtype=np.int64)[:, np.newaxis]
+        block_codes = np.where(stratum_codes >= 0, stratum_codes + column_offsets, -1).ravel()
+        flat_values = values[:, chunk].T.ravel()
+        flat_donors = donor_mask[:, chunk].T.ravel()
+        flat_na = mask_is_na[:, chunk].T.ravel()
+
+        if how in GROUPED_STATISTICS:
+            flat_filled, _ = fill_grouped(
+                flat_values,
+                block_codes,
+                flat_donors,
+                how=how,
+                min_threshold=min_threshold,
+                number_of_strata=block_strata,
+                col_name=col_name,
+            )
+        elif how == "mode":
+            recipient_positions, imputed_values = fill_mode_values(
+                flat_values,
+                block_codes,
+                flat_donors,
+                number_of_strata=block_strata,
+                min_threshold=min_threshold,
+                col_name=col_name,
+            )
+            flat_filled = flat_values.copy()
+            flat_filled[recipient_positions] = imputed_values
+        else:
+            recipient_positions, donor_positions = sample_donors(
+                block_codes,
+                flat_donors,
+                flat_na,
+                number_of_strata=block_strata,
+                min_threshold=min_threshold,
+                rng=rng.columns(first, chunk_size) if isinstance(rng, StratumStreams) else rng,
+                col_name=col_name,
+                max_donors=max_donors,
+            )
+            flat_filled = flat_values.copy()
+            flat_filled[recipient_positions] = flat_values[donor_positions]
+
+        filled_values[:, chunk] = flat_filled.reshape(chunk_size, number_of_records).T
+
+    return filled_values
+
+
+def impute_arrays(
+    values: np.ndarray,
+    stratum_codes: np.ndarray,
+    donor_mask: np.ndarray | None = None,
+    method: str = "mean",
+    min_threshold: int | None = 1,
+    rng=None,
+    number_of_strata: int | None = None,
+    max_donors: int | None = None,
+    col_name: str = None,
+) -> tuple:
+    """
+    Impute the missing values of all strata of one or more columns of a NumPy array.
+
+    Parameters
+    ----------
+    values: np.ndarray
+        Array of shape (number_of_records,) or (number_of_records, number_of_columns). Missing
+        values are NaN, or None or NaN in an object array. Mean and median need a numeric array,
+        a block of columns a float array.
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record (-1 for records without stratum), for
+        instance from :func:`factorize_strata`.
+    donor_mask: np.ndarray
+        Boolean array with the same shape as values which is True for the values which may act as
+        donor. Missing values are never used as donor. All values may be donor if not given.
+    method: str
+        Imputation method: 'mean', 'median', 'mode' (the smallest value for ties), 'pick' (a
+        random donor of the same stratum), 'nan' (the value 0) or 'pick1' (the value 1).
+    min_threshold: int
+        Minimum number of valid donor records needed for imputation of a stratum. The methods nan
+        and pick1 need no donors.
+    rng:
+        :class:`imputegaps.streams.StratumStreams` of the columns, or a random generator with a
+        *random(size)* method, used for pick. Defaults to a new numpy Generator.
+    number_of_strata: int
+        Total number of strata. Derived from the stratum codes if not given.
+    max_donors: int
+        If given, pick draws from a uniform sample of at most max_donors donors per stratum.
+    col_name: str
+        Name of the variables, used for reporting only
+
+    Returns
+    -------
+    tuple:
+        (filled_values, imputed_mask): a copy of values with the imputed values and a boolean
+        array with the same shape which is True for the imputed values.
+
+    Notes
+    -----
+    This is the kernel of :func:`imputegaps.impute_gaps.fill_missing_data_grouped` and of the
+    batches of :class:`imputegaps.impute_gaps.ImputeGaps`, without a pandas object in between.
+    The columns of a two dimensional array are imputed at once with :func:`fill_block`.
+    """
+    if method not in ARRAY_METHODS:
+        raise ValueError(f"Not a valid imputation method: {method}.")
+    values = np.asarray(values)
+    stratum_codes = np.asarray(stratum_codes, dtype=np.int64)
+    if values.shape[0] != stratum_codes.size:
+        raise ValueError(f"Expected {values.shape[0]} stratum codes, got {stratum_codes.size}.")
+    if number_of_strata is None:
+        number_of_strata = int(stratum_codes.max()) + 1 if stratum_codes.size > 0 else 0
+
+    mask_is_na = np.isnan(values) if values.dtype.kind in "fc" else pd.isna(values)
+    if donor_mask is None:
+        donor_mask = ~mask_is_na
+    else:
+        donor_mask = np.asarray(donor_mask, dtype=bool) & ~mask_is_na
+
+    if values.ndim == 2:
+        if method in BLOCK_METHODS and values.dtype.kind == "f":
+            filled_values = fill_block(
+                values,
+                stratum_codes,
+                donor_mask=donor_mask,
+                how=method,
+                min_threshold=min_threshold,
+                number_of_strata=number_of_strata,
+                rng=rng,
+                col_name=col_name,
+                max_donors=max_donors,
+            )
+            return filled_values, mask_is_na & ~np.isnan(filled_values)
+        # the other methods and types are imputed column by column
+        filled_values = values.copy()
+        imputed_mask = np.zeros(values.shape, dtype=bool)
+        for index in range(values.shape[1]):
+            column_rng = rng.columns(index, 1) if isinstance(rng, StratumStreams) else rng
+            filled_values[:, index], imputed_mask[:, index] = impute_arrays(
+                values[:, index],
+                stratum_codes,
+                donor_mask=donor_mask[:, index],
+                method=method,
+                min_threshold=min_threshold,
+                rng=column_rng,
+                number_of_strata=number_of_strata,
+                max_donors=max_donors,
+                col_name=col_name,
+            )
+        return filled_values, imputed_mask
+
+    filled_values = values.copy()
+    if method in ("nan", "pick1"):
+        # these methods do not need donors
+        recipient_positions = np.flatnonzero(mask_is_na & (stratum_codes >= 0))
+        filled_values[recipient_positions] = 0 if method == "nan" else 1
+    elif method in GROUPED_STATISTICS:
+        if values.dtype.kind not in "biuf":
+            raise TypeError(f"Can not take the {method} of the non-numeric variable {col_name}.")
+        filled_values, imputed_mask = fill_grouped(
+            values.astype(np.float64, copy=False),
+            stratum_codes,
+            donor_mask=donor_mask,
+            how=method,
+            min_threshold=min_threshold,
+            number_of_strata=number_of_strata,
+            col_name=col_name,
+        )
+        return filled_values, imputed_mask
+    elif method == "mode":
+        recipient_positions, imputed_values = fill_mode_values(
+            values,
+            stratum_codes,
+            donor_mask=donor_mask,
+            number_of_strata=number_of_strata,
+            min_threshold=min_threshold,
+            col_name=col_name,
+        )
+        filled_values[recipient_positions] = imputed_values
+    else:
+        recipient_positions, donor_positions = sample_donors(
+            stratum_codes,
+            donor_mask=donor_mask,
+            recipient_mask=mask_is_na,
+            number_of_strata=number_of_strata,
+            min_threshold=min_threshold,
+            rng=rng,
+            col_name=col_name,
+            max_donors=max_donors,
+        )
+        filled_values[recipient_positions] = values[donor_positions]
+
+    imputed_mask = np.zeros(values.size, dtype=bool)
+    imputed_mask[recipient_positions] = True
+    return filled_values, imputed_mask
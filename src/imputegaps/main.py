@@ -7,7 +7,17 @@ import pandas as pd
 import yaml
 
 from imputegaps import __version__, logger
+from imputegaps.chunked import impute_gaps_chunked
+from imputegaps.fileio import (
+    RecordsWriter,
+    needed_columns,
+    read_records,
+    read_records_in_chunks,
+    variable_dtypes,
+    write_records,
+)
 from imputegaps.impute_gaps import ImputeGaps
+from imputegaps.sketches import MEDIAN_ERROR
 
 
 def parse_args(args):
@@ -22,18 +32,59 @@ def parse_args(args):
       :obj:`argparse.Namespace`: command line parameters namespace
     """
     parser = argparse.ArgumentParser()
-    parser.add_argument("records_df", help="Name of the impute filename")
+    parser.add_argument(
+        "records_df",
+        help="Name of the impute filename. Parquet (.parquet), Feather (.feather, .arrow) and semicolon "
+        "separated CSV (.csv, optionally compressed as .csv.gz, .csv.bz2, .csv.xz, .csv.zip or .csv.zst) "
+        "are supported",
+    )
     parser.add_argument(
         "--output_filename",
-        help="Name of the output filename. If not given, output is written to stdout",
+        help="Name of the output filename, in a format given by the extension as for the input. If not given, "
+        "output is written to stdout as CSV",
     )
-    parser.add_argument("--variables", help="Variables impute methods")
+    parser.add_argument("--variables", help="Variables impute methods, with the variable name in the first column")
     parser.add_argument(
         "--impute_settings_file",
         help="Name of the settings file with the imputation method per type",
     )
-    parser.add_argument("--group_by", help="Group by column name to impute")
+    parser.add_argument("--group_by", help="Group by column name to impute. Separate more names by a comma")
     parser.add_argument("--id", help="Index column name of the smallest group")
+    parser.add_argument(
+        "--drop_dimensions",
+        action="store_true",
+        help="Impute the remaining gaps in the strata of the group by columns with the last one dropped",
+    )
+    parser.add_argument(
+        "--float32",
+        action="store_true",
+        help="Read the float variables as float32 instead of float64 to save memory",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        help="Read the records in chunks of this number of rows and impute them in two passes, "
+        "for input files which do not fit in memory",
+    )
+    parser.add_argument(
+        "--approximate",
+        action="store_true",
+        help="Approximate the median with quantile sketches, which bounds the memory per stratum. "
+        "Only applies with --chunksize; the imputation in memory takes the exact median",
+    )
+    parser.add_argument(
+        "--median_error",
+        type=float,
+        default=MEDIAN_ERROR,
+        help="Rank error of the approximate median as a fraction of the donors of a stratum",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="-",
+        help="Record the wall time, rows, strata and filled gaps per variable, level and stage, and write them to "
+        "this file in a format given by the extension, or to stderr if no file is given",
+    )
     parser.add_argument(
         "--version",
         action="version",
@@ -58,6 +109,24 @@ def parse_args(args):
     return parser.parse_args(args)
 
 
+def read_variables(filename) -> dict:
+    """
+    Read the variables file
+
+    Args:
+      filename (str): name of the semicolon separated file with one row per variable and the name
+          of the variable in the first column.
+
+    Returns:
+      dict: the properties per variable name. Empty properties are left out.
+    """
+    variables = pd.read_csv(filename, sep=";", index_col=0)
+    return {
+        name: {key: value for key, value in properties.items() if not pd.isna(value)}
+        for name, properties in variables.to_dict("index").items()
+    }
+
+
 def main(args):
     """
     doc here
@@ -67,32 +136,64 @@ def main(args):
 
     # Get command line arguments and set up logging
     args = parse_args(args)
-    logger.setLevel(args.loglevel)
+    if args.loglevel is not None:
+        logger.setLevel(args.loglevel)
 
     # Read input files
-    records_df = pd.read_csv(args.records_df, sep=";")
-    variables = pd.read_csv(args.variables, sep=";")
+    variables = read_variables(args.variables)
     index_key = args.id
+    group_by = args.group_by.split(",") if args.group_by else []
 
     # Read the settings file
-    with codecs.open(args.impute_settings, encoding="UTF-8") as stream:
+    with codecs.open(args.impute_settings_file, encoding="UTF-8") as stream:
         settings = yaml.load(stream=stream, Loader=yaml.Loader)
 
     impute_settings = settings["general"]["imputation"]
 
-    # Convert variables to dictionary
-    # variables.set_index("naam", inplace=True)
-    variables = variables.to_dict("index")
-
     # Start class ImputeGaps
     impute_gaps = ImputeGaps(
         index_key=index_key,
         imputation_methods=impute_settings["imputation_methods"],
         seed=impute_settings["set_seed"],
         variables=variables,
+        approximate=args.approximate,
+        median_error=args.median_error,
+        profile=args.profile is not None,
     )
 
-    records_df = impute_gaps.impute_gaps(records_df=records_df, group_by=args.group_by)
+    # Only read the columns which are needed for the imputation, with the types of the variables
+    columns = needed_columns(index_key, group_by, impute_gaps.plan)
+    dtype = variable_dtypes(variables, float_dtype="float32" if args.float32 else "float64")
+
+    if args.chunksize is not None:
+        if args.profile is not None:
+            logger.warning("The profile is only recorded for the imputation in memory, not with --chunksize.")
+
+        # the group by keys are read as strings, such that they have the same type in all chunks
+        def read_chunks():
+            return read_records_in_chunks(
+                args.records_df, args.chunksize, columns=columns, dtype=dtype | {name: str for name in group_by}
+            )
+
+        chunks = impute_gaps_chunked(impute_gaps, read_chunks, group_by=group_by, drop_dimensions=args.drop_dimensions)
+        with RecordsWriter(args.output_filename) as writer:
+            for records_df in chunks:
+                writer.write(records_df)
+    else:
+        records_df = read_records(args.records_df, columns=columns, dtype=dtype)
+        if index_key in records_df.columns:
+            records_df.set_index(index_key, inplace=True)
+        records_df = impute_gaps.impute_gaps(
+            records_df=records_df, group_by=group_by, drop_dimensions=args.drop_dimensions
+        )
+        if index_key in records_df.index.names:
+            records_df.reset_index(inplace=True)
+        write_records(records_df, args.output_filename)
+
+        if args.profile == "-":
+            print(impute_gaps.profile_df.to_string(index=False), file=sys.stderr)
+        elif args.profile is not None:
+            write_records(impute_gaps.profile_df, args.profile)
 
     logger.info("Class ImputeGaps has finished.")
 
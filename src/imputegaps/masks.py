@@ -0,0 +1,176 @@
+"""
+
+This module provides the evaluation of the filter and set_nan_eval expressions of the variables.
+
+Classes:
+--------
+
+MaskEvaluator:
+    Evaluates each distinct expression once for a DataFrame and shares the resulting masks between
+    all variables and levels which use it.
+"""
+
+import ast
+import logging
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+try:
+    import numexpr  # noqa: F401
+except ImportError:
+    NUMEXPR_AVAILABLE = False
+else:
+    NUMEXPR_AVAILABLE = True
+
+logger = logging.getLogger(__name__)
+
+DataFrameType = Union["pd.DataFrame", None]
+
+
+def referenced_names(expression: str) -> frozenset | None:
+    """
+    Find the names of the variables used in an expression.
+
+    Parameters
+    ----------
+    expression: str
+        Expression in the syntax of *DataFrame.eval*.
+
+    Returns
+    -------
+    frozenset or None:
+        Names used in the expression, or None if the expression can not be parsed, in which case it
+        may depend on any variable.
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError:
+        return None
+    return frozenset(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))
+
+
+class MaskEvaluator:
+    """
+    Evaluate boolean masks for the records of a DataFrame and keep them for reuse.
+
+    Arguments
+    ---------
+    records_df: DataFrameType
+        DataFrame on which the expressions are evaluated. The masks follow the changes of the
+        DataFrame as long as :meth:`invalidate` is called for each modified column.
+    use_numexpr: bool
+        Evaluate with the numexpr engine. Defaults to True if numexpr is installed. Expressions
+        which are not supported by numexpr are evaluated with the python engine.
+
+    Notes
+    -----
+    An expression which only consists of a variable name, such as the usual filter 'internet',
+    is compared directly without parsing. Other expressions are evaluated with *DataFrame.eval*.
+    """
+
+    def __init__(self, records_df: DataFrameType, use_numexpr: bool | None = None):
+        self.records_df = records_df
+        if use_numexpr is None:
+            use_numexpr = NUMEXPR_AVAILABLE
+        self.use_numexpr = use_numexpr and NUMEXPR_AVAILABLE
+        self._masks = {}
+        self._dependencies = {}
+        self.number_of_evaluations = 0
+
+    def mask(self, expression: str) -> np.ndarray:
+        """
+        Evaluate an expression, or return the mask of an earlier evaluation.
+
+        Parameters
+        ----------
+        expression: str
+            Expression in the syntax of *DataFrame.eval*.
+
+        Returns
+        -------
+        np.ndarray:
+            Boolean array with one value per record. Missing results are False.
+
+        Raises
+        ------
+        pd.errors.UndefinedVariableError:
+            If the expression uses a variable which is not in the DataFrame.
+        """
+        try:
+            return self._masks[expression]
+        except KeyError:
+            pass
+
+        names = referenced_names(expression)
+        result = self._evaluate(expression, names)
+        mask = np.asarray(pd.Series(result).to_numpy(dtype=bool, na_value=False))
+        if mask.ndim == 0:
+            mask = np.full(len(self.records_df), fill_value=bool(mask))
+        mask.setflags(write=False)
+
+        self.number_of_evaluations += 1
+        self._masks[expression] = mask
+        self._dependencies[expression] = names
+        return mask
+
+    def filter_mask(self, var_filter: str) -> np.ndarray:
+        """
+        Evaluate a filter, which selects the records for which the filter variable equals 1.
+
+        Parameters
+        ----------
+        var_filter: str
+            Name of the filter variable or an expression.
+
+        Returns
+        -------
+        np.ndarray:
+            Boolean array with one value per record.
+        """
+        return self.mask(var_filter + " == 1")
+
+    def invalidate(self, col_name: str):
+        """
+        Forget the masks which depend on a column, because the column has been modified.
+
+        Parameters
+        ----------
+        col_name: str
+            Name of the modified column.
+        """
+        for expression, names in list(self._dependencies.items()):
+            if names is None or col_name in names:
+                del self._masks[expression]
+                del self._dependencies[expression]
+
+    def _evaluate(self, expression: str, names: frozenset | None):
+        """
+        Evaluate an expression on the records.
+        """
+        records_df = self.records_df
+        tree = None
+        if names is not None and len(names) == 1:
+            tree = ast.parse(expression.strip(), mode="eval").body
+        if (
+            isinstance(tree, ast.Compare)
+            and isinstance(tree.left, ast.Name)
+            and len(tree.ops) == 1
+            and isinstance(tree.ops[0], ast.Eq)
+            and isinstance(tree.comparators[0], ast.Constant)
+        ):
+            # fast path for the filters 'name == value'
+            name = tree.left.id
+            if name not in records_df.columns:
+                raise pd.errors.UndefinedVariableError(name)
+            return records_df[name] == tree.comparators[0].value
+
+        if self.use_numexpr:
+            try:
+                return records_df.eval(expression, engine="numexpr")
+            except pd.errors.UndefinedVariableError:
+                raise
+            except Exception as err:
+                logger.debug("Evaluate %s with the python engine: %s", expression, err)
+        return records_df.eval(expression, engine="python")
@@ -0,0 +1,196 @@
+"""
+
+This module provides the imputation of the partitions of the records in separate processes.
+
+The strata of all levels which contain the first group_by variable never cross the values of that
+variable, so the records can be partitioned by it and each partition can be imputed on its own.
+The numeric columns are shared with the worker processes through shared memory instead of being
+pickled to each of them.
+
+Classes:
+--------
+
+SharedColumns:
+    Copies the numeric columns of a DataFrame into shared memory blocks.
+
+Functions:
+----------
+
+partition_positions:
+    Find the positions of the records of each partition.
+impute_partition:
+    Impute the levels of one partition in a worker process.
+"""
+
+import logging
+from multiprocessing import shared_memory
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+from imputegaps.kernels import factorize_levels, factorize_strata
+from imputegaps.masks import MaskEvaluator
+
+logger = logging.getLogger(__name__)
+
+DataFrameType = Union["pd.DataFrame", None]
+
+# kinds of numpy dtypes of the columns which are shared through shared memory
+SHARED_KINDS = "biuf"
+
+
+def partition_positions(partition_key: pd.Series) -> list:
+    """
+    Find the positions of the records of each partition.
+
+    Parameters
+    ----------
+    partition_key: pd.Series
+        Column with the partition of each record.
+
+    Returns
+    -------
+    list:
+        List with an array of positions per partition, in the sort order of the keys. Records with
+        a missing key are not in any partition.
+    """
+    codes, number_of_partitions = factorize_strata([partition_key], size=len(partition_key))
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes[codes >= 0], minlength=number_of_partitions)
+    start = np.count_nonzero(codes < 0)
+    return np.split(order[start:], np.cumsum(counts)[:-1]) if number_of_partitions > 0 else []
+
+
+class SharedColumns:
+    """
+    Copy the numeric columns of a DataFrame into shared memory blocks.
+
+    Arguments
+    ---------
+    records_df: DataFrameType
+        DataFrame of which the numeric columns are shared.
+
+    Notes
+    -----
+    The blocks are released when the object is used as a context manager, or with :meth:`close`.
+    Columns with another dtype, such as object or category, are not shared.
+    """
+
+    def __init__(self, records_df: DataFrameType):
+        self.descriptors = {}
+        self._blocks = []
+        try:
+            for col_name, dtype in records_df.dtypes.items():
+                if not isinstance(dtype, np.dtype) or dtype.kind not in SHARED_KINDS:
+                    continue
+                values = records_df[col_name].to_numpy()
+                block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+                self._blocks.append(block)
+                np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+                self.descriptors[col_name] = (block.name, values.dtype.str, values.size)
+        except Exception:
+            self.close()
+            raise
+
+    def array(self, col_name: str) -> np.ndarray:
+        """
+        Return a view on the shared values of a column.
+        """
+        name, dtype, size = self.descriptors[col_name]
+        block = next(block for block in self._blocks if block.name == name)
+        return np.ndarray((size,), dtype=np.dtype(dtype), buffer=block.buf)
+
+    def close(self):
+        """
+        Release the shared memory blocks.
+        """
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def impute_partition(
+    imputer,
+    descriptors: dict,
+    columns: list,
+    other_columns: dict,
+    positions: np.ndarray,
+    group_by: list,
+    drop_dimensions: bool,
+) -> dict:
+    """
+    Impute the levels of one partition which contain the first group_by variable.
+
+    Parameters
+    ----------
+    imputer: ImputeGaps
+        Imputer with the settings of the variables.
+    descriptors: dict
+        Descriptors of the shared columns, as *SharedColumns.descriptors*.
+    columns: list
+        Names of all columns of the records, in their order.
+    other_columns: dict
+        Values of the partition of the columns which are not shared, per name.
+    positions: np.ndarray
+        Positions of the records of the partition.
+    group_by: list
+        The variables which define the strata of the deepest level.
+    drop_dimensions: bool
+        If True, impute all levels which contain the first group_by variable, else only the
+        deepest level.
+
+    Returns
+    -------
+    dict:
+        The imputed values of the partition of the columns which are not shared, per name. The
+        imputed float columns are written into the shared memory blocks.
+    """
+    blocks = {}
+    try:
+        shared_values = {}
+        for col_name, (name, dtype, size) in descriptors.items():
+            blocks[col_name] = shared_memory.SharedMemory(name=name)
+            shared_values[col_name] = np.ndarray((size,), dtype=np.dtype(dtype), buffer=blocks[col_name].buf)
+
+        partition_df = pd.DataFrame(
+            {
+                col_name: (shared_values[col_name][positions] if col_name in shared_values else other_columns[col_name])
+                for col_name in columns
+            }
+        )
+
+        levels = factorize_levels([partition_df[name] for name in group_by], size=len(partition_df))
+        if imputer.track_imputed:
+            imputer.imputed_df = partition_df.isna()
+        masks = MaskEvaluator(partition_df)
+        residual_gaps = {}
+
+        number_of_dimensions = len(group_by)
+        for group_dim in range(number_of_dimensions):
+            partition_df = imputer.impute_gaps_for_dimensions(
+                partition_df,
+                group_by=group_by[: number_of_dimensions - group_dim],
+                stratum_codes=levels[group_dim],
+                masks=masks,
+                residual_gaps=residual_gaps,
+            )
+            if not drop_dimensions:
+                break
+
+        # the partitions do not overlap, so the workers can write into the shared columns at once
+        for col_name, values in shared_values.items():
+            if values.dtype.kind == "f":
+                values[positions] = partition_df[col_name].to_numpy()
+
+        return {col_name: partition_df[col_name] for col_name in other_columns}
+    finally:
+        for block in blocks.values():
+            block.close()
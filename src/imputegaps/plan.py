@@ -0,0 +1,270 @@
+"""
+
+This module provides the imputation plan, which resolves the settings of all variables once.
+
+Classes:
+--------
+
+ImputationPlan:
+    The imputation method, filter, set_nan_eval expression, target dtype and source columns of
+    each variable, resolved once from the variables and the imputation methods.
+
+Functions:
+----------
+
+imputed_float_dtype:
+    Get the float data type of an integer column which is imputed with values which are no integers.
+"""
+
+import logging
+
+import pandas as pd
+
+from imputegaps.masks import referenced_names
+
+logger = logging.getLogger(__name__)
+
+EXPLAIN_COLUMNS = ["variable", "type", "how", "filter", "set_nan_eval", "dtype", "sources", "skip"]
+
+
+def imputed_float_dtype(dtype) -> str:
+    """
+    Get the float data type of an integer column which is imputed with values which are no integers.
+
+    Parameters
+    ----------
+    dtype:
+        Data type of the column.
+
+    Returns
+    -------
+    str:
+        'Float64' for a nullable integer column, else 'float64'.
+    """
+    return "Float64" if pd.api.types.is_extension_array_dtype(dtype) else "float64"
+
+
+class ImputationPlan:
+    """
+    The imputation settings of all variables, resolved once and reused by all levels and calls.
+
+    Arguments
+    ---------
+    variables: dict
+        Dictionary with information about the variables to impute.
+    imputation_methods: dict
+        Dictionary with imputation methods per data type, with the types which are not imputed
+        under 'skip'.
+
+    Notes
+    -----
+    The settings of a variable are a dictionary with:
+
+    * var_type: the type of the variable;
+    * how: the imputation method, the 'impute_method' of the variable or else the method of its type;
+    * filter: the impute_only expression, or else the filter expression, of the records to impute;
+    * set_nan_eval: the expression of the records which are not imputed;
+    * to_category: whether the variable is converted to a category (dict variables);
+    * dtype: the data type of the imputed variable, 'category', 'float64' for the mean or median
+      of an int variable, or None if the data type is kept. A nullable integer column becomes
+      'Float64' instead, see :func:`imputed_float_dtype`, which explain shows given the records;
+    * referenced: the names of the columns used in the filter and set_nan_eval expressions, or
+      None if an expression can not be parsed, in which case it may depend on any column;
+    * sources: the names of the columns which are read to impute the variable, which are the
+      variable itself and the referenced columns, or None if the referenced columns are unknown.
+
+    Variables without a type, with no_impute, of a skipped type or without an imputation method
+    are not imputed; the reason is kept in *skipped*.
+    """
+
+    def __init__(self, variables: dict | None, imputation_methods: dict | None):
+        self.variables = variables or {}
+        self.imputation_methods = imputation_methods or {}
+        self.settings = {}
+        self.skipped = {}
+        for col_name, variable_properties in self.variables.items():
+            settings = self._resolve(col_name, variable_properties)
+            if settings is not None:
+                self.settings[col_name] = settings
+
+    def _resolve(self, col_name: str, variable_properties: dict) -> dict | None:
+        """
+        Resolve the settings of one variable, or keep the reason why it is not imputed.
+        """
+        # Check if information is available about the variable
+        try:
+            var_type = variable_properties["type"]
+        except KeyError as err:
+            logger.info("Geen 'type' info voor: %s, %s", col_name, err)
+            self.skipped[col_name] = "no type"
+            return None
+
+        no_impute = variable_properties.get("no_impute")
+        skip_variable_type = self.imputation_methods.get("skip")
+
+        # Check if the variable has a 'no_impute' flag or if its type should not be imputed
+        if no_impute or (skip_variable_type is not None and var_type in skip_variable_type):
+            logger.debug("Skip imputing variable %s of var type %s", col_name, var_type)
+            self.skipped[col_name] = "no_impute" if no_impute else "skip type"
+            return None
+
+        # Get filter(s) if provided
+        impute_only = variable_properties.get("impute_only")
+        variable_filter = variable_properties.get("filter")
+
+        if impute_only is None and variable_filter is not None:  # Als impute_only leeg is, neem dan filter
+            var_filter = variable_filter
+        else:
+            var_filter = impute_only
+
+        # Get which imputing method to use
+        how = None
+        to_category = False
+        imputation_dict = self.imputation_methods
+        not_none = [i for i in imputation_dict.keys() if imputation_dict[i] is not None]
+
+        impute_method = variable_properties.get("impute_method")
+        if impute_method is not None:
+            how = impute_method
+        else:
+            for key in imputation_dict.keys():
+                if key in not_none and var_type in imputation_dict[key]:
+                    how = key
+                    # Convert categorical (dict) variables to categorical
+                    to_category = var_type == "dict"
+
+        if how is None:
+            logger.warning("Imputation method not found for %s of var type %s!", col_name, var_type)
+            self.skipped[col_name] = "no method"
+            return None
+        logger.debug("Fill gaps of %s by taking the %s of the valid values", col_name, how)
+
+        set_nan_eval = variable_properties.get("set_nan_eval")
+        if to_category:
+            dtype = "category"
+        elif var_type == "int" and how in ("mean", "median"):
+            dtype = "float64"
+        else:
+            dtype = None
+
+        referenced = set()
+        for expression in (var_filter, set_nan_eval):
+            if expression is None:
+                continue
+            names = referenced_names(expression)
+            if names is None:
+                logger.debug("Can not find the variables used in %s of %s", expression, col_name)
+                referenced = None
+                break
+            referenced |= names
+
+        return {
+            "var_type": var_type,
+            "how": how,
+            "filter": var_filter,
+            "set_nan_eval": set_nan_eval,
+            "to_category": to_category,
+            "dtype": dtype,
+            "referenced": None if referenced is None else frozenset(referenced),
+            "sources": None if referenced is None else frozenset(referenced | {col_name}),
+        }
+
+    def settings_for(self, col_name: str) -> dict | None:
+        """
+        Get the settings of one variable.
+
+        Parameters
+        ----------
+        col_name: str
+            Name of the variable.
+
+        Returns
+        -------
+        dict or None:
+            The settings of the variable, see the notes of the class. None if the variable must not
+            be imputed.
+        """
+        try:
+            return self.settings[col_name]
+        except KeyError:
+            if col_name not in self.variables:
+                logger.debug("Skip imputing, want geen variabele info voor %s", col_name)
+            return None
+
+    def for_columns(self, columns, exclude=()) -> dict:
+        """
+        Get the settings of the variables to impute among the columns of the records.
+
+        Parameters
+        ----------
+        columns: iterable
+            Names of the columns, in the order of imputation.
+        exclude: iterable
+            Names of the columns which are never imputed, such as the index key and the group_by
+            variables.
+
+        Returns
+        -------
+        dict:
+            Settings per variable, in the order of the columns.
+        """
+        exclude = set(exclude)
+        return {
+            col_name: self.settings[col_name]
+            for col_name in columns
+            if col_name in self.settings and col_name not in exclude
+        }
+
+    def explain(self, records_df: pd.DataFrame | None = None) -> pd.DataFrame:
+        """
+        Show the work of the imputation per variable.
+
+        Parameters
+        ----------
+        records_df: pd.DataFrame
+            If given, only the variables which are columns of records_df are shown, in the order of
+            imputation, with their number of gaps and the dtype which follows from their column.
+
+        Returns
+        -------
+        pd.DataFrame:
+            One row per variable with the columns EXPLAIN_COLUMNS: the type, the imputation method,
+            the filter and set_nan_eval expressions, the target dtype, the source columns, separated
+            by a comma, and the reason why the variable is skipped, which is empty for the variables
+            which are imputed. With records_df, the column 'gaps' has the number of missing values.
+        """
+        col_names = (
+            list(self.variables) if records_df is None else [c for c in records_df.columns if c in self.variables]
+        )
+        rows = []
+        for col_name in col_names:
+            settings = self.settings.get(col_name)
+            if settings is None:
+                rows.append(
+                    {
+                        "variable": col_name,
+                        "type": self.variables[col_name].get("type"),
+                        "skip": self.skipped[col_name],
+                    }
+                )
+                continue
+            sources = settings["sources"]
+            dtype = settings["dtype"]
+            if dtype == "float64" and records_df is not None:
+                dtype = imputed_float_dtype(records_df[col_name].dtype)
+            rows.append(
+                {
+                    "variable": col_name,
+                    "type": settings["var_type"],
+                    "how": settings["how"],
+                    "filter": settings["filter"],
+                    "set_nan_eval": settings["set_nan_eval"],
+                    "dtype": dtype,
+                    "sources": "*" if sources is None else ",".join(sorted(sources)),
+                    "skip": "",
+                }
+            )
+        explanation = pd.DataFrame(rows, columns=EXPLAIN_COLUMNS)
+        if records_df is not None:
+            explanation["gaps"] = records_df[col_names].isna().sum().to_numpy()
+        return explanation
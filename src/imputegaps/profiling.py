@@ -0,0 +1,134 @@
+"""
+
+This module provides the opt-in profiling of the imputation per variable, level and stage.
+
+Classes:
+--------
+
+Profiler:
+    Collect the wall time, rows, strata and filled gaps per variable, level and stage.
+NullProfiler:
+    Profiler which records nothing, used when profiling is off.
+
+Functions:
+----------
+
+timed_call:
+    Call a function and measure its wall time, also in a worker process.
+"""
+
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# groupby: factorize or hash the group_by keys; filter: evaluate the filter and set_nan_eval masks;
+# kernel: compute the imputed values; write_back: write them into the records; partition: impute the
+# partitions in the worker processes
+STAGES = ("groupby", "filter", "kernel", "write_back", "partition")
+PROFILE_COLUMNS = ["variable", "level", "stage", "wall_time", "rows", "strata", "gaps_filled"]
+
+
+class Profiler:
+    """
+    Collect the wall time, rows, strata and filled gaps per variable, level and stage.
+
+    Notes
+    -----
+    The level is named by its group_by variables separated by a comma, which is empty for the
+    level of the whole column, 'all' for the factorization of the keys of all levels and 'rollup'
+    for the rollup imputation. Stages which do not belong to a single variable, such as the
+    factorization of the group_by keys, have an empty variable. A batch of variables which is
+    imputed at once is named by its variables separated by a comma and a space.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    @contextmanager
+    def stage(self, variable: str, level: str, stage: str, rows: int = 0, strata: int = 0):
+        """
+        Measure the wall time of the code of a stage.
+
+        Yields
+        ------
+        dict:
+            The entry of the stage, of which the rows, strata and gaps_filled may be updated.
+        """
+        entry = {"variable": variable, "level": level, "stage": stage, "rows": rows, "strata": strata, "gaps_filled": 0}
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry["wall_time"] = time.perf_counter() - start
+            self.entries.append(entry)
+
+    def add(
+        self, variable: str, level: str, stage: str, wall_time: float, rows: int = 0, strata: int = 0, gaps_filled=0
+    ):
+        """
+        Add a stage of which the wall time was measured elsewhere, for instance in a worker.
+
+        Returns
+        -------
+        dict:
+            The entry of the stage, which may still be updated.
+        """
+        entry = {
+            "variable": variable,
+            "level": level,
+            "stage": stage,
+            "wall_time": wall_time,
+            "rows": rows,
+            "strata": strata,
+            "gaps_filled": gaps_filled,
+        }
+        self.entries.append(entry)
+        return entry
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Return the stages in the order in which they were finished.
+
+        Returns
+        -------
+        pd.DataFrame:
+            One row per stage with the columns PROFILE_COLUMNS.
+        """
+        return pd.DataFrame(self.entries, columns=PROFILE_COLUMNS)
+
+
+class NullProfiler(Profiler):
+    """
+    Profiler which records nothing, used when profiling is off.
+    """
+
+    def stage(self, variable: str, level: str, stage: str, rows: int = 0, strata: int = 0):
+        return nullcontext({})
+
+    def add(self, *args, **kwargs):
+        return {}
+
+
+def timed_call(function, kwargs: dict) -> tuple:
+    """
+    Call a function and measure its wall time, also in a worker process.
+
+    Parameters
+    ----------
+    function: callable
+        Function to call.
+    kwargs: dict
+        Keyword arguments of the function.
+
+    Returns
+    -------
+    tuple:
+        (result, wall_time) with the result of function(**kwargs) and its wall time in seconds.
+    """
+    start = time.perf_counter()
+    result = function(**kwargs)
+    return result, time.perf_counter() - start
@@ -0,0 +1,207 @@
+"""
+
+This module provides mergeable quantile sketches of all strata of a column at once.
+
+The sketch of a stratum is a short list of centroids (mean and weight of a run of sorted values),
+as in the merging t-digest. The centroids are formed on a uniform scale of the quantiles, such
+that each centroid holds at most about a fraction *error* of the donors of its stratum. Sketches
+of chunks or of finer strata are merged by compressing their centroids together, which is how the
+approximate median of the coarser levels is computed from the sketches of the finer levels.
+
+Functions:
+----------
+
+merge_sketches:
+    Compress the centroids of each stratum into a sketch.
+sketch_quantiles:
+    Estimate a quantile and the number of values per stratum from the sketches.
+level_quantiles:
+    Estimate a quantile of the donors per stratum of all levels of drop_dimensions.
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# default rank error of the approximate median
+MEDIAN_ERROR = 0.01
+
+
+def merge_sketches(codes: np.ndarray, means: np.ndarray, weights: np.ndarray, error: float = MEDIAN_ERROR) -> tuple:
+    """
+    Compress the centroids of each stratum into a sketch.
+
+    Parameters
+    ----------
+    codes: np.ndarray
+        Integer array with the stratum code of each centroid.
+    means: np.ndarray
+        Float array with the mean of each centroid. Single values are centroids with weight 1.
+    weights: np.ndarray
+        Array with the number of values of each centroid.
+    error: float
+        Maximum fraction of the values of a stratum per centroid, which bounds the rank error of
+        the quantiles. A stratum keeps at most ceil(1 / error) centroids.
+
+    Returns
+    -------
+    tuple:
+        (codes, means, weights) of the compressed centroids, sorted by stratum and mean.
+
+    Notes
+    -----
+    The centroids of all strata are sorted at once. The rank of the center of each centroid within
+    its stratum gives the bucket on the uniform quantile scale, and the centroids of a bucket are
+    combined into their weighted mean. A stratum with at most ceil(1 / error) values keeps every
+    value, so its quantiles are exact.
+    """
+    if not 0 < error < 1:
+        raise ValueError(f"The error of a sketch must be between 0 and 1, got {error}.")
+    number_of_buckets = int(np.ceil(1 / error))
+    # one integer sort on the stratum and the rank of the mean is faster than a lexsort
+    ranks = np.empty(means.size, dtype=np.int64)
+    ranks[np.argsort(means)] = np.arange(means.size)
+    order = np.argsort(codes.astype(np.int64) * means.size + ranks)
+    codes = codes[order]
+    means = means[order]
+    weights = np.asarray(weights, dtype=np.float64)[order]
+    if codes.size == 0:
+        return codes, means, weights
+
+    centers, totals = _centers(codes, weights)
+    buckets = np.minimum((centers / totals * number_of_buckets).astype(np.int64), number_of_buckets - 1)
+
+    is_start = np.ones(codes.size, dtype=bool)
+    is_start[1:] = (codes[1:] != codes[:-1]) | (buckets[1:] != buckets[:-1])
+    starts = np.flatnonzero(is_start)
+    merged_weights = np.add.reduceat(weights, starts)
+    merged_means = np.add.reduceat(means * weights, starts) / merged_weights
+    return codes[starts], merged_means, merged_weights
+
+
+def _centers(codes: np.ndarray, weights: np.ndarray) -> tuple:
+    """
+    Compute the rank of the center of each centroid and the total weight of its stratum.
+    """
+    cumulative = np.cumsum(weights)
+    is_start = np.ones(codes.size, dtype=bool)
+    is_start[1:] = codes[1:] != codes[:-1]
+    run_starts = np.flatnonzero(is_start)
+    run_lengths = np.diff(run_starts, append=codes.size)
+    offsets = np.repeat(cumulative[run_starts] - weights[run_starts], run_lengths)
+    totals = np.repeat(np.add.reduceat(weights, run_starts), run_lengths)
+    return cumulative - offsets - weights / 2, totals
+
+
+def sketch_quantiles(
+    codes: np.ndarray,
+    means: np.ndarray,
+    weights: np.ndarray,
+    number_of_strata: int,
+    q: float = 0.5,
+) -> tuple:
+    """
+    Estimate a quantile and the number of values per stratum from the sketches.
+
+    Parameters
+    ----------
+    codes, means, weights: np.ndarray
+        Centroids as returned by :func:`merge_sketches`.
+    number_of_strata: int
+        Total number of strata.
+    q: float
+        Quantile to estimate, 0.5 for the median.
+
+    Returns
+    -------
+    tuple:
+        (quantiles, counts), both arrays of length number_of_strata. The quantile is NaN for
+        strata without values.
+
+    Notes
+    -----
+    The quantile is interpolated linearly between the centers of the centroids, which gives the
+    same median as *Series.median()* if all centroids are single values.
+    """
+    counts = np.bincount(codes, weights=weights, minlength=number_of_strata)
+    quantiles = np.full(number_of_strata, np.nan)
+    if codes.size == 0:
+        return quantiles, counts.astype(np.int64)
+
+    centers, _ = _centers(codes, weights)
+    sizes = np.bincount(codes, minlength=number_of_strata)
+    starts = np.cumsum(sizes) - sizes
+    targets = q * counts
+    before = np.bincount(codes, weights=centers < targets[codes], minlength=number_of_strata).astype(np.int64)
+
+    strata = np.flatnonzero(sizes > 0)
+    upper = starts[strata] + np.minimum(before[strata], sizes[strata] - 1)
+    lower = starts[strata] + np.maximum(before[strata] - 1, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = (targets[strata] - centers[lower]) / (centers[upper] - centers[lower])
+    fraction = np.where(upper == lower, 0.0, np.clip(fraction, 0, 1))
+    quantiles[strata] = means[lower] + fraction * (means[upper] - means[lower])
+    return quantiles, np.rint(counts).astype(np.int64)
+
+
+def level_quantiles(
+    values: np.ndarray,
+    levels: list,
+    donor_mask: np.ndarray,
+    error: float = MEDIAN_ERROR,
+    q: float = 0.5,
+    needed_levels=None,
+) -> list:
+    """
+    Estimate a quantile of the donors per stratum of all levels of drop_dimensions.
+
+    Parameters
+    ----------
+    values: np.ndarray
+        Float array with the values of the column.
+    levels: list
+        List of (stratum_codes, number_of_strata) tuples as returned by
+        :func:`imputegaps.kernels.factorize_levels`, starting with the deepest level.
+    donor_mask: np.ndarray
+        Boolean array which is True for the valid donors.
+    error: float
+        Rank error of the sketches, see :func:`merge_sketches`.
+    q: float
+        Quantile to estimate, 0.5 for the median.
+    needed_levels: array-like
+        Indices of the levels of which the quantiles are needed. All levels if not given.
+
+    Returns
+    -------
+    list:
+        Array with the quantile per stratum for each level, None for the levels which are not
+        needed.
+
+    Notes
+    -----
+    The donors are sketched once per combination of the stratum codes of all levels, which also
+    keeps the donors of which a deeper key is missing. The sketches of each level are merged from
+    these finest sketches, so the values are sorted only once.
+    """
+    donors = np.flatnonzero(donor_mask)
+    finest_codes = np.zeros(donors.size, dtype=np.int64)
+    for codes, number_of_strata in levels:
+        finest_codes, _ = pd.factorize(finest_codes * (number_of_strata + 1) + codes[donors] + 1)
+    number_of_finest = int(finest_codes.max()) + 1 if finest_codes.size > 0 else 0
+
+    sketch_codes, means, weights = merge_sketches(finest_codes, values[donors], np.ones(donors.size), error=error)
+    quantiles = []
+    for level, (codes, number_of_strata) in enumerate(levels):
+        if needed_levels is not None and level not in needed_levels:
+            quantiles.append(None)
+            continue
+        parents = np.full(number_of_finest, -1, dtype=np.int64)
+        parents[finest_codes] = codes[donors]
+        level_codes = parents[sketch_codes]
+        keep = level_codes >= 0
+        merged = merge_sketches(level_codes[keep], means[keep], weights[keep], error=error)
+        quantiles.append(sketch_quantiles(*merged, number_of_strata=number_of_strata, q=q)[0])
+    return quantiles
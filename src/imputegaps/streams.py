@@ -0,0 +1,251 @@
+"""
+
+This module provides the random streams of pick, which only depend on the seed, the name of the
+variable and the key of the stratum.
+
+Classes:
+--------
+
+StratumStreams:
+    Counter-based random streams per stratum of one or more variables.
+
+Functions:
+----------
+
+hash_uniforms:
+    Map keys to uniform numbers in [0, 1) which only depend on the key and a salt.
+stratum_hashes:
+    Hash the group_by keys of each record into one 64-bit key of its stratum.
+stratum_generator:
+    Make the random generator of one stratum of a variable.
+draw_uniforms:
+    Draw a uniform number for each recipient from a random generator or from the stratum streams.
+"""
+
+import hashlib
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# odd constant of the Weyl sequence of splitmix64, which spreads the counters of a stream
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+
+def salt_hash(salt: str) -> np.uint64:
+    """
+    Hash a salt into a 64-bit number.
+    """
+    return np.uint64(int.from_bytes(hashlib.blake2b(salt.encode(), digest_size=8).digest(), "little"))
+
+
+def _splitmix64(mixed: np.ndarray) -> np.ndarray:
+    """
+    Apply the finalizer of splitmix64 to an array of 64-bit numbers.
+    """
+    mixed = (mixed ^ (mixed >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    mixed = (mixed ^ (mixed >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return mixed ^ (mixed >> np.uint64(31))
+
+
+def hash_uniforms(keys, salt: str, counters=None) -> np.ndarray:
+    """
+    Map keys to uniform numbers in [0, 1) which only depend on the key and a salt.
+
+    Parameters
+    ----------
+    keys: array-like
+        Keys, for instance the identifiers of the records.
+    salt: str
+        Salt of the hash, for instance the seed and the name of the variable.
+    counters: array-like
+        Optional non-negative integer per key. The numbers of the counters of the same key form a
+        stream of that key.
+
+    Returns
+    -------
+    np.ndarray:
+        Array of floats with one number per key.
+
+    Notes
+    -----
+    The keys are hashed with pandas and mixed with the salt by the splitmix64 finalizer. Unlike
+    the numbers of a random generator, the number of a key does not depend on the other keys or on
+    the order in which they are drawn.
+    """
+    mixed = pd.util.hash_array(np.asarray(keys)) ^ salt_hash(salt)
+    if counters is not None:
+        mixed = _splitmix64(mixed) + np.asarray(counters).astype(np.uint64) * GOLDEN_GAMMA
+    return (_splitmix64(mixed) >> np.uint64(11)) * 2.0**-53
+
+
+def stratum_hashes(keys: list, size: int | None = None) -> np.ndarray:
+    """
+    Hash the group_by keys of each record into one 64-bit key of its stratum.
+
+    Parameters
+    ----------
+    keys: list
+        List of array-likes (one per group_by variable) with the same length.
+    size: int
+        Number of records, only needed if keys is empty.
+
+    Returns
+    -------
+    np.ndarray:
+        Array of uint64 with the hash of the stratum per record. Records with the same values of
+        the keys get the same hash, whatever the order or subset of the records.
+    """
+    if size is None:
+        size = len(keys[0]) if keys else 0
+    hashes = np.zeros(size, dtype=np.uint64)
+    for key in keys:
+        # as objects, such that a column hashes the same whatever its dtype in a worker
+        hashes = _splitmix64(hashes ^ pd.util.hash_array(np.asarray(key, dtype=object)))
+    return hashes
+
+
+def stratum_generator(seed: int | None, col_name: str, stratum_key) -> np.random.Generator:
+    """
+    Make the random generator of one stratum of a variable.
+
+    Parameters
+    ----------
+    seed: int
+        Seed of the imputation. A generator with fresh entropy is returned if None.
+    col_name: str
+        Name of the variable.
+    stratum_key:
+        Key of the stratum, for instance the name of a group of a groupby.
+
+    Returns
+    -------
+    np.random.Generator:
+        Generator which is seeded with a SeedSequence of the seed, the variable and the stratum.
+    """
+    if seed is None:
+        return np.random.default_rng()
+    entropy = int(salt_hash(f"{seed}:{col_name}:{stratum_key}"))
+    return np.random.default_rng(np.random.SeedSequence(entropy))
+
+
+class StratumStreams:
+    """
+    Counter-based random streams per stratum of one or more variables.
+
+    Arguments
+    ---------
+    seed: int
+        Seed of the imputation.
+    col_names: list
+        Names of the variables. For a block of variables, the records of the columns follow each
+        other, as in :func:`imputegaps.kernels.fill_block`.
+    stratum_keys: np.ndarray
+        Array with the hash of the stratum of each record, as returned by :func:`stratum_hashes`.
+        A 2-D array holds the hashes of each level of drop_dimensions, see :meth:`level`.
+
+    Notes
+    -----
+    The n-th recipient of a stratum, counted in the order of the records, gets the n-th number of
+    the stream of the seed, the variable and the key of the stratum. The draws therefore do not
+    depend on the codes of the strata, on the other strata or variables, or on the order in which
+    they are imputed, so a serial, parallel, batched or partitioned run draws the same donors.
+    """
+
+    def __init__(self, seed: int, col_names: list, stratum_keys: np.ndarray):
+        self.seed = seed
+        self.col_names = list(col_names)
+        self.stratum_keys = stratum_keys
+
+    def level(self, index: int) -> "StratumStreams":
+        """
+        Select the streams of one level of drop_dimensions.
+        """
+        return StratumStreams(self.seed, self.col_names, self.stratum_keys[index])
+
+    def columns(self, first: int, size: int) -> "StratumStreams":
+        """
+        Select the streams of size variables, starting with variable first.
+        """
+        return StratumStreams(self.seed, self.col_names[first : first + size], self.stratum_keys)
+
+    def uniforms(self, positions: np.ndarray, counters: np.ndarray, purpose: str = "pick") -> np.ndarray:
+        """
+        Draw the numbers of the given counters of the streams of the records at positions.
+
+        Parameters
+        ----------
+        positions: np.ndarray
+            Positions of the records. Positions beyond the number of records belong to the next
+            variables.
+        counters: np.ndarray
+            Index of the number in the stream of the stratum of each record.
+        purpose: str
+            Name of the use of the numbers, which separates for instance the draws of the donors
+            from the priorities of the reservoir.
+
+        Returns
+        -------
+        np.ndarray:
+            Array of floats in [0, 1), one per position.
+        """
+        number_of_records = self.stratum_keys.shape[-1]
+        columns, records = np.divmod(positions, max(number_of_records, 1))
+        uniforms = np.empty(positions.size, dtype=np.float64)
+        for column in np.unique(columns):
+            selection = columns == column
+            salt = f"{self.seed}:{self.col_names[column]}"
+            if purpose != "pick":
+                salt = f"{salt}:{purpose}"
+            uniforms[selection] = hash_uniforms(
+                self.stratum_keys[records[selection]], salt, counters=counters[selection]
+            )
+        return uniforms
+
+
+def draw_uniforms(
+    rng,
+    positions: np.ndarray,
+    stratum_codes: np.ndarray,
+    offsets: np.ndarray | None = None,
+    purpose: str = "pick",
+) -> np.ndarray:
+    """
+    Draw a uniform number for each recipient from a random generator or from the stratum streams.
+
+    Parameters
+    ----------
+    rng:
+        :class:`StratumStreams`, or a random generator with a *random(size)* method.
+    positions: np.ndarray
+        Positions of the recipients in increasing order.
+    stratum_codes: np.ndarray
+        Integer array with the stratum code per record.
+    offsets: np.ndarray
+        Number of recipients per stratum which drew before, for draws which are made in blocks.
+    purpose: str
+        Name of the use of the numbers, see :meth:`StratumStreams.uniforms`.
+
+    Returns
+    -------
+    np.ndarray:
+        Array of floats in [0, 1), one per recipient.
+    """
+    if not isinstance(rng, StratumStreams):
+        return rng.random(positions.size)
+
+    # the counter of a recipient is its rank among the recipients of its stratum
+    codes = stratum_codes[positions]
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    is_start = np.ones(sorted_codes.size, dtype=bool)
+    is_start[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    run_starts = np.flatnonzero(is_start)
+    run_lengths = np.diff(run_starts, append=sorted_codes.size)
+    counters = np.empty(codes.size, dtype=np.int64)
+    counters[order] = np.arange(codes.size) - np.repeat(run_starts, run_lengths)
+    if offsets is not None:
+        counters += offsets[codes]
+    return rng.uniforms(positions, counters, purpose=purpose)
@@ -7,9 +7,13 @@ Read more about conftest.py under:
 - https://docs.pytest.org/en/stable/writing_plugins.html
 """
 
+import numpy as np
+import pandas as pd
 import pytest
 import yaml
 
+from imputegaps.impute_gaps import ImputeGaps
+
 DEFAULT_SETTINGS = {
     "general": {
         "imputation": {"imputation_methods": ["pick", "dict"]},
@@ -26,3 +30,67 @@ def input_settings():
     This fixture returns a YAML string containing the default settings for the tests.
     """
     return yaml.dump(DEFAULT_SETTINGS)
+
+
+VARIABLES = {
+    "float0": {"type": "float"},
+    "float1": {"type": "float", "filter": "internet"},
+    "float2": {"type": "float"},
+    "dict0": {"type": "dict"},
+}
+
+
+def records_with_gaps(number_of_records=800, seed=1, gap_rate=0.3, number_of_floats=3, missing_keys=0.0):
+    """
+    Make records with float variables and a dict variable with gaps, the group_by variables gk and sbi
+    and the filter variable internet.
+
+    A share gap_rate of the values of every variable and a share missing_keys of the group_by keys are
+    missing.
+    """
+    rng = np.random.default_rng(seed)
+    records = pd.DataFrame({"be_id": np.arange(number_of_records)})
+    for name, keys in [("gk", ["10", "20", "30"]), ("sbi", list("ABCDEFGH"))]:
+        records[name] = rng.choice(keys, size=number_of_records).astype(object)
+        records.loc[rng.random(number_of_records) < missing_keys, name] = None
+    records["internet"] = rng.choice([0, 1], size=number_of_records, p=[0.3, 0.7])
+    for index in range(number_of_floats):
+        values = np.round(rng.normal(50, 10, size=number_of_records))
+        values[rng.random(number_of_records) < gap_rate] = np.nan
+        records[f"float{index}"] = values
+    records["dict0"] = pd.Series(rng.choice(["a", "b", "c"], size=number_of_records), dtype=object)
+    records.loc[rng.random(number_of_records) < gap_rate, "dict0"] = None
+    return records.set_index("be_id")
+
+
+@pytest.fixture
+def variables():
+    """
+    The variables of the records of make_records. A test module overrides this fixture for other variables.
+    """
+    return {name: dict(properties) for name, properties in VARIABLES.items()}
+
+
+@pytest.fixture
+def make_records():
+    """
+    Factory of records with gaps, indexed by be_id.
+    """
+    return records_with_gaps
+
+
+@pytest.fixture
+def make_imputer(variables):
+    """
+    Factory of an ImputeGaps for the variables, which imputes the float variables with how and the dict
+    variables with mode, unless other imputation_methods are given.
+    """
+
+    def make_imputer(how="mean", imputation_methods=None, **kwargs):
+        if imputation_methods is None:
+            imputation_methods = {"mode": ["dict"]}
+            imputation_methods.setdefault(how, []).append("float")
+        kwargs = {"variables": variables, "min_threshold": 3, "seed": 1, **kwargs}
+        return ImputeGaps(index_key="be_id", imputation_methods=imputation_methods, **kwargs)
+
+    return make_imputer
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from imputegaps.impute_gaps import fill_missing_data_grouped
+from imputegaps.kernels import ARRAY_METHODS, factorize_strata, impute_arrays
+from imputegaps.streams import StratumStreams, stratum_hashes
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - The array kernel gives the same result as the imputation of a pd.Series for every method, with
+#   donor masks and min_threshold, and marks the imputed values.
+# - Object arrays are imputed with mode, pick, nan and pick1, but not with mean or median.
+# - A block of columns is imputed as the columns one by one.
+
+
+@pytest.fixture
+def arrays(make_records):
+    """
+    A float column with gaps, the stratum keys and the records with internet as donors
+    """
+    records_df = make_records(number_of_records=1000, seed=6)
+    keys = [records_df["gk"].to_numpy(), records_df["sbi"].to_numpy()]
+    return records_df["float0"].to_numpy(), keys, records_df["internet"].to_numpy() == 1
+
+
+@pytest.mark.parametrize("method", ARRAY_METHODS)
+@pytest.mark.parametrize("min_threshold", [1, 15])
+def test_arrays_equal_series(arrays, method, min_threshold):
+    values, keys, donor_mask = arrays
+    codes, number_of_strata = factorize_strata(keys)
+    streams = StratumStreams(2, ["omzet"], stratum_hashes(keys))
+
+    filled_values, imputed_mask = impute_arrays(
+        values, codes, donor_mask=donor_mask, method=method, min_threshold=min_threshold, rng=streams
+    )
+
+    expected = fill_missing_data_grouped(
+        pd.Series(values, name="omzet"),
+        invalid_donors=~donor_mask,
+        how=method,
+        min_threshold=min_threshold,
+        stratum_codes=(codes, number_of_strata),
+        rng=StratumStreams(2, ["omzet"], stratum_hashes(keys)),
+    )
+    np.testing.assert_array_equal(filled_values, expected.to_numpy())
+    np.testing.assert_array_equal(imputed_mask, np.isnan(values) & ~np.isnan(filled_values))
+    assert imputed_mask.any()
+    np.testing.assert_array_equal(filled_values[~imputed_mask], values[~imputed_mask])
+
+
+def test_object_arrays():
+    values = np.array(["a", None, "b", "b", None, "c", np.nan], dtype=object)
+    codes = np.array([0, 0, 0, 1, 1, 1, -1])
+
+    filled_values, imputed_mask = impute_arrays(values, codes, method="mode")
+    # ties are broken by the smallest value, the record without stratum is not imputed
+    assert filled_values[:6].tolist() == ["a", "a", "b", "b", "b", "c"]
+    assert pd.isna(filled_values[6])
+    np.testing.assert_array_equal(imputed_mask, [False, True, False, False, True, False, False])
+
+    filled_values, _ = impute_arrays(values, codes, method="pick", rng=np.random.default_rng(1))
+    assert filled_values[1] in ("a", "b")
+    assert filled_values[4] in ("b", "c")
+
+    filled_values, imputed_mask = impute_arrays(values, codes, method="nan")
+    assert filled_values[[1, 4]].tolist() == [0, 0]
+    assert not imputed_mask[6]
+
+    with pytest.raises(TypeError):
+        impute_arrays(values, codes, method="median")
+    with pytest.raises(ValueError):
+        impute_arrays(values, codes, method="average")
+
+
+@pytest.mark.parametrize("method", ["median", "mode", "pick", "pick1"])
+def test_block_equals_columns(arrays, method):
+    values, keys, donor_mask = arrays
+    block = np.column_stack([values, np.roll(values, 7), np.roll(values, 11)])
+    block_donors = np.column_stack([donor_mask, donor_mask, ~np.roll(donor_mask, 3)])
+    codes, _ = factorize_strata(keys)
+    col_names = ["var0", "var1", "var2"]
+    hashes = stratum_hashes(keys)
+
+    filled_values, imputed_mask = impute_arrays(
+        block, codes, donor_mask=block_donors, method=method, rng=StratumStreams(4, col_names, hashes)
+    )
+
+    for index, col_name in enumerate(col_names):
+        column_values, column_mask = impute_arrays(
+            block[:, index],
+            codes,
+            donor_mask=block_donors[:, index],
+            method=method,
+            rng=StratumStreams(4, [col_name], hashes),
+        )
+        np.testing.assert_array_equal(filled_values[:, index], column_values)
+        np.testing.assert_array_equal(imputed_mask[:, index], column_mask)
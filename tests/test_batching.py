@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from imputegaps.kernels import fill_block, fill_grouped
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - Imputing the float variables in batches gives the same result as imputing them one by one for
+#   mean, median, mode and pick, with and without track_imputed and drop_dimensions.
+# - Variables used in a filter are not batched across other variables.
+# - The batched pick only copies values of the same variable and stratum.
+# - Wide blocks are imputed in chunks of columns.
+
+
+def make_variables(filtered=(1, 3)):
+    """
+    Make the settings of six float variables, some of which are filtered on internet
+    """
+    variables = {}
+    for index in range(6):
+        properties = {"type": "float"}
+        if index in filtered:
+            properties["filter"] = "internet"
+        variables[f"float{index}"] = properties
+    return variables
+
+
+@pytest.fixture
+def records_df(make_records):
+    return make_records(number_of_records=600, seed=4, number_of_floats=6)
+
+
+@pytest.fixture
+def impute(make_imputer):
+    def impute(records_df, how, batch_columns, track_imputed=False, drop_dimensions=True, variables=None):
+        impute_gaps = make_imputer(
+            variables=variables or make_variables(),
+            imputation_methods={how: ["float"]},
+            track_imputed=track_imputed,
+            batch_columns=batch_columns,
+        )
+        return impute_gaps.impute_gaps(records_df.copy(), group_by=["gk", "sbi"], drop_dimensions=drop_dimensions)
+
+    return impute
+
+
+@pytest.mark.parametrize("how", ["mean", "median", "mode", "pick"])
+@pytest.mark.parametrize("track_imputed", [False, True])
+@pytest.mark.parametrize("drop_dimensions", [False, True])
+def test_batches_equal_column_by_column(impute, records_df, how, track_imputed, drop_dimensions):
+    """
+    Compare the batched imputation with the imputation column by column
+    """
+    expected = impute(
+        records_df, how, batch_columns=False, track_imputed=track_imputed, drop_dimensions=drop_dimensions
+    )
+    result = impute(records_df, how, batch_columns=True, track_imputed=track_imputed, drop_dimensions=drop_dimensions)
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_filter_variable_is_not_batched_across(impute, make_imputer, records_df):
+    """
+    A variable used in a filter is imputed at its own place in the order of the variables
+    """
+    records_df["internet"] = records_df["internet"].astype(float)
+    records_df.loc[records_df.index[::7], "internet"] = np.nan
+    variables = make_variables()
+    variables["internet"] = {"type": "float"}
+    # internet comes before the variables, so all filtered variables see the imputed filter
+    records_df = records_df[["gk", "sbi", "float0", "internet"] + [f"float{index}" for index in range(1, 6)]]
+
+    impute_gaps = make_imputer(variables=variables, imputation_methods={"mode": ["float"]})
+    variable_settings = {name: impute_gaps._variable_settings(name) for name in records_df.columns[2:]}
+    assert impute_gaps._column_batches(records_df, variable_settings) == [
+        [["float0"]],
+        [["internet"]],
+        [["float1", "float3"], ["float2", "float4", "float5"]],
+    ]
+
+    expected = impute(records_df, "mode", batch_columns=False, variables=variables)
+    result = impute(records_df, "mode", batch_columns=True, variables=variables)
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_batched_pick_draws_from_same_variable(impute, records_df):
+    """
+    Each imputed value is a value of the same variable in the same stratum
+    """
+    result = impute(records_df, "pick", batch_columns=True, drop_dimensions=False)
+
+    for index in range(6):
+        col_name = f"float{index}"
+        imputed = records_df[col_name].isnull() & result[col_name].notnull()
+        assert imputed.any()
+        for (gk, sbi), stratum in result[imputed].groupby(["gk", "sbi"]):
+            mask_stratum = (records_df["gk"] == gk) & (records_df["sbi"] == sbi)
+            assert stratum[col_name].isin(records_df.loc[mask_stratum, col_name].dropna()).all()
+
+
+def test_fill_block_in_chunks(monkeypatch):
+    """
+    A block which is split in chunks of columns gives the same result as column by column
+    """
+    rng = np.random.default_rng(2)
+    values = rng.normal(size=(200, 5))
+    values[rng.random(values.shape) < 0.4] = np.nan
+    stratum_codes = rng.integers(-1, 7, size=200)
+
+    monkeypatch.setattr("imputegaps.kernels.MAX_BLOCK_STRATA", 14)
+    result = fill_block(values, stratum_codes, how="median", number_of_strata=7, min_threshold=2)
+
+    for index in range(values.shape[1]):
+        expected, _ = fill_grouped(
+            values[:, index],
+            stratum_codes,
+            ~np.isnan(values[:, index]),
+            how="median",
+            min_threshold=2,
+            number_of_strata=7,
+        )
+        np.testing.assert_array_equal(result[:, index], expected)
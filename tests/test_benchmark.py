@@ -0,0 +1,96 @@
+import json
+
+import numpy as np
+import pytest
+
+from imputegaps.benchmark import (
+    METHODS,
+    compare_results,
+    imputation_methods_for,
+    main,
+    make_survey_records,
+    run_benchmarks,
+)
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - The synthetic records follow the number of rows, strata, variables, missing rate, type mix and
+#   filters, and are the same for the same seed.
+# - Skewed strata give a larger first category.
+# - All variable types get an imputation method which can impute them.
+# - The benchmarks measure every method with and without track_imputed.
+# - The command line writes the results as JSON and compares them with an earlier run.
+
+
+def test_make_survey_records():
+    records_df, variables, group_by = make_survey_records(
+        number_of_records=2000, strata=(5, 3, 2), number_of_variables=12, missing_rate=0.25, filter_rate=0.5
+    )
+
+    assert len(records_df) == 2000
+    assert records_df.index.name == "be_id"
+    assert group_by == ["key0", "key1", "key2"]
+    assert [records_df[name].nunique() for name in group_by] == [5, 3, 2]
+    assert len(variables) == 12
+    missing_rates = records_df[list(variables)].isna().mean()
+    assert ((missing_rates > 0.2) & (missing_rates < 0.3)).all()
+    assert {properties["type"] for properties in variables.values()} <= {"float", "int", "dict", "bool"}
+    assert any("filter" in properties for properties in variables.values())
+    again, _, _ = make_survey_records(
+        number_of_records=2000, strata=(5, 3, 2), number_of_variables=12, missing_rate=0.25, filter_rate=0.5
+    )
+    assert again.equals(records_df)
+
+
+def test_skewed_strata():
+    uniform, _, _ = make_survey_records(number_of_records=5000, strata=(10,), strata_skew=0.0)
+    skewed, _, _ = make_survey_records(number_of_records=5000, strata=(10,), strata_skew=1.5)
+
+    assert skewed["key0"].value_counts().iloc[0] > 2 * uniform["key0"].value_counts().iloc[0]
+
+
+@pytest.mark.parametrize("how", METHODS)
+def test_imputation_methods_for(how):
+    _, variables, _ = make_survey_records(number_of_records=10, number_of_variables=20)
+
+    imputation_methods = imputation_methods_for(how, variables)
+
+    types = {properties["type"] for properties in variables.values()}
+    assert sorted(sum(imputation_methods.values(), [])) == sorted(types)
+    if how in ("mean", "median"):
+        assert imputation_methods["mode"] == ["dict"]
+
+
+def test_run_benchmarks():
+    cases = {"small": {"number_of_records": 300}, "deep": {"number_of_records": 300, "strata": (4, 3, 2)}}
+
+    results = run_benchmarks(cases, methods=("mean", "pick"))
+
+    assert [(result["case"], result["method"], result["track_imputed"]) for result in results] == [
+        (case, how, track_imputed) for case in cases for how in ("mean", "pick") for track_imputed in (False, True)
+    ]
+    for result in results:
+        assert result["wall_time"] > 0
+        assert result["peak_memory"] > 0
+        assert 0 < result["number_of_imputed"] <= result["number_of_gaps"]
+    assert results[-1]["strata"] == [4, 3, 2]
+
+
+def test_main_writes_and_compares(tmp_path, capsys):
+    baseline = tmp_path / "baseline.json"
+    args = ["--cases", "base,no_drop_dimensions", "--methods", "median,nan", "--scale", "0.01"]
+    main(args + ["--output", str(baseline)])
+    current = tmp_path / "current.json"
+
+    main(args + ["--output", str(current), "--compare", str(baseline)])
+
+    report = json.loads(current.read_text())
+    assert len(report["results"]) == 8
+    assert {"version", "python", "numpy", "pandas", "created"} <= set(report)
+    comparison = compare_results(json.loads(baseline.read_text()), report)
+    assert len(comparison) == 8
+    assert np.isfinite(comparison["wall_time_ratio"]).all()
+    assert "wall_time_ratio" in capsys.readouterr().out
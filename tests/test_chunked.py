@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from imputegaps.chunked import ChunkedImputer, impute_gaps_chunked
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - The two pass imputation of chunks gives the same result as the rollup imputation of all records
+#   at once for mean, median, mode, nan and pick1, with and without drop_dimensions.
+# - pick draws from a uniform sample of the donors of the stratum, also with a small reservoir.
+# - The donors drawn by pick do not depend on the size of the chunks.
+# - The median of the value counts equals the median of the values.
+
+
+@pytest.fixture
+def records_df(make_records):
+    return make_records(number_of_records=1200, seed=5, gap_rate=0.4, missing_keys=0.05).reset_index()
+
+
+@pytest.fixture
+def variables(variables):
+    variables["float2"]["set_nan_eval"] = "internet == 0"
+    return variables
+
+
+def split_in_chunks(records_df, chunk_size=250):
+    return lambda: (
+        records_df.iloc[start : start + chunk_size].copy() for start in range(0, len(records_df), chunk_size)
+    )
+
+
+@pytest.mark.parametrize("how", ["mean", "median", "mode", "nan", "pick1"])
+@pytest.mark.parametrize("drop_dimensions", [False, True])
+def test_chunked_equals_rollup(make_imputer, records_df, how, drop_dimensions):
+    """
+    Compare the imputation in chunks with the rollup imputation of all records
+    """
+    expected = make_imputer(how).impute_gaps(
+        records_df.set_index("be_id"), group_by=["gk", "sbi"], drop_dimensions=drop_dimensions, rollup=True
+    )
+
+    chunks = impute_gaps_chunked(
+        make_imputer(how), split_in_chunks(records_df), group_by=["gk", "sbi"], drop_dimensions=drop_dimensions
+    )
+    result = pd.concat(chunks).set_index("be_id")
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize("reservoir_size", [3, 1000])
+def test_chunked_pick(make_imputer, records_df, reservoir_size):
+    """
+    pick imputes the same gaps as the rollup imputation with donors of the same stratum
+    """
+    expected = make_imputer("pick").impute_gaps(records_df.set_index("be_id"), group_by=["gk", "sbi"], rollup=True)
+
+    chunks = impute_gaps_chunked(
+        make_imputer("pick"), split_in_chunks(records_df), group_by=["gk", "sbi"], reservoir_size=reservoir_size
+    )
+    result = pd.concat(chunks).set_index("be_id")
+
+    pd.testing.assert_frame_equal(result.isnull(), expected.isnull())
+    imputed = records_df.set_index("be_id")["float0"].isnull() & result["float0"].notnull()
+    for (gk, sbi), stratum in result[imputed].groupby(["gk", "sbi"]):
+        donors = records_df.loc[(records_df["gk"] == gk) & (records_df["sbi"] == sbi), "float0"].dropna()
+        assert stratum["float0"].isin(donors).all()
+        if reservoir_size == 3:
+            assert stratum["float0"].nunique() <= 3
+
+
+def test_chunked_pick_does_not_depend_on_chunks(make_imputer, records_df):
+    """
+    pick draws the same donors whatever the size of the chunks
+    """
+    results = []
+    for chunk_size in [250, 400]:
+        chunks = impute_gaps_chunked(
+            make_imputer("pick"),
+            split_in_chunks(records_df, chunk_size=chunk_size),
+            group_by=["gk", "sbi"],
+            drop_dimensions=True,
+            reservoir_size=3,
+        )
+        results.append(pd.concat(chunks))
+
+    pd.testing.assert_frame_equal(results[0], results[1])
+
+
+def test_reservoir_is_uniform(make_imputer):
+    """
+    The donors in the reservoir are a uniform sample of the donors of the stratum
+    """
+    records_df = pd.DataFrame({"be_id": np.arange(4000), "gk": "10", "float0": np.arange(4000) % 10 + 0.0})
+    chunked_imputer = ChunkedImputer(make_imputer("pick"), group_by=["gk"], reservoir_size=2000)
+    for chunk in split_in_chunks(records_df, chunk_size=300)():
+        chunked_imputer.update(chunk)
+    chunked_imputer.finalize()
+
+    donors = chunked_imputer.donors[("float0", ("gk",))]
+    assert donors.size == 2000
+    np.testing.assert_allclose(np.bincount(donors.astype(int)) / donors.size, 0.1, atol=0.02)
+    assert chunked_imputer.statistics[("float0", ("gk",))]["count"].iloc[0] == 4000
+
+
+def test_median_from_value_counts():
+    values = pd.Series([3.0, 1.0, 2.0, 2.0, 7.0, 4.0, 4.0, 9.0])
+    keys = pd.Series(["a", "a", "a", "b", "b", "b", "b", "c"], name="gk")
+    value_counts = values.groupby([keys, values.rename("value")]).size()
+
+    table = ChunkedImputer._value_count_statistics(value_counts, "median")
+
+    pd.testing.assert_series_equal(table["value"], values.groupby(keys).median(), check_names=False)
+    assert table["count"].tolist() == [3, 4, 1]
@@ -0,0 +1,247 @@
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+
+from imputegaps.fileio import (
+    RecordsWriter,
+    file_format,
+    needed_columns,
+    read_records,
+    read_records_in_chunks,
+    variable_dtypes,
+    write_records,
+)
+from imputegaps.impute_gaps import ImputeGaps
+from imputegaps.main import main
+from imputegaps.plan import ImputationPlan
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - The file format follows from the extension, including compressed CSV.
+# - Records are written and read back in all formats, completely, by projection and in chunks.
+# - The columns needed for the imputation include the sources of the variables which are imputed.
+# - The data types follow from the types of the variables, with the c and pyarrow CSV engines.
+# - Numeric dict codes are read as numeric categories, so filters, set_nan_eval and the ties of the
+#   mode compare them as numbers, also with the c engine and in chunks.
+# - The mean of a nullable integer variable makes it a float variable.
+# - The command line reads and writes all formats, in memory and in chunks.
+
+FORMATS = ["records.csv", "records.csv.gz", "records.csv.bz2", "records.csv.zip", "records.parquet", "records.feather"]
+
+
+def make_records(number_of_records=300, seed=3):
+    rng = np.random.default_rng(seed)
+    values = np.round(rng.normal(50, 10, size=number_of_records))
+    values[rng.random(number_of_records) < 0.3] = np.nan
+    return pd.DataFrame(
+        {
+            "be_id": np.arange(number_of_records),
+            "gk": rng.choice(["A", "B"], size=number_of_records),
+            "internet": rng.choice([0, 1], size=number_of_records),
+            "omzet": values,
+            "unused": rng.random(number_of_records),
+        }
+    )
+
+
+def skip_without_pyarrow(filename):
+    if file_format(filename) != "csv":
+        pytest.importorskip("pyarrow")
+
+
+@pytest.mark.parametrize(
+    "filename, expected",
+    [
+        ("a.csv", "csv"),
+        ("a.CSV.GZ", "csv"),
+        ("a.b.csv.zst", "csv"),
+        ("a.parquet", "parquet"),
+        ("a.pq", "parquet"),
+        ("a.feather", "feather"),
+        ("a.arrow", "feather"),
+    ],
+)
+def test_file_format(filename, expected):
+    assert file_format(filename) == expected
+
+
+def test_unknown_file_format():
+    with pytest.raises(ValueError, match="Unknown file format"):
+        file_format("records.xlsx")
+
+
+@pytest.mark.parametrize("name", FORMATS)
+def test_write_and_read(tmp_path, name):
+    skip_without_pyarrow(name)
+    filename = tmp_path / name
+    records_df = make_records()
+    write_records(records_df, filename)
+
+    pd.testing.assert_frame_equal(read_records(filename), records_df, check_dtype=False)
+    pd.testing.assert_frame_equal(
+        read_records(filename, columns={"be_id", "omzet", "not_in_file"}),
+        records_df[["be_id", "omzet"]],
+        check_dtype=False,
+    )
+
+
+@pytest.mark.parametrize("name", FORMATS)
+def test_write_and_read_in_chunks(tmp_path, name):
+    skip_without_pyarrow(name)
+    filename = tmp_path / name
+    records_df = make_records()
+    with RecordsWriter(filename) as writer:
+        for start in range(0, len(records_df), 70):
+            writer.write(records_df.iloc[start : start + 70])
+
+    chunks = list(read_records_in_chunks(filename, chunksize=70, columns={"gk", "omzet"}, dtype={"gk": str}))
+
+    assert all(len(chunk) <= 70 for chunk in chunks)
+    result = pd.concat(chunks, ignore_index=True)
+    pd.testing.assert_frame_equal(result, records_df[["gk", "omzet"]], check_dtype=False)
+
+
+def test_needed_columns():
+    variables = {
+        "omzet": {"type": "float", "filter": "internet"},
+        "kosten": {"type": "float", "set_nan_eval": "omzet < 0 | gk == 1"},
+        "naam": {"type": "str", "filter": "status"},
+    }
+    imputation_methods = {"mean": ["float"]}
+
+    plan = ImputationPlan(variables, imputation_methods)
+    assert needed_columns("be_id", ["sbi"], plan) == {"be_id", "sbi", "omzet", "kosten", "naam", "internet", "gk"}
+    plan = ImputationPlan({"omzet": {"type": "float", "filter": "not valid ("}}, imputation_methods)
+    assert needed_columns("be_id", ["sbi"], plan) is None
+
+
+def test_variable_dtypes():
+    variables = {
+        "omzet": {"type": "float"},
+        "gk": {"type": "dict"},
+        "naam": {"type": "str"},
+        "internet": {"type": "bool"},
+        "werkzame_personen": {"type": "int"},
+        "datum": {"type": "date"},
+        "onbekend": {},
+    }
+
+    assert variable_dtypes(variables, float_dtype="float32") == {
+        "omzet": "float32",
+        "gk": "category",
+        "naam": "category",
+        "internet": "Int8",
+        "werkzame_personen": "Int32",
+    }
+
+
+@pytest.mark.parametrize("engine", ["c", "pyarrow"])
+def test_read_with_variable_dtypes(tmp_path, engine):
+    if engine == "pyarrow":
+        pytest.importorskip("pyarrow")
+    filename = tmp_path / "records.csv.gz"
+    records_df = make_records()
+    records_df.loc[::5, "internet"] = np.nan
+    write_records(records_df, filename)
+    variables = {"gk": {"type": "dict"}, "internet": {"type": "bool"}, "omzet": {"type": "float"}}
+
+    result = read_records(
+        filename, columns={"gk", "internet", "omzet"}, dtype=variable_dtypes(variables), engine=engine
+    )
+
+    assert result.dtypes.to_dict() == {"gk": "category", "internet": "Int8", "omzet": "float64"}
+    assert result["internet"].isna().sum() == records_df["internet"].isna().sum()
+    assert result["gk"].cat.categories.tolist() == ["A", "B"]
+
+
+@pytest.mark.parametrize("chunksize", [None, 3])
+def test_read_numeric_dict_codes(tmp_path, chunksize):
+    filename = tmp_path / "records.csv"
+    records_df = pd.DataFrame(
+        {
+            "be_id": range(6),
+            "gk": ["A"] * 6,
+            "internet": [1, 1, 2, 1, 0, 2],
+            "klasse": [2, 10, 10, 2, None, None],
+            "omzet": [1.0, 3.0, 5.0, None, None, None],
+        }
+    )
+    write_records(records_df, filename)
+    variables = {
+        "internet": {"type": "dict"},
+        "klasse": {"type": "dict"},
+        "omzet": {"type": "float", "filter": "internet", "set_nan_eval": "internet == 0"},
+    }
+    dtype = variable_dtypes(variables)
+    if chunksize is None:
+        chunks = [read_records(filename, dtype=dtype, engine="c")]
+    else:
+        chunks = list(read_records_in_chunks(filename, chunksize, dtype=dtype))
+    for chunk in chunks:
+        assert chunk["internet"].cat.categories.dtype == "Int64"
+        assert chunk["klasse"].cat.categories.dtype == "Int64"
+    result = pd.concat(chunks).astype({"internet": "category", "klasse": "category"})
+    assert result["internet"].cat.categories.tolist() == [0, 1, 2]
+    impute_gaps = ImputeGaps(
+        index_key="be_id", variables=variables, imputation_methods={"mean": ["float"], "mode": ["dict"]}
+    )
+
+    result = impute_gaps.impute_gaps(result, group_by=["gk"])
+
+    # only the record with internet 1 is imputed, with the mean of the other records with internet 1
+    assert result["omzet"].tolist()[:4] == [1.0, 3.0, 5.0, 2.0]
+    assert result["omzet"].iloc[4:].isna().all()
+    # the tie between 2 and 10 is decided by the numeric order of the codes
+    assert result["klasse"].tolist()[4:] == [2, 2]
+
+
+def test_mean_of_nullable_integer():
+    records_df = pd.DataFrame(
+        {"be_id": range(4), "gk": ["A"] * 4, "personen": pd.array([1, 2, None, 2], dtype="Int32")}
+    ).set_index("be_id")
+    impute_gaps = ImputeGaps(
+        index_key="be_id", variables={"personen": {"type": "int"}}, imputation_methods={"mean": ["int"]}
+    )
+
+    result = impute_gaps.impute_gaps(records_df, group_by=["gk"])
+
+    assert result["personen"].dtype == "Float64"
+    assert result["personen"].tolist() == [1, 2, 5 / 3, 2]
+
+
+def write_settings(tmp_path):
+    variables_file = tmp_path / "variables.csv"
+    pd.DataFrame({"naam": ["omzet"], "type": ["float"], "filter": ["internet"]}).to_csv(
+        variables_file, sep=";", index=False
+    )
+    settings_file = tmp_path / "settings.yml"
+    settings = {"general": {"imputation": {"imputation_methods": {"mean": ["float"]}, "set_seed": 1}}}
+    settings_file.write_text(yaml.dump(settings))
+    return ["--variables", str(variables_file), "--impute_settings_file", str(settings_file)]
+
+
+@pytest.mark.parametrize("input_name", ["records.csv.gz", "records.parquet"])
+@pytest.mark.parametrize("output_name", ["imputed.csv", "imputed.csv.zip", "imputed.feather"])
+@pytest.mark.parametrize("chunksize", [None, 100])
+def test_main_reads_and_writes(tmp_path, input_name, output_name, chunksize):
+    skip_without_pyarrow(input_name)
+    skip_without_pyarrow(output_name)
+    records_df = make_records()
+    write_records(records_df, tmp_path / input_name)
+    output_filename = tmp_path / output_name
+
+    args = [str(tmp_path / input_name), "--output_filename", str(output_filename), "--id", "be_id"]
+    args += ["--group_by", "gk", "--drop_dimensions"] + write_settings(tmp_path)
+    if chunksize is not None:
+        args += ["--chunksize", str(chunksize)]
+    main(args)
+
+    result = read_records(output_filename)
+    assert list(result.columns) == ["be_id", "gk", "internet", "omzet"]
+    mask_filter = records_df["internet"] == 1
+    assert result.loc[mask_filter, "omzet"].notnull().all()
+    pd.testing.assert_series_equal(result.loc[~mask_filter, "omzet"], records_df.loc[~mask_filter, "omzet"])
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - fit followed by transform of the same records gives the same result as the rollup imputation
+#   for mean, median, mode, nan and pick1, with and without drop_dimensions.
+# - The statistics which are saved to and loaded from Parquet impute the same values.
+# - pick imputes donors of the fitted stratum, also after loading.
+# - pick draws the same donors when transforming twice, after loading and for a subset of the records.
+# - A new batch of records is imputed with the statistics of the fitted records.
+
+
+@pytest.fixture
+def records_df(make_records):
+    return make_records(number_of_records=1000, seed=8, gap_rate=0.4, missing_keys=0.05)
+
+
+@pytest.mark.parametrize("how", ["mean", "median", "mode", "nan", "pick1"])
+@pytest.mark.parametrize("drop_dimensions", [False, True])
+def test_fit_transform_equals_rollup(make_imputer, records_df, how, drop_dimensions):
+    expected = make_imputer(how).impute_gaps(
+        records_df, group_by=["gk", "sbi"], drop_dimensions=drop_dimensions, rollup=True
+    )
+
+    impute_gaps = make_imputer(how).fit(records_df, group_by=["gk", "sbi"], drop_dimensions=drop_dimensions)
+    result = impute_gaps.transform(records_df)
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert records_df["float0"].isnull().any()
+
+
+@pytest.mark.parametrize("how", ["mean", "median", "mode"])
+def test_save_and_load(make_imputer, make_records, records_df, tmp_path, how):
+    pytest.importorskip("pyarrow")
+    new_df = make_records(number_of_records=50, seed=9)
+    fitted = make_imputer(how).fit(records_df, group_by=["gk", "sbi"], drop_dimensions=True)
+    fitted.save(tmp_path / "statistics.parquet")
+
+    loaded = make_imputer(how).load(tmp_path / "statistics.parquet")
+
+    pd.testing.assert_frame_equal(loaded.transform(new_df), fitted.transform(new_df))
+    assert loaded.fitted_statistics.levels == [("gk", "sbi"), ("gk",), ()]
+
+
+def test_save_and_load_pick(make_imputer, make_records, records_df, tmp_path):
+    pytest.importorskip("pyarrow")
+    new_df = make_records(number_of_records=200, seed=9)
+    fitted = make_imputer("pick").fit(records_df, group_by=["gk", "sbi"], reservoir_size=4)
+    fitted.save(tmp_path / "statistics.parquet")
+
+    result = make_imputer("pick").load(tmp_path / "statistics.parquet").transform(new_df)
+
+    pd.testing.assert_frame_equal(result.isnull(), fitted.transform(new_df).isnull())
+    imputed = new_df["float0"].isnull() & result["float0"].notnull()
+    for (gk, sbi), stratum in result[imputed].groupby(["gk", "sbi"]):
+        donors = records_df.loc[(records_df["gk"] == gk) & (records_df["sbi"] == sbi), "float0"]
+        assert stratum["float0"].isin(donors.dropna()).all()
+        assert stratum["float0"].nunique() <= 4
+
+
+def test_pick_is_reproducible(make_imputer, make_records, records_df, tmp_path):
+    pytest.importorskip("pyarrow")
+    new_df = make_records(number_of_records=200, seed=9)
+    fitted = make_imputer("pick").fit(records_df, group_by=["gk", "sbi"], drop_dimensions=True, reservoir_size=4)
+    expected = fitted.transform(new_df)
+    fitted.save(tmp_path / "statistics.parquet")
+
+    loaded = make_imputer("pick").load(tmp_path / "statistics.parquet")
+
+    assert (expected["float0"].notnull() & new_df["float0"].isnull()).any()
+    pd.testing.assert_frame_equal(fitted.transform(new_df), expected)
+    pd.testing.assert_frame_equal(loaded.transform(new_df), expected)
+    pd.testing.assert_frame_equal(fitted.transform(new_df.iloc[50:120]), expected.iloc[50:120])
+
+
+def test_transform_new_records(make_imputer, records_df):
+    new_df = pd.DataFrame(
+        {"be_id": [5000, 5001, 5002], "gk": ["10", "20", "99"], "sbi": ["A", "B", "A"], "float0": [np.nan] * 3}
+    ).set_index("be_id")
+    impute_gaps = make_imputer("mean").fit(records_df, group_by=["gk", "sbi"])
+
+    result = impute_gaps.transform(new_df)
+
+    means = records_df.groupby(["gk", "sbi"])["float0"].mean()
+    assert result["float0"].iloc[:2].tolist() == [means[("10", "A")], means[("20", "B")]]
+    assert np.isnan(result["float0"].iloc[2])
+    assert new_df["float0"].isnull().all()
+
+
+def test_transform_before_fit(make_imputer, records_df):
+    with pytest.raises(ValueError, match="not fitted"):
+        make_imputer("mean").transform(records_df)
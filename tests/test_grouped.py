@@ -0,0 +1,234 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from imputegaps.impute_gaps import ImputeGaps, fill_missing_data, fill_missing_data_grouped
+from imputegaps import jit, kernels
+from imputegaps.kernels import factorize_levels, factorize_strata, fill_rollup, sample_donors
+from imputegaps.streams import StratumStreams, stratum_hashes
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - The grouped imputation of mean, median and mode gives the same result as the per stratum
+#   imputation with fill_missing_data, including min_threshold and invalid donors.
+# - Invalid donors can be given by position or aligned on the index.
+# - The batched pick sampler only draws valid donors from the stratum of the recipient.
+# - Factorizing the strata keys, including missing keys.
+# - Only the donors of the strata with gaps are aggregated, also in the rollup, and the draws of
+#   pick do not depend on the strata without gaps.
+
+
+def make_column(number_of_records=500, seed=3):
+    """
+    Make a column with gaps and an index with the levels be_id, gk and sbi
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_arrays(
+        [
+            np.arange(number_of_records),
+            rng.choice(["10", "20", "30"], size=number_of_records),
+            rng.choice(list("ABCDEFGH"), size=number_of_records),
+        ],
+        names=["be_id", "gk", "sbi"],
+    )
+    values = rng.normal(50, 10, size=number_of_records)
+    values[rng.random(number_of_records) < 0.3] = np.nan
+    column = pd.Series(values, index=index, name="omzet")
+    invalid_donors = pd.Series(rng.random(number_of_records) < 0.2, index=index, name="omzet")
+    return column, invalid_donors
+
+
+@pytest.mark.parametrize("how", ["mean", "median", "mode"])
+@pytest.mark.parametrize("min_threshold", [1, 5, 12])
+@pytest.mark.parametrize("use_invalid_donors", [None, "series", "array"])
+def test_grouped_equals_per_stratum(how, min_threshold, use_invalid_donors):
+    """
+    Compare the grouped imputation with the imputation per stratum
+    """
+    column, invalid_donors = make_column()
+    if how == "mode":
+        # round the values such that the mode has ties and frequencies larger than one
+        column = (column / 10).round() * 10
+    if use_invalid_donors is None:
+        invalid_donors = None
+
+    expected = column.groupby(["gk", "sbi"], group_keys=False).apply(
+        lambda stratum: fill_missing_data(stratum, invalid_donors=invalid_donors, how=how, min_threshold=min_threshold)
+    )
+    result = fill_missing_data_grouped(
+        column,
+        group_by=["gk", "sbi"],
+        invalid_donors=invalid_donors.to_numpy() if use_invalid_donors == "array" else invalid_donors,
+        how=how,
+        min_threshold=min_threshold,
+    )
+
+    pd.testing.assert_series_equal(result, expected.reindex(column.index))
+
+
+def test_grouped_whole_column():
+    """
+    Without group_by the whole column is one stratum
+    """
+    column, _ = make_column()
+    expected = fill_missing_data(column, how="median")
+    result = fill_missing_data_grouped(column, group_by=[], how="median")
+
+    pd.testing.assert_series_equal(result, expected)
+
+
+def test_grouped_mode_categorical():
+    """
+    The mode of a categorical follows the order of the categories for ties
+    """
+    column = pd.Series(
+        pd.Categorical(["b", "a", None, "c", "a", "c", None, "b"], categories=["c", "b", "a"]),
+        index=pd.MultiIndex.from_arrays([range(8), ["10"] * 5 + ["20"] * 3], names=["be_id", "gk"]),
+    )
+    expected = column.groupby("gk", group_keys=False).apply(lambda stratum: fill_missing_data(stratum, how="mode"))
+    result = fill_missing_data_grouped(column, group_by=["gk"], how="mode")
+
+    pd.testing.assert_series_equal(result, expected, check_names=False)
+    assert result.tolist() == ["b", "a", "a", "c", "a", "c", "c", "b"]
+
+
+@pytest.mark.parametrize("min_threshold", [1, 12])
+def test_grouped_pick_draws_valid_donors(min_threshold):
+    """
+    Each imputed value is copied from a valid donor of the same stratum
+    """
+    column, invalid_donors = make_column()
+    keys = [column.index.get_level_values(name) for name in ["gk", "sbi"]]
+    stratum_codes, number_of_strata = factorize_strata(keys)
+    mask_is_na = column.isnull().to_numpy()
+    donor_mask = ~mask_is_na & ~invalid_donors.to_numpy()
+
+    recipients, donors = sample_donors(
+        stratum_codes,
+        donor_mask=donor_mask,
+        recipient_mask=mask_is_na,
+        number_of_strata=number_of_strata,
+        min_threshold=min_threshold,
+        rng=np.random.default_rng(1),
+    )
+
+    counts = np.bincount(stratum_codes[donor_mask], minlength=number_of_strata)
+    expected_recipients = np.flatnonzero(mask_is_na & (counts[stratum_codes] >= min_threshold))
+    np.testing.assert_array_equal(recipients, expected_recipients)
+    np.testing.assert_array_equal(stratum_codes[donors], stratum_codes[recipients])
+    assert donor_mask[donors].all()
+
+    result = fill_missing_data_grouped(
+        column, group_by=["gk", "sbi"], invalid_donors=invalid_donors, how="pick", min_threshold=min_threshold
+    )
+    assert result.isnull().sum() == mask_is_na.sum() - recipients.size
+    assert result.dropna().isin(column.dropna()).all()
+
+
+def test_sample_donors_is_uniform():
+    """
+    All donors of a stratum are drawn with the same probability
+    """
+    stratum_codes = np.array([0, 0, 0, 0, 1, 1] + [0] * 20000 + [1] * 20000)
+    donor_mask = np.zeros(stratum_codes.size, dtype=bool)
+    donor_mask[:6] = True
+
+    _, donors = sample_donors(stratum_codes, donor_mask, ~donor_mask, rng=np.random.default_rng(5))
+
+    frequencies = np.bincount(donors, minlength=6) / 20000
+    np.testing.assert_allclose(frequencies, [0.25, 0.25, 0.25, 0.25, 0.5, 0.5], atol=0.02)
+
+
+@pytest.mark.parametrize("how", ["mean", "median", "mode"])
+def test_only_strata_with_gaps_are_aggregated(monkeypatch, how):
+    """
+    The statistics are only calculated for the donors of the strata which contain a gap
+    """
+    column, _ = make_column()
+    # only the strata of gk 10 have gaps
+    gk = column.index.get_level_values("gk")
+    column[gk != "10"] = column[gk != "10"].fillna(0.0)
+    codes, number_of_strata = factorize_strata([gk, column.index.get_level_values("sbi")])
+    aggregated = []
+
+    def spy(function):
+        def wrapper(values, stratum_codes, donor_mask, *args, **kwargs):
+            aggregated.append(np.unique(stratum_codes[donor_mask]))
+            return function(values, stratum_codes, donor_mask, *args, **kwargs)
+
+        return wrapper
+
+    # the NumPy kernels, the compiled kernels of jit select the same donors
+    monkeypatch.setattr(jit, "USE_NUMBA", False)
+    monkeypatch.setattr(kernels, "grouped_statistic", spy(kernels.grouped_statistic))
+    monkeypatch.setattr(kernels, "grouped_mode", spy(kernels.grouped_mode))
+
+    result = fill_missing_data_grouped(column, group_by=["gk", "sbi"], how=how)
+    levels = factorize_levels([gk, column.index.get_level_values("sbi")])
+    values = column.to_numpy() if how != "mode" else pd.factorize(column, sort=True)[0]
+    fill_rollup(
+        values, levels, donor_mask=column.notnull().to_numpy(), recipient_mask=column.isnull().to_numpy(), how=how
+    )
+
+    assert result.notnull().all()
+    strata_with_gaps = np.unique(codes[column.isnull().to_numpy()])
+    assert len(aggregated) == 2
+    for strata in aggregated:
+        assert np.isin(strata, strata_with_gaps).all()
+
+
+@pytest.mark.parametrize("max_donors", [None, 3])
+def test_pick_does_not_depend_on_strata_without_gaps(max_donors):
+    """
+    Leaving out the strata without gaps does not change the drawn donors
+    """
+    column, _ = make_column()
+    gk = column.index.get_level_values("gk")
+    column[gk != "10"] = column[gk != "10"].fillna(0.0)
+    keys = [gk, column.index.get_level_values("sbi")]
+    codes, number_of_strata = factorize_strata(keys)
+    mask_is_na = column.isnull().to_numpy()
+    streams = StratumStreams(3, ["omzet"], stratum_hashes(keys))
+
+    recipients, donors = sample_donors(codes, ~mask_is_na, mask_is_na, rng=streams, max_donors=max_donors)
+
+    subset = np.flatnonzero(gk == "10")
+    subset_codes, _ = factorize_strata([key[subset] for key in keys])
+    subset_streams = StratumStreams(3, ["omzet"], streams.stratum_keys[subset])
+    subset_recipients, subset_donors = sample_donors(
+        subset_codes, ~mask_is_na[subset], mask_is_na[subset], rng=subset_streams, max_donors=max_donors
+    )
+    np.testing.assert_array_equal(subset[subset_recipients], recipients)
+    np.testing.assert_array_equal(subset[subset_donors], donors)
+
+
+def test_factorize_strata():
+    """
+    Records with a missing key do not get a stratum
+    """
+    codes, number_of_strata = factorize_strata([["10", "20", "10", None], ["B", "A", "B", "A"]])
+
+    np.testing.assert_array_equal(codes, [0, 1, 0, -1])
+    assert number_of_strata == 2
+
+
+def test_impute_gaps_for_dimensions_index_or_columns():
+    """
+    The strata can be given by index levels or by columns
+    """
+    column, _ = make_column()
+    records_df = column.to_frame()
+    impute_gaps = ImputeGaps(
+        variables={"omzet": {"type": "float"}},
+        imputation_methods={"mean": ["float"]},
+        index_key="be_id",
+    )
+
+    with_index = impute_gaps.impute_gaps_for_dimensions(records_df.copy(), group_by=["gk", "sbi"])
+    with_columns = impute_gaps.impute_gaps_for_dimensions(records_df.reset_index(), group_by=["gk", "sbi"])
+
+    np.testing.assert_allclose(with_index["omzet"].to_numpy(), with_columns["omzet"].to_numpy())
+    assert with_columns["omzet"].notnull().all()
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from imputegaps.incremental import IncrementalImputer
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - The first imputation equals the rollup imputation for mean, median and mode.
+# - Adding, removing and changing records gives the same result as imputing all current records
+#   again for mean, median, mode and pick, with and without drop_dimensions.
+# - Only the gaps of the strata of the changed donors are imputed again.
+
+
+@pytest.fixture
+def records_df(make_records):
+    return make_records(number_of_records=800, seed=21, gap_rate=0.4, missing_keys=0.05)
+
+
+def make_changes(records_df, make_records):
+    """
+    Add records, remove records and change values and group_by keys of other records
+    """
+    added = make_records(number_of_records=40, seed=22).rename(index=lambda be_id: be_id + 10000)
+    removed = records_df.index[::37]
+    changed = records_df.loc[records_df.index[5::41].difference(removed), ["gk", "float0", "dict0"]].copy()
+    changed["float0"] = np.where(changed["float0"].isnull(), 80.0, np.nan)
+    changed["gk"] = "20"
+    changed["dict0"] = "c"
+    return added, removed, changed
+
+
+@pytest.mark.parametrize("how", ["mean", "median", "mode"])
+@pytest.mark.parametrize("drop_dimensions", [False, True])
+def test_fit_equals_rollup(make_imputer, records_df, how, drop_dimensions):
+    expected = make_imputer(how).impute_gaps(
+        records_df, group_by=["gk", "sbi"], drop_dimensions=drop_dimensions, rollup=True
+    )
+
+    incremental = IncrementalImputer(make_imputer(how), group_by=["gk", "sbi"], drop_dimensions=drop_dimensions)
+    result = incremental.fit(records_df).imputed_records()
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize("how", ["mean", "median", "mode", "pick"])
+@pytest.mark.parametrize("drop_dimensions", [False, True])
+def test_update_equals_recompute(make_imputer, make_records, records_df, how, drop_dimensions):
+    added, removed, changed = make_changes(records_df, make_records)
+    incremental = IncrementalImputer(make_imputer(how), group_by=["gk", "sbi"], drop_dimensions=drop_dimensions)
+    incremental.fit(records_df)
+
+    incremental.update(removed=removed)
+    incremental.update(added=added, changed=changed)
+    result = incremental.imputed_records()
+
+    current_df = incremental.records_df
+    assert len(current_df) == len(records_df) - len(removed) + len(added)
+    assert (current_df.loc[changed.index, "gk"] == "20").all()
+    recomputed = IncrementalImputer(make_imputer(how), group_by=["gk", "sbi"], drop_dimensions=drop_dimensions)
+    expected = recomputed.fit(current_df).imputed_records()
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_only_dependent_gaps_are_imputed_again(make_imputer, records_df, monkeypatch):
+    incremental = IncrementalImputer(make_imputer("mean"), group_by=["gk", "sbi"])
+    incremental.fit(records_df)
+    in_stratum = (records_df["gk"] == "10") & (records_df["sbi"] == "A")
+    # a donor of float0 without gaps of its own
+    donor = records_df.index[records_df[["float0", "float1"]].notnull().all(axis=1) & in_stratum][0]
+
+    imputed_gaps = {}
+    impute = incremental._impute
+
+    def spy(col_name, how, gap_ids):
+        imputed_gaps[col_name] = gap_ids
+        return impute(col_name, how, gap_ids)
+
+    monkeypatch.setattr(incremental, "_impute", spy)
+    incremental.update(changed=pd.DataFrame({"float0": [1000.0]}, index=[donor]))
+
+    gaps = records_df.index[records_df["float0"].isnull() & in_stratum]
+    assert sorted(imputed_gaps["float0"]) == sorted(gaps)
+    assert imputed_gaps["float1"].empty
+    result = incremental.imputed_records()
+    mean = result.loc[records_df.index[in_stratum & records_df["float0"].notnull()], "float0"].mean()
+    np.testing.assert_allclose(result.loc[gaps, "float0"], mean)
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from imputegaps import jit
+from imputegaps.kernels import factorize_strata, grouped_mode, grouped_statistic, impute_arrays
+from imputegaps.streams import StratumStreams, stratum_hashes
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - The kernels of jit give the same median, mode and donor segments as the NumPy kernels. Without
+#   numba they run as plain Python functions.
+# - impute_arrays gives the same result with and without the jit kernels.
+# - Without numba the functions are not compiled.
+
+
+@pytest.fixture
+def arrays(make_records):
+    """
+    A float column with gaps, the stratum codes and keys, some of which are missing, and a donor mask
+    """
+    records_df = make_records(number_of_records=300, seed=9, missing_keys=0.1)
+    keys = [records_df["gk"].to_numpy(), records_df["sbi"].to_numpy()]
+    values = records_df["float0"].to_numpy()
+    donor_mask = (records_df["internet"].to_numpy() == 1) & ~np.isnan(values)
+    codes, number_of_strata = factorize_strata(keys)
+    # one stratum without donors
+    donor_mask[codes == 0] = False
+    return values, codes, number_of_strata, donor_mask, keys
+
+
+def test_grouped_median(arrays):
+    values, codes, number_of_strata, donor_mask, _ = arrays
+
+    statistic, counts = jit.grouped_median(values, codes, donor_mask, number_of_strata)
+
+    expected, expected_counts = grouped_statistic(values, codes, donor_mask, number_of_strata, how="median")
+    np.testing.assert_allclose(statistic, expected)
+    np.testing.assert_array_equal(counts, expected_counts)
+    assert np.isnan(statistic[0])
+
+
+def test_grouped_float_mode(arrays):
+    values, codes, number_of_strata, donor_mask, _ = arrays
+
+    modes, counts = jit.grouped_float_mode(values, codes, donor_mask, number_of_strata)
+
+    value_codes, uniques = pd.factorize(values, sort=True)
+    mode_codes, expected_counts = grouped_mode(value_codes, codes, donor_mask, number_of_strata)
+    np.testing.assert_array_equal(modes, np.where(mode_codes >= 0, uniques[mode_codes], np.nan))
+    np.testing.assert_array_equal(counts, expected_counts)
+
+
+def test_segment_donors(arrays):
+    _, codes, number_of_strata, donor_mask, _ = arrays
+
+    sorted_donors, counts = jit.segment_donors(codes, donor_mask, number_of_strata)
+
+    donor_positions = np.flatnonzero(donor_mask & (codes >= 0))
+    np.testing.assert_array_equal(sorted_donors, donor_positions[np.argsort(codes[donor_positions], kind="stable")])
+    np.testing.assert_array_equal(counts, np.bincount(codes[donor_positions], minlength=number_of_strata))
+
+
+@pytest.mark.parametrize("method", ["median", "mode", "pick"])
+@pytest.mark.parametrize("block", [False, True])
+def test_impute_arrays_with_jit(arrays, monkeypatch, method, block):
+    values, codes, number_of_strata, donor_mask, keys = arrays
+    if block:
+        values = np.column_stack([values, np.roll(values, 5)])
+        donor_mask = np.column_stack([donor_mask, np.roll(donor_mask, 5)])
+    col_names = ["var0", "var1"] if block else ["var0"]
+    hashes = stratum_hashes(keys)
+
+    monkeypatch.setattr(jit, "USE_NUMBA", False)
+    expected = impute_arrays(values, codes, donor_mask, method=method, rng=StratumStreams(1, col_names, hashes))
+    monkeypatch.setattr(jit, "USE_NUMBA", True)
+    result = impute_arrays(values, codes, donor_mask, method=method, rng=StratumStreams(1, col_names, hashes))
+
+    np.testing.assert_allclose(result[0], expected[0])
+    np.testing.assert_array_equal(result[1], expected[1])
+
+
+@pytest.mark.skipif(jit.NUMBA_AVAILABLE, reason="numba is installed")
+def test_without_numba():
+    def function(values):
+        return values
+
+    assert jit.njit(function) is function
+    assert not jit.USE_NUMBA
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from imputegaps.impute_gaps import ImputeGaps
+from imputegaps.masks import NUMEXPR_AVAILABLE, MaskEvaluator, referenced_names
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - Each distinct expression is evaluated once and shared, until a column it uses is modified.
+# - The numexpr and python engines give the same masks.
+# - Variables with the same filter share the mask during imputation.
+
+
+def make_records():
+    """
+    Make a DataFrame with filter variables
+    """
+    return pd.DataFrame(
+        {
+            "internet": [1, 1, 2, 1, None, 2],
+            "werkzame_personen": [3, 10, 50, 0, 4, 7],
+            "omzet": [1.0, None, 3.0, None, 5.0, None],
+        }
+    )
+
+
+def test_referenced_names():
+    """
+    The names of the variables of an expression are found
+    """
+    assert referenced_names("internet == 1") == {"internet"}
+    assert referenced_names("(a > 1) & (b == 2)") == {"a", "b"}
+    assert referenced_names("a ==") is None
+
+
+def test_mask_is_shared():
+    """
+    An expression is evaluated once, until one of its variables is modified
+    """
+    records_df = make_records()
+    masks = MaskEvaluator(records_df)
+
+    first = masks.filter_mask("internet")
+    second = masks.filter_mask("internet")
+    np.testing.assert_array_equal(first, [True, True, False, True, False, False])
+    assert first is second
+    assert masks.number_of_evaluations == 1
+
+    masks.mask("werkzame_personen > 5")
+    masks.invalidate("omzet")
+    masks.filter_mask("internet")
+    assert masks.number_of_evaluations == 2
+
+    records_df["internet"] = 1
+    masks.invalidate("internet")
+    assert masks.filter_mask("internet").all()
+    assert masks.number_of_evaluations == 3
+
+
+def test_undefined_variable():
+    """
+    An unknown variable raises the same error as DataFrame.eval
+    """
+    masks = MaskEvaluator(make_records())
+    with pytest.raises(pd.errors.UndefinedVariableError):
+        masks.filter_mask("onbekend")
+    with pytest.raises(pd.errors.UndefinedVariableError):
+        masks.mask("onbekend > 3")
+
+
+@pytest.mark.parametrize("expression", ["werkzame_personen > 5", "(internet == 1) & (werkzame_personen < 5)"])
+@pytest.mark.skipif(not NUMEXPR_AVAILABLE, reason="numexpr is not installed")
+def test_numexpr_equals_python(expression):
+    """
+    Both engines give the same mask
+    """
+    records_df = make_records()
+    with_numexpr = MaskEvaluator(records_df, use_numexpr=True).mask(expression)
+    with_python = MaskEvaluator(records_df, use_numexpr=False).mask(expression)
+    np.testing.assert_array_equal(with_numexpr, with_python)
+
+
+def test_shared_filter_during_imputation(monkeypatch):
+    """
+    Variables with the same filter share one evaluation for all levels
+    """
+    records_df = pd.DataFrame(
+        {
+            "be_id": range(8),
+            "internet": [1, 1, 1, 1, 2, 1, 1, 1],
+            "gk": ["10", "10", "10", "20", "20", "20", "20", "20"],
+            "omzet": [1.0, 2.0, None, 4.0, None, 6.0, None, 8.0],
+            "kosten": [1.0, None, 3.0, None, 5.0, 6.0, 7.0, 8.0],
+        }
+    )
+    variables = {
+        "omzet": {"type": "float", "filter": "internet"},
+        "kosten": {"type": "float", "filter": "internet"},
+    }
+    evaluations = []
+    original_mask = MaskEvaluator.mask
+
+    def counting_mask(self, expression):
+        if expression not in self._masks:
+            evaluations.append(expression)
+        return original_mask(self, expression)
+
+    monkeypatch.setattr(MaskEvaluator, "mask", counting_mask)
+
+    impute_gaps = ImputeGaps(variables=variables, imputation_methods={"mean": ["float"]}, index_key="be_id")
+    new_records = impute_gaps.impute_gaps(records_df=records_df, group_by=["gk"], drop_dimensions=True)
+
+    assert evaluations == ["internet == 1"]
+    expected = pd.Series([1.0, 2.0, 1.5, 4.0, None, 6.0, 6.0, 8.0], name="omzet")
+    pd.testing.assert_series_equal(new_records["omzet"], expected)
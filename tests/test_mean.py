@@ -1,4 +1,5 @@
 import pandas as pd
+import pytest
 
 from imputegaps.impute_gaps import ImputeGaps
 
@@ -18,6 +19,8 @@ GROUP_BY = {"gk6sbi2": {"dimensions": ["gk", "sbi"]}, "drop_dimensions": True}
 #       * Alles leeg in stratum ['sbi', 'gk'], maar niet in ['gk'] -> imputeren o.b.v GK
 #       * Alles leeg in stratum ['sbi', 'gk'], maar ook in ['gk'] -> imputeren o.b.v. hele dataset
 # - Test voor een situatie met een filter.
+# - Test voor een variabele met getallen in een object kolom, met en zonder rollup.
+# - Test voor een variabele met tekst in een object kolom, die niet geïmputeerd wordt.
 
 
 def test_float():
@@ -138,3 +141,62 @@ def test_met_filter():
 
     # Test uitvoeren
     pd.testing.assert_series_equal(new_records["telewerkers"], expected)
+
+
+@pytest.mark.parametrize("rollup", [False, True])
+def test_object(rollup):
+    """
+    Test voor var_type 'float' met getallen in een object kolom
+    """
+    records_df = pd.DataFrame(
+        {
+            "be_id": [1, 2, 3],
+            "gk": ["10", "10", "10"],
+            "sbi": ["A", "A", "A"],
+            "telewerkers": pd.Series([1.0, None, 3.0], dtype=object),
+        }
+    )
+    variables = {"telewerkers": {"type": "float"}}
+
+    # Init ImputeGaps
+    impute_gaps = ImputeGaps(
+        variables=variables,
+        imputation_methods=IMPUTATION_METHODS,
+        index_key=ID_KEY,
+        seed=SET_SEED,
+    )
+
+    new_records = impute_gaps.impute_gaps(
+        records_df=records_df, group_by=["gk", "sbi"], drop_dimensions=True, rollup=rollup
+    )
+
+    # Test uitvoeren
+    assert new_records["telewerkers"].tolist() == [1.0, 2.0, 3.0]
+
+
+def test_tekst():
+    """
+    Test voor var_type 'float' met tekst in een object kolom
+    """
+    records_df = pd.DataFrame(
+        {
+            "be_id": [1, 2, 3],
+            "gk": ["10", "10", "10"],
+            "sbi": ["A", "A", "A"],
+            "telewerkers": pd.Series(["a", None, "b"], dtype=object),
+        }
+    )
+    variables = {"telewerkers": {"type": "float"}}
+
+    # Init ImputeGaps
+    impute_gaps = ImputeGaps(
+        variables=variables,
+        imputation_methods=IMPUTATION_METHODS,
+        index_key=ID_KEY,
+        seed=SET_SEED,
+    )
+
+    new_records = impute_gaps.impute_gaps(records_df=records_df, group_by=["gk", "sbi"], drop_dimensions=True)
+
+    # Test uitvoeren
+    assert new_records["telewerkers"].isnull().tolist() == [False, True, False]
@@ -1,4 +1,5 @@
 import pandas as pd
+import pytest
 
 from imputegaps.impute_gaps import ImputeGaps
 
@@ -18,6 +19,7 @@ GROUP_BY = {"gk6sbi2": {"dimensions": ["gk", "sbi"]}, "drop_dimensions": True}
 #       * Alles leeg in stratum ['sbi', 'gk'], maar niet in ['gk'] -> imputeren o.b.v GK
 #       * Alles leeg in stratum ['sbi', 'gk'], maar ook in ['gk'] -> imputeren o.b.v. hele dataset
 # - Test voor een situatie met een filter.
+# - Test voor var_type 'bool' met een nullable boolean kolom, met en zonder rollup.
 
 
 def test_float():
@@ -138,3 +140,37 @@ def test_met_filter():
 
     # Test uitvoeren
     pd.testing.assert_series_equal(new_records["telewerkers"], expected)
+
+
+@pytest.mark.parametrize("rollup", [False, True])
+def test_boolean(rollup):
+    """
+    Test voor var_type 'bool' met een nullable boolean kolom
+    """
+    records_df = pd.DataFrame(
+        {
+            "be_id": [1, 2, 3, 4],
+            "gk": ["10", "10", "10", "10"],
+            "sbi": ["A", "A", "A", "A"],
+            "internet": pd.Series([True, None, True, False], dtype="boolean"),
+        }
+    )
+    variables = {"internet": {"type": "bool"}}
+
+    # Init ImputeGaps
+    impute_gaps = ImputeGaps(
+        variables=variables,
+        imputation_methods=IMPUTATION_METHODS,
+        index_key=ID_KEY,
+        seed=SET_SEED,
+    )
+
+    new_records = impute_gaps.impute_gaps(
+        records_df=records_df, group_by=["gk", "sbi"], drop_dimensions=True, rollup=rollup
+    )
+
+    # Expected
+    expected = pd.Series([True, True, True, False], dtype="boolean", name="internet")
+
+    # Test uitvoeren
+    pd.testing.assert_series_equal(new_records["internet"], expected)
@@ -18,6 +18,7 @@ GROUP_BY = {"gk6sbi2": {"dimensions": ["gk", "sbi"]}, "drop_dimensions": True}
 #       * Alles leeg in stratum ['sbi', 'gk'], maar niet in ['gk'] -> imputeren o.b.v GK
 #       * Alles leeg in stratum ['sbi', 'gk'], maar ook in ['gk'] -> imputeren o.b.v. hele dataset
 # - Test voor een situatie met een filter.
+# - A categorical variable gets 0 as a new category.
 
 
 def test_float():
@@ -222,3 +223,24 @@ def test_met_filter():
 
     # Test uitvoeren
     pd.testing.assert_series_equal(new_records["telewerkers"], expected)
+
+
+def test_categorical():
+    """
+    A variable which is categorical already gets 0 as a new category
+    """
+    records_df = pd.DataFrame(
+        {
+            "be_id": [1, 2, 3, 4],
+            "gk": ["10", "10", "20", "20"],
+            "telewerkers": pd.Categorical(["a", None, "b", None]),
+        }
+    )
+    impute_gaps = ImputeGaps(
+        variables={"telewerkers": {"type": "dict"}}, imputation_methods=IMPUTATION_METHODS, index_key=ID_KEY
+    )
+
+    new_records = impute_gaps.impute_gaps(records_df=records_df, group_by=["gk"])
+
+    assert new_records["telewerkers"].tolist() == ["a", 0, "b", 0]
+    assert new_records["telewerkers"].dtype == "category"
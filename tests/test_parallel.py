@@ -0,0 +1,56 @@
+import pandas as pd
+import pytest
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - Imputing the variables with a thread pool or a process pool gives the same result as the
+#   serial imputation, for all methods, with filters and with track_imputed.
+# - An unknown executor is refused.
+
+
+@pytest.fixture
+def records_df(make_records):
+    records_df = make_records()
+    # the categories are sent to the worker processes
+    records_df["dict0"] = records_df["dict0"].astype("category")
+    return records_df
+
+
+@pytest.mark.parametrize("how", ["mean", "mode", "pick"])
+@pytest.mark.parametrize("executor", ["thread", "process"])
+@pytest.mark.parametrize("track_imputed", [False, True])
+def test_parallel_equals_serial(make_imputer, records_df, how, executor, track_imputed):
+    """
+    Compare the parallel imputation with the serial imputation
+    """
+    expected = make_imputer(how, track_imputed=track_imputed).impute_gaps(
+        records_df.copy(), group_by=["gk", "sbi"], drop_dimensions=True
+    )
+    result = make_imputer(how, track_imputed=track_imputed, n_jobs=3, executor=executor).impute_gaps(
+        records_df.copy(), group_by=["gk", "sbi"], drop_dimensions=True
+    )
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert result["float0"].notnull().all()
+
+
+def test_parallel_for_dimensions(make_imputer, records_df):
+    """
+    A pool is started for a direct call of impute_gaps_for_dimensions
+    """
+    records_df = records_df.reset_index()
+    impute_gaps = make_imputer(imputation_methods={"mean": ["float"]})
+    expected = impute_gaps.impute_gaps_for_dimensions(records_df.copy(), group_by=["gk"])
+
+    impute_gaps.n_jobs = 2
+    result = impute_gaps.impute_gaps_for_dimensions(records_df.copy(), group_by=["gk"])
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_unknown_executor(make_imputer):
+    with pytest.raises(ValueError, match="executor"):
+        make_imputer(executor="mpi")
@@ -0,0 +1,82 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from imputegaps.partition import SharedColumns, partition_positions
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - Imputing per partition of the first group_by variable in worker processes gives the same
+#   result as the serial imputation for mean, median and mode, including the coarser levels of
+#   drop_dimensions, track_imputed and records with a missing partition key.
+# - pick draws the same donors as the serial imputation, also from a sample of max_donors donors.
+# - The positions of the partitions and the shared memory columns.
+
+
+@pytest.fixture
+def records_df(make_records):
+    # some records have no partition key
+    return make_records(number_of_records=900, seed=11, gap_rate=0.4, missing_keys=0.05)
+
+
+@pytest.fixture
+def impute(make_imputer, records_df):
+    def impute(how, track_imputed=False, drop_dimensions=True, partition=False, max_donors=None):
+        impute_gaps = make_imputer(how, track_imputed=track_imputed, min_threshold=4, n_jobs=2, max_donors=max_donors)
+        return impute_gaps.impute_gaps(
+            records_df.copy(), group_by=["gk", "sbi"], drop_dimensions=drop_dimensions, partition=partition
+        )
+
+    return impute
+
+
+@pytest.mark.parametrize("how", ["mean", "median", "mode"])
+@pytest.mark.parametrize("track_imputed", [False, True])
+@pytest.mark.parametrize("drop_dimensions", [False, True])
+def test_partitioned_equals_serial(impute, how, track_imputed, drop_dimensions):
+    """
+    Compare the imputation per partition with the serial imputation
+    """
+    expected = impute(how, track_imputed=track_imputed, drop_dimensions=drop_dimensions)
+    result = impute(how, track_imputed=track_imputed, drop_dimensions=drop_dimensions, partition=True)
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize("max_donors", [None, 3])
+def test_partitioned_pick(impute, records_df, variables, max_donors):
+    """
+    pick draws the same donors per partition as in the serial imputation
+    """
+    expected = impute("pick", max_donors=max_donors)
+    result = impute("pick", partition=True, max_donors=max_donors)
+
+    pd.testing.assert_frame_equal(result, expected)
+    for col_name in variables:
+        assert result[col_name].dropna().isin(records_df[col_name].dropna()).all()
+
+
+def test_partition_positions():
+    positions = partition_positions(pd.Series(["20", "10", None, "20", "10", "30"]))
+
+    assert [part.tolist() for part in positions] == [[1, 4], [0, 3], [5]]
+
+
+def test_shared_columns():
+    """
+    Only numeric columns are shared and the blocks are released afterwards
+    """
+    records_df = pd.DataFrame({"a": [1.0, np.nan], "b": [1, 2], "c": ["x", "y"]})
+    with SharedColumns(records_df) as shared:
+        assert list(shared.descriptors) == ["a", "b"]
+        np.testing.assert_array_equal(shared.array("a"), records_df["a"].to_numpy())
+        names = [name for name, _, _ in shared.descriptors.values()]
+
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
@@ -1,6 +1,9 @@
+import numpy as np
 import pandas as pd
+import pytest
 
-from imputegaps.impute_gaps import ImputeGaps
+from imputegaps.impute_gaps import ImputeGaps, fill_missing_data
+from imputegaps.kernels import reservoir_donors
 
 __author__ = "EMSK"
 __copyright__ = "EMSK"
@@ -18,6 +21,9 @@ GROUP_BY = {"gk6sbi2": {"dimensions": ["gk", "sbi"]}, "drop_dimensions": True}
 #       * Alles leeg in stratum ['sbi', 'gk'], maar niet in ['gk'] -> imputeren o.b.v GK
 #       * Alles leeg in stratum ['sbi', 'gk'], maar ook in ['gk'] -> imputeren o.b.v. hele dataset
 # - Test voor een situatie met een filter.
+# - The reservoir of max_donors donors per stratum is a uniform sample, also over several blocks.
+# - With max_donors, pick draws from at most max_donors donors per stratum, while the min_threshold
+#   applies to all donors, in the grouped, batched and rollup imputation and in fill_missing_data.
 
 
 def test_float():
@@ -56,7 +62,7 @@ def test_float():
     new_records = impute_gaps.impute_gaps(records_df=records_df, group_by=["gk", "sbi"], drop_dimensions=True)
 
     # Expected
-    expected = pd.Series([1.1, 2.2, 3.3, 4.4, 1.1, 1.1, 4.4], copy=False, name="telewerkers")
+    expected = pd.Series([1.1, 2.2, 3.3, 4.4, 2.2, 1.1, 4.4], copy=False, name="telewerkers")
 
     # Test uitvoeren
     pd.testing.assert_series_equal(new_records["telewerkers"], expected)
@@ -98,7 +104,7 @@ def test_percentage():
     new_records = impute_gaps.impute_gaps(records_df=records_df, group_by=["gk", "sbi"], drop_dimensions=True)
 
     # Expected
-    expected = pd.Series([1.1, 2.2, 3.3, 4.4, 1.1, 1.1, 4.4], copy=False, name="telewerkers")
+    expected = pd.Series([1.1, 2.2, 3.3, 4.4, 2.2, 1.1, 4.4], copy=False, name="telewerkers")
 
     # Test uitvoeren
     pd.testing.assert_series_equal(new_records["telewerkers"], expected)
@@ -140,7 +146,7 @@ def test_bool():
     new_records = impute_gaps.impute_gaps(records_df=records_df, group_by=["gk", "sbi"], drop_dimensions=True)
 
     # Expected
-    expected = pd.Series([float(1), 0, 1, 0, 1, 1, 0], copy=False, name="telewerkers")
+    expected = pd.Series([float(1), 0, 1, 0, 0, 1, 0], copy=False, name="telewerkers")
 
     # Test uitvoeren
     pd.testing.assert_series_equal(new_records["telewerkers"], expected)
@@ -183,7 +189,7 @@ def test_dict():
 
     # Expected
     # The expected values are floats as the initial values are floats due to the Nones
-    expected_telewerkers = pd.Series([1.0, 2, 3, 4, 1, 1, 4], copy=False, name="telewerkers")
+    expected_telewerkers = pd.Series([1.0, 2, 3, 4, 2, 1, 4], copy=False, name="telewerkers")
     new_telewerkers = new_records["telewerkers"]
 
     # Test uitvoeren
@@ -224,3 +230,79 @@ def test_met_filter():
 
     # Test uitvoeren
     pd.testing.assert_series_equal(new_records["telewerkers"], expected)
+
+
+def test_reservoir_donors():
+    """
+    The reservoir keeps min(max_donors, number of donors) donors per stratum, sorted by stratum
+    """
+    stratum_codes = np.array([0, 1, 0, 1, -1, 0, 2, 0, 0, 1])
+    donor_mask = np.array([1, 1, 1, 0, 1, 1, 1, 1, 0, 1], dtype=bool)
+
+    sorted_donors, sample_counts = reservoir_donors(stratum_codes, donor_mask, 2, number_of_strata=4, block_size=3)
+
+    assert sample_counts.tolist() == [2, 2, 1, 0]
+    assert stratum_codes[sorted_donors].tolist() == [0, 0, 1, 1, 2]
+    assert donor_mask[sorted_donors].all()
+
+
+def test_reservoir_is_uniform():
+    """
+    Every donor has the same chance to be in the reservoir
+    """
+    rng = np.random.default_rng(4)
+    stratum_codes = np.repeat([0, 1], 50)
+    hits = np.zeros(100)
+    for _ in range(2000):
+        sorted_donors, _ = reservoir_donors(stratum_codes, np.ones(100, dtype=bool), 10, rng=rng, block_size=7)
+        hits[sorted_donors] += 1
+
+    np.testing.assert_allclose(hits / 2000, 0.2, atol=0.04)
+
+
+def make_large_strata(number_of_records=2000):
+    rng = np.random.default_rng(5)
+    values = np.arange(number_of_records, dtype=float)
+    values[rng.random(number_of_records) < 0.3] = np.nan
+    return pd.DataFrame(
+        {
+            "be_id": np.arange(number_of_records),
+            "gk": rng.choice(["10", "20"], size=number_of_records),
+            "telewerkers": values,
+            "omzet": values + 0.5,
+        }
+    )
+
+
+@pytest.mark.parametrize("batch_columns", [False, True])
+@pytest.mark.parametrize("rollup", [False, True])
+def test_max_donors(batch_columns, rollup):
+    records_df = make_large_strata()
+    impute_gaps = ImputeGaps(
+        variables={"telewerkers": {"type": "float"}, "omzet": {"type": "float"}},
+        imputation_methods=IMPUTATION_METHODS,
+        index_key=ID_KEY,
+        min_threshold=10,
+        batch_columns=batch_columns,
+        max_donors=5,
+    )
+
+    new_records = impute_gaps.impute_gaps(records_df=records_df, group_by=["gk"], rollup=rollup)
+
+    assert new_records[["telewerkers", "omzet"]].notnull().all().all()
+    for col_name in ["telewerkers", "omzet"]:
+        imputed = records_df[col_name].isnull()
+        for gk, stratum in new_records[imputed].groupby("gk"):
+            donors = records_df.loc[(records_df["gk"] == gk), col_name].dropna()
+            assert stratum[col_name].isin(donors).all()
+            assert stratum[col_name].nunique() <= 5
+
+
+def test_fill_missing_data_max_donors():
+    stratum = pd.Series(np.r_[np.arange(100.0), [np.nan] * 50])
+
+    result = fill_missing_data(stratum, how="pick", max_donors=3)
+
+    assert result.notnull().all()
+    assert result[100:].isin(stratum[:100]).all()
+    assert result[100:].nunique() <= 3
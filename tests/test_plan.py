@@ -0,0 +1,103 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from imputegaps.impute_gaps import ImputeGaps
+from imputegaps.plan import EXPLAIN_COLUMNS, ImputationPlan
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - The plan resolves the method, filter, set_nan_eval, target dtype and source columns per
+#   variable, and the reason why a variable is skipped.
+# - The plan is made once per imputer and again if the variables are replaced.
+# - explain shows the settings and the number of gaps per variable, and the dtype of its column.
+
+VARIABLES = {
+    "omzet": {"type": "float", "filter": "internet", "impute_only": "kosten > 0"},
+    "personeel": {"type": "int", "set_nan_eval": "omzet < 0"},
+    "gk": {"type": "dict"},
+    "kosten": {"type": "float", "impute_method": "median"},
+    "internet": {"type": "bool", "no_impute": True},
+    "datum": {"type": "date"},
+    "naam": {"type": "str"},
+    "onbekend": {"filter": "internet"},
+    "fout": {"type": "float", "filter": "not valid ("},
+}
+IMPUTATION_METHODS = {"mean": ["float", "int"], "pick": ["dict"], "skip": ["date"], "mode": None}
+
+
+def test_plan_settings():
+    plan = ImputationPlan(VARIABLES, IMPUTATION_METHODS)
+
+    omzet = plan.settings_for("omzet")
+    assert omzet["how"] == "mean"
+    assert omzet["filter"] == "kosten > 0"
+    assert omzet["dtype"] is None
+    assert omzet["sources"] == {"omzet", "kosten"}
+    personeel = plan.settings_for("personeel")
+    assert personeel["set_nan_eval"] == "omzet < 0"
+    assert personeel["dtype"] == "float64"
+    assert personeel["referenced"] == {"omzet"}
+    gk = plan.settings_for("gk")
+    assert (gk["how"], gk["to_category"], gk["dtype"]) == ("pick", True, "category")
+    assert plan.settings_for("kosten")["how"] == "median"
+    assert plan.settings_for("fout")["sources"] is None
+    assert plan.settings_for("be_id") is None
+    assert plan.skipped == {"internet": "no_impute", "datum": "skip type", "naam": "no method", "onbekend": "no type"}
+    assert list(plan.for_columns(["be_id", "kosten", "gk", "omzet", "datum"], exclude=["gk"])) == ["kosten", "omzet"]
+
+
+def test_plan_is_made_once(caplog):
+    rng = np.random.default_rng(2)
+    records_df = pd.DataFrame(
+        {
+            "be_id": np.arange(60),
+            "gk": rng.choice(["10", "20"], size=60),
+            "sbi": rng.choice(["A", "B", "C"], size=60),
+            "omzet": np.where(rng.random(60) < 0.3, np.nan, rng.normal(size=60)),
+            "naam": rng.choice(["a", "b"], size=60),
+        }
+    ).set_index("be_id")
+    variables = {"omzet": {"type": "float"}, "naam": {"type": "str"}}
+    impute_gaps = ImputeGaps(index_key="be_id", variables=variables, imputation_methods={"mean": ["float"]})
+
+    with caplog.at_level(logging.WARNING, logger="imputegaps.plan"):
+        impute_gaps.impute_gaps(records_df, group_by=["gk", "sbi"], drop_dimensions=True)
+        plan = impute_gaps.plan
+        impute_gaps.impute_gaps(records_df, group_by=["gk", "sbi"], rollup=True)
+
+    assert impute_gaps.plan is plan
+    assert caplog.text.count("Imputation method not found for naam") == 1
+    impute_gaps.variables = {"omzet": {"type": "float", "no_impute": True}}
+    assert impute_gaps.plan is not plan
+    assert impute_gaps._variable_settings("omzet") is None
+
+
+def test_explain():
+    records_df = pd.DataFrame(
+        {"kosten": [1.0, np.nan, np.nan], "omzet": [np.nan, 2.0, 3.0], "gk": ["10", None, "20"], "be_id": [1, 2, 3]}
+    )
+    impute_gaps = ImputeGaps(index_key="be_id", variables=VARIABLES, imputation_methods=IMPUTATION_METHODS)
+
+    explanation = impute_gaps.explain()
+    assert list(explanation.columns) == EXPLAIN_COLUMNS
+    assert list(explanation["variable"]) == list(VARIABLES)
+    omzet = explanation.set_index("variable").loc["omzet"]
+    assert (omzet["how"], omzet["sources"], omzet["skip"]) == ("mean", "kosten,omzet", "")
+    assert explanation.set_index("variable").loc["fout", "sources"] == "*"
+
+    explanation = impute_gaps.explain(records_df)
+    assert explanation[["variable", "how", "gaps"]].values.tolist() == [
+        ["kosten", "median", 2],
+        ["omzet", "mean", 1],
+        ["gk", "pick", 1],
+    ]
+
+    # the mean of a nullable integer column makes it a nullable float column, as in fill_positions
+    for personeel, dtype in [(pd.array([1, None], dtype="Int32"), "Float64"), ([1.0, np.nan], "float64")]:
+        explanation = impute_gaps.explain(pd.DataFrame({"personeel": personeel}))
+        assert explanation["dtype"].tolist() == [dtype]
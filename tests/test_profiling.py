@@ -0,0 +1,134 @@
+import pandas as pd
+import pytest
+import yaml
+
+from imputegaps.fileio import read_records, write_records
+from imputegaps.main import main
+from imputegaps.profiling import PROFILE_COLUMNS
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - Without profile no profile is kept, and profiling does not change the imputation.
+# - The profile has the stages of every variable and level, and the gaps filled per variable add
+#   up to the imputed gaps, also in batches, in parallel, in the rollup and per partition.
+# - The command line writes the profile to a file.
+
+
+@pytest.fixture
+def records_df(make_records):
+    records_df = make_records(number_of_records=600, seed=12, gap_rate=0.4)
+    # a rare size class, of which the gaps are imputed on the level of the whole column
+    records_df.loc[:2, "gk"] = "99"
+    records_df.loc[:2, ["float0", "float1", "float2", "dict0"]] = None
+    return records_df
+
+
+@pytest.fixture
+def make_imputer(make_imputer):
+    def make_profiler(profile=True, **kwargs):
+        return make_imputer(
+            imputation_methods={"mean": ["float"], "pick": ["dict"]}, min_threshold=5, seed=3, profile=profile, **kwargs
+        )
+
+    return make_profiler
+
+
+def number_of_imputed(records_df, result):
+    return int((records_df.isnull() & result.notnull()).to_numpy().sum())
+
+
+def test_without_profile(make_imputer, records_df):
+    impute_gaps = make_imputer(profile=False)
+
+    expected = impute_gaps.impute_gaps(records_df, group_by=["gk", "sbi"], drop_dimensions=True)
+    result = make_imputer().impute_gaps(records_df, group_by=["gk", "sbi"], drop_dimensions=True)
+
+    assert impute_gaps.profile_df is None
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize("batch_columns", [False, True])
+@pytest.mark.parametrize("n_jobs, executor", [(1, "thread"), (2, "process")])
+def test_profile_per_variable_and_level(make_imputer, records_df, variables, batch_columns, n_jobs, executor):
+    impute_gaps = make_imputer(batch_columns=batch_columns, n_jobs=n_jobs, executor=executor)
+
+    result = impute_gaps.impute_gaps(records_df, group_by=["gk", "sbi"], drop_dimensions=True)
+
+    profile_df = impute_gaps.profile_df
+    assert list(profile_df.columns) == PROFILE_COLUMNS
+    assert (profile_df["wall_time"] >= 0).all()
+    kernels = profile_df[profile_df["stage"] == "kernel"]
+    assert set(kernels["level"]) == {"gk,sbi", "gk", ""}
+    assert {"groupby", "filter", "kernel", "write_back"} == set(profile_df["stage"])
+    assert kernels["gaps_filled"].sum() == number_of_imputed(records_df, result)
+    deepest = kernels[kernels["level"] == "gk,sbi"]
+    assert (deepest["rows"] > 0).all()
+    assert deepest["strata"].between(1, records_df.groupby(["gk", "sbi"]).ngroups).all()
+    if not batch_columns:
+        assert set(kernels["variable"]) == set(variables)
+        write_back = profile_df[profile_df["stage"] == "write_back"].set_index(["variable", "level"])
+        pd.testing.assert_series_equal(
+            write_back["gaps_filled"], kernels.set_index(["variable", "level"])["gaps_filled"]
+        )
+
+
+def test_profile_rollup(make_imputer, records_df, variables):
+    impute_gaps = make_imputer()
+
+    result = impute_gaps.impute_gaps(records_df, group_by=["gk", "sbi"], drop_dimensions=True, rollup=True)
+
+    profile_df = impute_gaps.profile_df
+    assert set(profile_df["level"]) == {"rollup"}
+    kernels = profile_df[profile_df["stage"] == "kernel"]
+    assert set(kernels["variable"]) == set(variables)
+    assert kernels["gaps_filled"].sum() == number_of_imputed(records_df, result)
+    assert (kernels["strata"] > 0).all()
+
+
+def test_profile_partitioned(make_imputer, records_df):
+    impute_gaps = make_imputer(n_jobs=2)
+
+    impute_gaps.impute_gaps(records_df, group_by=["gk", "sbi"], drop_dimensions=True, partition=True)
+
+    profile_df = impute_gaps.profile_df
+    partition = profile_df[profile_df["stage"] == "partition"]
+    assert partition[["variable", "level", "rows"]].values.tolist() == [["", "gk", len(records_df)]]
+    assert set(profile_df.loc[profile_df["stage"] == "kernel", "level"]) == {""}
+
+
+def test_main_writes_profile(tmp_path, records_df):
+    records_df = records_df.reset_index()
+    write_records(records_df, tmp_path / "records.csv")
+    variables_file = tmp_path / "variables.csv"
+    pd.DataFrame({"naam": ["float0", "float1"], "type": ["float", "float"]}).to_csv(
+        variables_file, sep=";", index=False
+    )
+    settings_file = tmp_path / "settings.yml"
+    settings = {"general": {"imputation": {"imputation_methods": {"mean": ["float"]}, "set_seed": 1}}}
+    settings_file.write_text(yaml.dump(settings))
+
+    main(
+        [
+            str(tmp_path / "records.csv"),
+            "--output_filename",
+            str(tmp_path / "imputed.csv"),
+            "--id",
+            "be_id",
+            "--group_by",
+            "gk,sbi",
+            "--drop_dimensions",
+            "--variables",
+            str(variables_file),
+            "--impute_settings_file",
+            str(settings_file),
+            "--profile",
+            str(tmp_path / "profile.csv"),
+        ]
+    )
+
+    profile_df = read_records(tmp_path / "profile.csv")
+    assert list(profile_df.columns) == PROFILE_COLUMNS
+    assert set(profile_df.loc[profile_df["stage"] == "kernel", "variable"]) == {"float0, float1"}
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from imputegaps.impute_gaps import ImputeGaps
+from imputegaps.kernels import factorize_levels, strata_with_recipients
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - Only the records of the strata with a recipient are selected.
+# - The residual gaps shrink with every level and the result is the same as without keeping them.
+# - A coarser level only visits the strata with residual gaps and skips the variables without
+#   residual gaps before evaluating their filter.
+# - nan fills the gaps of a stratum without observed values, column by column and in batches.
+
+
+@pytest.fixture
+def records_df(make_records):
+    records_df = make_records(gap_rate=0.2, seed=4)
+    # a stratum of which all values are missing, which is imputed on the level of gk
+    gap_stratum = (records_df["gk"] == "10") & (records_df["sbi"] == "A")
+    records_df.loc[gap_stratum, ["float0", "float1", "dict0"]] = None
+    return records_df
+
+
+IMPUTATION_METHODS = {"mean": ["float"], "pick": ["dict"]}
+
+
+def test_strata_with_recipients():
+    codes = np.array([0, 1, 2, -1, 1, 0, 2, -1])
+
+    selected = strata_with_recipients(codes, np.array([1, 3]), number_of_strata=3)
+
+    np.testing.assert_array_equal(selected, [False, True, False, False, True, False, False, False])
+    assert not strata_with_recipients(codes, np.array([], dtype=np.int64), number_of_strata=3).any()
+
+
+@pytest.mark.parametrize("batch_columns", [False, True])
+def test_residual_gaps_per_level(make_imputer, records_df, variables, batch_columns):
+    records_df = records_df.reset_index()
+    group_by = ["gk", "sbi"]
+    levels = factorize_levels([records_df[name] for name in group_by], size=len(records_df))
+
+    impute_gaps = make_imputer(imputation_methods=IMPUTATION_METHODS, batch_columns=batch_columns)
+    expected = records_df.copy()
+    result = records_df.copy()
+    residual_gaps = {}
+    for group_dim, stratum_codes in enumerate(levels):
+        max_dim = len(group_by) - group_dim
+        expected = impute_gaps.impute_gaps_for_dimensions(
+            expected, group_by=group_by[:max_dim], stratum_codes=stratum_codes
+        )
+        result = impute_gaps.impute_gaps_for_dimensions(
+            result, group_by=group_by[:max_dim], stratum_codes=stratum_codes, residual_gaps=residual_gaps
+        )
+        for col_name in variables:
+            np.testing.assert_array_equal(residual_gaps[col_name], np.flatnonzero(result[col_name].isnull()))
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert residual_gaps["float1"].size == (records_df["internet"] == 0).sum() - (
+        records_df.loc[records_df["internet"] == 0, "float1"].notnull().sum()
+    )
+
+
+def test_coarser_levels_visit_residual_gaps(make_imputer, records_df):
+    impute_gaps = make_imputer(imputation_methods=IMPUTATION_METHODS, batch_columns=False, profile=True)
+
+    result = impute_gaps.impute_gaps(records_df, group_by=["gk", "sbi"], drop_dimensions=True)
+
+    assert result[["float0", "float2", "dict0"]].notnull().all().all()
+    profile_df = impute_gaps.profile_df
+    kernels = profile_df[profile_df["stage"] == "kernel"].set_index(["variable", "level"])
+    # the gaps of gk 10, sbi A are imputed from the records of gk 10 only
+    gk_10 = int((records_df["gk"] == "10").sum())
+    assert kernels.loc[("float0", "gk"), "rows"] == gk_10
+    assert kernels.loc[("float0", "gk"), "strata"] == 1
+    assert kernels.loc[("float1", "gk"), "rows"] == int(((records_df["gk"] == "10") & records_df["internet"]).sum())
+    # float2 has no gaps left after the deepest level, so its filter is not even evaluated
+    filters = profile_df[profile_df["stage"] == "filter"]
+    assert set(filters.loc[filters["variable"] == "float2", "level"]) == {"gk,sbi"}
+    assert ("float2", "gk") not in kernels.index
+
+
+@pytest.mark.parametrize("batch_columns", [False, True])
+def test_gaps_in_strata_without_values(batch_columns):
+    records_df = pd.DataFrame(
+        {
+            "be_id": range(6),
+            "g": ["a", "a", "b", "b", "c", "c"],
+            "x": [1, 2, np.nan, np.nan, 3, 4],
+            "y": [1.0, np.nan, np.nan, np.nan, 3.0, 4.0],
+            "z": [2.0, np.nan, np.nan, np.nan, 5.0, np.nan],
+        }
+    ).set_index("be_id")
+    impute_gaps = ImputeGaps(
+        index_key="be_id",
+        variables={"x": {"type": "bool"}, "y": {"type": "float"}, "z": {"type": "float"}},
+        imputation_methods={"nan": ["bool"], "mean": ["float"]},
+        batch_columns=batch_columns,
+    )
+
+    result = impute_gaps.impute_gaps(records_df, group_by=["g"], drop_dimensions=False)
+
+    assert result["x"].tolist() == [1, 2, 0, 0, 3, 4]
+    np.testing.assert_array_equal(result["y"], [1.0, 1.0, np.nan, np.nan, 3.0, 4.0])
+    np.testing.assert_array_equal(result["z"], [2.0, 2.0, np.nan, np.nan, 5.0, 5.0])
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from imputegaps.impute_gaps import ImputeGaps
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+IMPUTATION_METHODS = {
+    "mean": ["float"],
+    "median": ["percentage"],
+    "mode": ["int"],
+    "pick": ["dict", "str"],
+    "nan": ["bool"],
+}
+ID_KEY = "be_id"
+SET_SEED = 2
+
+# This script contains the following tests:
+# - The rollup over all levels of drop_dimensions gives the same result as imputing level by level
+#   with track_imputed for mean, median, mode and nan, including filters, min_threshold and
+#   missing group_by keys.
+# - With pick, the rollup only imputes values of valid donors of the deepest possible stratum.
+
+
+def make_records(number_of_records=600, seed=7):
+    """
+    Make a DataFrame with gaps for each imputation method
+    """
+    rng = np.random.default_rng(seed)
+    gk = rng.choice(["10", "20", "30", "40"], size=number_of_records, p=[0.5, 0.3, 0.15, 0.05])
+    sbi = rng.choice(list("ABCDEFGHIJ"), size=number_of_records).astype(object)
+    sbi[rng.random(number_of_records) < 0.02] = None
+    records_df = pd.DataFrame(
+        {
+            "be_id": np.arange(number_of_records),
+            "internet": rng.choice([1, 2], size=number_of_records, p=[0.8, 0.2]),
+            "gk": gk,
+            "sbi": sbi,
+            "omzet": rng.normal(100, 20, size=number_of_records),
+            "aandeel": rng.uniform(0, 100, size=number_of_records),
+            "personen": rng.integers(0, 4, size=number_of_records).astype(float),
+            "website": rng.choice([0, 1, 2, 3], size=number_of_records).astype(float),
+            "telewerk": rng.choice([0, 1], size=number_of_records).astype(float),
+        }
+    )
+    for name in ["omzet", "aandeel", "personen", "website", "telewerk"]:
+        records_df.loc[rng.random(number_of_records) < 0.35, name] = np.nan
+    # make sure some strata have no donors at all
+    records_df.loc[(records_df["gk"] == "40") & (records_df["sbi"].isin(["A", "B", "C"])), "omzet"] = np.nan
+    variables = {
+        "omzet": {"type": "float"},
+        "aandeel": {"type": "percentage", "filter": "internet"},
+        "personen": {"type": "int"},
+        "website": {"type": "dict"},
+        "telewerk": {"type": "bool"},
+    }
+    return records_df, variables
+
+
+@pytest.mark.parametrize("min_threshold", [None, 3, 8])
+@pytest.mark.parametrize("drop_dimensions", [False, True])
+def test_rollup_equals_track_imputed(min_threshold, drop_dimensions):
+    """
+    Compare the rollup with the imputation level by level
+    """
+    records_df, variables = make_records()
+
+    def impute(rollup):
+        impute_gaps = ImputeGaps(
+            variables=variables,
+            imputation_methods=IMPUTATION_METHODS,
+            index_key=ID_KEY,
+            seed=SET_SEED,
+            track_imputed=True,
+            min_threshold=min_threshold,
+        )
+        return impute_gaps.impute_gaps(
+            records_df=records_df, group_by=["gk", "sbi"], drop_dimensions=drop_dimensions, rollup=rollup
+        )
+
+    expected = impute(rollup=False)
+    result = impute(rollup=True)
+
+    for name in ["omzet", "aandeel", "personen", "telewerk"]:
+        pd.testing.assert_series_equal(result[name], expected[name])
+    pd.testing.assert_series_equal(result["website"].isnull(), expected["website"].isnull())
+
+
+def test_rollup_pick():
+    """
+    Each gap is filled with a valid donor of the deepest stratum with enough donors
+    """
+    records_df, variables = make_records()
+    impute_gaps = ImputeGaps(
+        variables=variables,
+        imputation_methods=IMPUTATION_METHODS,
+        index_key=ID_KEY,
+        seed=SET_SEED,
+        min_threshold=2,
+    )
+    result = impute_gaps.impute_gaps(records_df=records_df, group_by=["gk", "sbi"], drop_dimensions=True, rollup=True)
+
+    imputed = records_df["website"].isnull()
+    assert result["website"].notnull().all()
+    for (gk, sbi), stratum in result[imputed].groupby(["gk", "sbi"]):
+        donors = records_df.loc[(records_df["gk"] == gk) & (records_df["sbi"] == sbi), "website"].dropna()
+        if donors.size >= 2:
+            assert stratum["website"].isin(donors).all()
+
+
+def test_rollup_track_imputed_example():
+    """
+    Example of test_track_imputed with three rounds
+    """
+    records_df = pd.DataFrame(
+        [
+            [1, 1, "A", "10", 10],
+            [2, 1, "A", "10", 20],
+            [3, 1, "A", "10", 30],
+            [4, 1, "A", "10", 40],
+            [5, 1, "B", "10", 50],
+            [6, 1, "B", "10", 60],
+            [7, 1, "B", "10", 70],
+            [8, 1, "B", "10", 80],
+            [9, 1, "B", "10", 85],
+            [10, 1, "B", "10", None],
+            [11, 1, "B", "10", None],
+            [12, 1, "C", "10", None],
+            [13, 1, "C", "10", None],
+            [14, 1, "D", "20", None],
+            [15, 1, "D", "20", None],
+        ],
+        columns=["be_id", "internet", "sbi", "gk", "telewerkers"],
+    )
+    impute_gaps = ImputeGaps(
+        variables={"telewerkers": {"type": "float"}},
+        imputation_methods={"mean": ["float"]},
+        min_threshold=2,
+        index_key=ID_KEY,
+    )
+    new_records = impute_gaps.impute_gaps(
+        records_df=records_df, group_by=["gk", "sbi"], drop_dimensions=True, rollup=True
+    )
+
+    expected = pd.Series(
+        [float(10), 20, 30, 40, 50, 60, 70, 80, 85, 69, 69, 49.444444, 49.444444, 49.444444, 49.444444],
+        name="telewerkers",
+    )
+    pd.testing.assert_series_equal(new_records["telewerkers"], expected)
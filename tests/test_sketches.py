@@ -0,0 +1,151 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from imputegaps.chunked import impute_gaps_chunked
+from imputegaps.impute_gaps import ImputeGaps
+from imputegaps.sketches import level_quantiles, merge_sketches, sketch_quantiles
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - The median of a sketch is exact for small strata and within the rank error for large strata,
+#   also after merging the sketches of chunks.
+# - The medians of the coarser levels are merged from the finer sketches, including the donors of
+#   which a deeper key is missing.
+# - The approximate median of the rollup and chunked imputations equals the exact median for small
+#   strata and is close to it otherwise.
+# - Without rollup, the median stays exact and a warning tells that approximate does not apply,
+#   which is only given if a variable is imputed with the median.
+
+
+def rank_errors(values, codes, medians):
+    return np.array([np.mean(values[codes == code] < median) - 0.5 for code, median in enumerate(medians)])
+
+
+def test_exact_for_small_strata():
+    rng = np.random.default_rng(1)
+    values = rng.normal(size=300)
+    codes = rng.integers(0, 5, size=300)
+
+    medians, counts = sketch_quantiles(*merge_sketches(codes, values, np.ones(300), error=0.01), number_of_strata=6)
+
+    np.testing.assert_allclose(medians[:5], pd.Series(values).groupby(codes).median())
+    assert np.isnan(medians[5])
+    assert counts.tolist() == np.bincount(codes, minlength=6).tolist()
+
+
+@pytest.mark.parametrize("error", [0.01, 0.05])
+def test_rank_error(error):
+    rng = np.random.default_rng(2)
+    values = rng.lognormal(3, 1, size=100000)
+    codes = rng.integers(0, 20, size=100000)
+
+    sketches = merge_sketches(codes, values, np.ones(values.size), error=error)
+    chunk_sketches = [
+        merge_sketches(codes[start : start + 3000], values[start : start + 3000], np.ones(3000), error=error)
+        for start in range(0, values.size, 3000)
+    ]
+    merged = merge_sketches(*[np.concatenate(parts) for parts in zip(*chunk_sketches)], error=error)
+
+    assert sketches[0].size <= 20 * np.ceil(1 / error)
+    for codes_, means, weights in (sketches, merged):
+        medians, _ = sketch_quantiles(codes_, means, weights, number_of_strata=20)
+        assert np.abs(rank_errors(values, codes, medians)).max() <= error
+
+
+def test_level_quantiles():
+    values = np.array([1.0, 2.0, 3.0, 10.0, 20.0, 30.0, 40.0])
+    deep = np.array([0, 0, 1, 1, -1, 2, 2])
+    coarse = np.array([0, 0, 0, 0, 1, 1, 1])
+
+    medians = level_quantiles(values, [(deep, 3), (coarse, 2), (np.zeros(7, dtype=np.int64), 1)], np.ones(7, bool))
+
+    np.testing.assert_allclose(medians[0], [1.5, 6.5, 35.0])
+    np.testing.assert_allclose(medians[1], [2.5, 30.0])
+    np.testing.assert_allclose(medians[2], [10.0])
+
+
+def make_records(number_of_records=3000, seed=3):
+    rng = np.random.default_rng(seed)
+    sbi = rng.choice(list("ABCDEF"), size=number_of_records).astype(object)
+    sbi[rng.random(number_of_records) < 0.05] = None
+    values = rng.lognormal(3, 1, size=number_of_records)
+    values[rng.random(number_of_records) < 0.3] = np.nan
+    return pd.DataFrame(
+        {"be_id": np.arange(number_of_records), "gk": rng.choice(["10", "20"], size=number_of_records), "sbi": sbi}
+    ).assign(float0=values)
+
+
+def make_imputer(approximate=False, median_error=0.01):
+    return ImputeGaps(
+        index_key="be_id",
+        variables={"float0": {"type": "float"}},
+        imputation_methods={"median": ["float"]},
+        min_threshold=5,
+        approximate=approximate,
+        median_error=median_error,
+    )
+
+
+def impute_in_chunks(imputer, records_df):
+    chunks = impute_gaps_chunked(
+        imputer,
+        lambda: (records_df.iloc[start : start + 700].copy() for start in range(0, len(records_df), 700)),
+        group_by=["gk", "sbi"],
+        drop_dimensions=True,
+    )
+    return pd.concat(chunks).set_index("be_id")
+
+
+def test_approximate_equals_exact_for_small_strata():
+    records_df = make_records()
+    expected = make_imputer().impute_gaps(
+        records_df.set_index("be_id"), group_by=["gk", "sbi"], drop_dimensions=True, rollup=True
+    )
+
+    rollup = make_imputer(approximate=True, median_error=0.0002).impute_gaps(
+        records_df.set_index("be_id"), group_by=["gk", "sbi"], drop_dimensions=True, rollup=True
+    )
+    chunked = impute_in_chunks(make_imputer(approximate=True, median_error=0.0002), records_df)
+
+    pd.testing.assert_frame_equal(rollup, expected)
+    pd.testing.assert_frame_equal(chunked, expected)
+
+
+def test_approximate_median_is_close():
+    records_df = make_records()
+    expected = make_imputer().impute_gaps(
+        records_df.set_index("be_id"), group_by=["gk", "sbi"], drop_dimensions=True, rollup=True
+    )
+
+    rollup = make_imputer(approximate=True, median_error=0.02).impute_gaps(
+        records_df.set_index("be_id"), group_by=["gk", "sbi"], drop_dimensions=True, rollup=True
+    )
+    chunked = impute_in_chunks(make_imputer(approximate=True, median_error=0.02), records_df)
+
+    for result in (rollup, chunked):
+        pd.testing.assert_frame_equal(result.isnull(), expected.isnull())
+        np.testing.assert_allclose(result["float0"], expected["float0"], rtol=0.1)
+
+
+def test_approximate_without_rollup_is_exact(caplog):
+    records_df = make_records(number_of_records=300).set_index("be_id")
+    expected = make_imputer().impute_gaps(records_df, group_by=["gk", "sbi"], drop_dimensions=True)
+
+    with caplog.at_level(logging.WARNING, logger="imputegaps.impute_gaps"):
+        result = make_imputer(approximate=True).impute_gaps(records_df, group_by=["gk", "sbi"], drop_dimensions=True)
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert "only approximated with rollup" in caplog.text
+
+    caplog.clear()
+    imputer = make_imputer(approximate=True)
+    imputer.imputation_methods = {"mean": ["float"]}
+    with caplog.at_level(logging.WARNING, logger="imputegaps.impute_gaps"):
+        imputer.impute_gaps(records_df, group_by=["gk", "sbi"], drop_dimensions=True)
+    assert "only approximated with rollup" not in caplog.text
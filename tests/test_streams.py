@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+from imputegaps.kernels import fill_block, sample_donors
+from imputegaps.streams import StratumStreams, draw_uniforms, hash_uniforms, stratum_generator, stratum_hashes
+
+__author__ = "EMSK"
+__copyright__ = "EMSK"
+__license__ = "MIT"
+
+# This script contains the following tests:
+# - The uniform numbers of the hash only depend on the key and the salt.
+# - The hash of a stratum only depends on the values of its keys, not on their dtype or order.
+# - The draws of a stratum only depend on the seed, the variable, the key of the stratum and the
+#   rank of the recipient in its stratum, not on the stratum codes or the other records.
+# - A block of columns draws the same donors as the columns one by one.
+# - The generator of a stratum is reproducible and differs between strata and variables.
+
+
+def test_hash_uniforms():
+    uniforms = hash_uniforms(np.arange(10000), "6:float0")
+
+    assert ((uniforms >= 0) & (uniforms < 1)).all()
+    assert abs(uniforms.mean() - 0.5) < 0.01
+    np.testing.assert_array_equal(hash_uniforms(np.arange(5000, 10000), "6:float0"), uniforms[5000:])
+    assert not np.array_equal(hash_uniforms(np.arange(10000), "7:float0"), uniforms)
+
+
+def test_stratum_hashes():
+    gk = pd.Series(["10", "20", "10", "30"], dtype=object)
+    sbi = pd.Series(["A", "A", "B", "A"], dtype="category")
+
+    hashes = stratum_hashes([gk, sbi])
+
+    assert len(set(hashes.tolist())) == 4
+    np.testing.assert_array_equal(stratum_hashes([gk.astype("category"), sbi.astype(str)]), hashes)
+    np.testing.assert_array_equal(stratum_hashes([gk[::-1], sbi[::-1]]), hashes[::-1])
+    assert not np.array_equal(stratum_hashes([sbi, gk]), hashes)
+    np.testing.assert_array_equal(stratum_hashes([], size=3), np.zeros(3, dtype=np.uint64))
+
+
+def test_draws_only_depend_on_the_stratum():
+    rng = np.random.default_rng(3)
+    keys = rng.choice(list("ABCDE"), size=500)
+    recipients = np.flatnonzero(rng.random(500) < 0.3)
+    codes, _ = pd.factorize(keys)
+    streams = StratumStreams(4, ["float0"], stratum_hashes([keys]))
+
+    uniforms = draw_uniforms(streams, recipients, codes)
+
+    # other codes for the same strata and a subset of the records with all recipients of stratum A
+    other_codes, _ = pd.factorize(keys, sort=True)
+    np.testing.assert_array_equal(draw_uniforms(streams, recipients, other_codes), uniforms)
+    subset = np.flatnonzero(keys == "A")
+    subset_streams = StratumStreams(4, ["float0"], stratum_hashes([keys[subset]]))
+    subset_recipients = np.flatnonzero(np.isin(subset, recipients))
+    np.testing.assert_array_equal(
+        draw_uniforms(subset_streams, subset_recipients, np.zeros(subset.size, dtype=np.int64)),
+        uniforms[keys[recipients] == "A"],
+    )
+    assert not np.array_equal(
+        draw_uniforms(StratumStreams(5, ["float0"], streams.stratum_keys), recipients, codes), uniforms
+    )
+
+
+def test_block_draws_as_columns():
+    rng = np.random.default_rng(5)
+    values = np.round(rng.normal(size=(300, 4)), 2)
+    values[rng.random(values.shape) < 0.4] = np.nan
+    keys = rng.choice(["10", "20", "30"], size=300)
+    codes, _ = pd.factorize(keys)
+    col_names = [f"float{index}" for index in range(4)]
+    streams = StratumStreams(1, col_names, stratum_hashes([keys]))
+
+    result = fill_block(values, codes, how="pick", rng=streams)
+
+    for index, col_name in enumerate(col_names):
+        column = values[:, index]
+        recipient_positions, donor_positions = sample_donors(
+            codes, ~np.isnan(column), np.isnan(column), rng=StratumStreams(1, [col_name], streams.stratum_keys)
+        )
+        expected = column.copy()
+        expected[recipient_positions] = column[donor_positions]
+        np.testing.assert_array_equal(result[:, index], expected)
+
+
+def test_stratum_generator():
+    first = stratum_generator(2, "float0", ("10", "A")).random(5)
+
+    np.testing.assert_array_equal(stratum_generator(2, "float0", ("10", "A")).random(5), first)
+    assert not np.array_equal(stratum_generator(2, "float0", ("10", "B")).random(5), first)
+    assert not np.array_equal(stratum_generator(2, "float1", ("10", "A")).random(5), first)
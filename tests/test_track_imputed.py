@@ -111,7 +111,7 @@ def test_pick_met_bool():
     new_records = impute_gaps.impute_gaps(records_df=records_df, group_by=["gk", "sbi"], drop_dimensions=True)
 
     # Maak verwacht
-    expected = pd.Series([float(1), 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 1], copy=False, name="telewerkers")
+    expected = pd.Series([float(1), 1, 1, 1, 0, 0, 0, 0, 0, 0, 1, 1], copy=False, name="telewerkers")
 
     # Test uitvoeren
     pd.testing.assert_series_equal(new_records["telewerkers"], expected)